@@ -0,0 +1,130 @@
+# This file benchmarks saving and exporting the canvas.
+# A 4K canvas with strokes over a gradient is exported to every format three ways: the
+# old pipeline that encoded a PNG snapshot, decoded it and encoded the target format;
+# the split/paste pipeline that followed the tile store; and FileManager.export_canvas,
+# which wraps the pixels without copying them and encodes once. The direct export is then
+# run through export_pixels on its own to count its progress reports and the longest gap
+# between them, which bounds how long the progress bar stalls and a cancel takes.
+#
+# Usage: python benchmarks/bench_export.py [--size 3840 2160] [--repeat 3]
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import rasterizer  # noqa: E402
+from file_utils import SUPPORTED_EXPORT_FORMATS, ExportSettings, FileManager, export_pixels  # noqa: E402
+
+
+class Canvas:
+    """Just enough of the paint widget for FileManager: a get_pixels() copy"""
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+
+    def get_pixels(self):
+        return self.pixels.copy()
+
+
+def make_pixels(width, height):
+    pixels = rasterizer.new_canvas(width, height)
+    pixels[..., 0] = np.linspace(120, 255, width, dtype=np.uint8)[None, :]
+    pixels[..., 1] = np.linspace(255, 90, height, dtype=np.uint8)[:, None]
+    rng = np.random.default_rng(0)
+    for _ in range(40):
+        points = rng.uniform((0, 0), (width, height), (12, 2))
+        rasterizer.draw_pencil(pixels, points, tuple(rng.uniform(0, 1, 3)) + (0.8,), int(rng.integers(2, 12)))
+    pixels[:height // 8, :, 3] = 0  # A transparent strip, as an erased layer would leave
+    return pixels
+
+
+def flattened(image):
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.split()[3])
+    return background
+
+
+def save_as(image, path, settings):
+    """The per-format save calls export_canvas makes, on an already prepared image"""
+    dpi = (settings.dpi, settings.dpi)
+    if settings.format == 'PNG':
+        image.save(path, 'PNG', dpi=dpi, optimize=True)
+    elif settings.format == 'JPEG':
+        image.save(path, 'JPEG', quality=settings.quality, dpi=dpi, optimize=True)
+    elif settings.format == 'TIFF':
+        image.save(path, 'TIFF', resolution=settings.dpi, quality=settings.quality)
+    elif settings.format == 'PDF':
+        image.save(path, 'PDF', resolution=settings.dpi)
+    else:
+        image.save(path, settings.format)
+
+
+def export_paste(canvas, path, settings):
+    image = Image.fromarray(canvas.get_pixels())
+    if settings.format in ('JPEG', 'BMP', 'PDF'):
+        image = flattened(image)
+    save_as(image, path, settings)
+
+
+def export_round_trip(canvas, path, settings):
+    buffer = io.BytesIO()
+    Image.fromarray(canvas.get_pixels()).save(buffer, 'PNG')
+    buffer.seek(0)
+    image = Image.open(buffer)
+    image.load()
+    if settings.format in ('JPEG', 'BMP', 'PDF'):
+        image = flattened(image)
+    save_as(image, path, settings)
+
+
+def best_time(action, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        action()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def progress_gaps(canvas, path, settings):
+    """(reports, longest gap in seconds) of one export_pixels run"""
+    times = [time.perf_counter()]
+    export_pixels(canvas.get_pixels(), path, settings, lambda fraction: times.append(time.perf_counter()))
+    return len(times) - 1, max(b - a for a, b in zip(times, times[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, nargs=2, default=[3840, 2160])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    canvas = Canvas(make_pixels(*args.size))
+    print(f"Exporting a {args.size[0]}x{args.size[1]} canvas, best of {args.repeat}")
+    print(f"{'format':<8}{'round trip':>12}{'split/paste':>13}{'direct':>10}{'speedup':>10}"
+          f"{'reports':>9}{'longest gap':>13}")
+    with tempfile.TemporaryDirectory(prefix='paint-bench-') as directory:
+        path = os.path.join(directory, 'export')
+        for format in SUPPORTED_EXPORT_FORMATS:
+            settings = ExportSettings(format=format)
+            output = path + SUPPORTED_EXPORT_FORMATS[format]['extension']
+            times = [best_time(lambda: export(canvas, output, settings), args.repeat)
+                     for export in (export_round_trip, export_paste)]
+            with contextlib.redirect_stdout(io.StringIO()):  # export_canvas reports each save
+                times.append(best_time(lambda: FileManager.export_canvas(canvas, path, settings), args.repeat))
+            reports, gap = progress_gaps(canvas, path, settings)
+            print(f"{format:<8}" + ''.join(f"{t * 1000:>{w}.0f} ms" for t, w in zip(times, (9, 10, 7)))
+                  + f"{times[0] / times[2]:>9.2f}x{reports:>9}{gap * 1000:>10.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# This file benchmarks the fill preview as the tolerance slider moves over a 4K canvas.
+# Each slider tick is compared with recomputing the int64 color difference over the
+# whole image and labelling it, as a tolerance change cost before FillRegion, on a
+# drawing (few colors in long runs) and a photo-like image (smooth gradients with noise).
+#
+# Usage: python benchmarks/bench_fill_preview.py [--size 3840 2160] [--ticks 60]
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import scipy.ndimage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from fill_region import FillRegion  # noqa: E402
+
+FRAME = 1 / 60
+
+
+def make_drawing(width, height):
+    """White canvas with overlapping flat-colored boxes and a few gray outlines"""
+    rng = np.random.default_rng(0)
+    pixels = np.full((height, width, 4), 255, dtype=np.uint8)
+    for _ in range(200):
+        x, y = rng.integers(0, width), rng.integers(0, height)
+        w, h = rng.integers(20, width // 4), rng.integers(20, height // 4)
+        pixels[y:y + h, x:x + w, :3] = rng.integers(0, 256, 3)
+        pixels[y:y + h, x:x + 2, :3] = rng.integers(0, 80)
+    return pixels
+
+
+def make_photo(width, height):
+    """Diagonal color gradient with sensor-like noise"""
+    rng = np.random.default_rng(0)
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    base = np.stack(np.broadcast_arrays(xs * 200 + ys * 40, ys * 220 + 10, (xs + ys) * 100), axis=-1)
+    pixels[..., :3] = np.clip(base + rng.normal(0, 6, base.shape), 0, 255)
+    pixels[..., 3] = 255
+    return pixels
+
+
+def full_recompute(pixels, x, y, tolerance):
+    """A tolerance change done from scratch over the whole image"""
+    target = pixels[y, x, :3].astype(int)
+    mask = np.all(np.abs(pixels[:, :, :3].astype(int) - target) <= tolerance, axis=2)
+    labeled, _ = scipy.ndimage.label(mask)
+    return labeled == labeled[y, x]
+
+
+def slider_sweep(ticks):
+    """Tolerances a slider drag passes through: up, back down part way, and up again"""
+    up = np.linspace(0, 80, ticks // 2).astype(int)
+    return list(up) + list(up[::-2]) + list(up[::3])
+
+
+def run(name, pixels, x, y, ticks, baseline_ticks):
+    sweep = slider_sweep(ticks)
+    region = FillRegion(pixels, x, y)
+    start = time.perf_counter()
+    region.region(sweep[0])
+    first = time.perf_counter() - start
+    # PaintWidget prepares the region on the frame after the click
+    start = time.perf_counter()
+    region.prepare()
+    prepare = time.perf_counter() - start
+    rest = []
+    for tolerance in sweep[1:]:
+        start = time.perf_counter()
+        region.region(tolerance)
+        rest.append(time.perf_counter() - start)
+    baseline = []
+    for tolerance in sweep[1:baseline_ticks + 1]:
+        start = time.perf_counter()
+        full_recompute(pixels, x, y, tolerance)
+        baseline.append(time.perf_counter() - start)
+    path = 'level map' if region.levels is not None else f'labelled {region.labelled} regions'
+    print(f"{name} ({path}): click {first * 1000:.1f} ms, prepare {prepare * 1000:.0f} ms, then per tick "
+          f"median {statistics.median(rest) * 1000:.2f} ms, max {max(rest) * 1000:.1f} ms, "
+          f"{sum(t > FRAME for t in rest)} of {len(rest)} over a frame; "
+          f"full recompute median {statistics.median(baseline) * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, nargs=2, default=[3840, 2160])
+    parser.add_argument('--ticks', type=int, default=60)
+    parser.add_argument('--baseline-ticks', type=int, default=5)
+    args = parser.parse_args()
+    width, height = args.size
+    print(f"{width}x{height} canvas, seed in the middle")
+    for name, make in (('drawing', make_drawing), ('photo', make_photo)):
+        run(name, make(width, height), width // 2, height // 2, args.ticks, args.baseline_ticks)
+
+
+if __name__ == '__main__':
+    main()
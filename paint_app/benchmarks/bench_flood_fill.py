@@ -0,0 +1,78 @@
+# This file benchmarks the scanline flood fill against the previous scipy.ndimage.label
+# implementation on small, medium and whole-canvas fills.
+#
+# Usage: python benchmarks/bench_flood_fill.py [--size 8000] [--repeat 3]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import scipy.ndimage
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')  # modules/ imports kivy, keep it off our argv
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+from modules.bucketfill import find_fill_spans  # noqa: E402
+
+FILL_COLOR = np.array([0, 0, 255], dtype=np.uint8)
+
+
+def label_fill(pixel_data, x, y, target_color, fill_color, tolerance):
+    """The label-based flood fill FillTool used before the scanline engine"""
+    mask = np.all(np.abs(pixel_data[:, :, :3].astype(int) - target_color.astype(int)) <= tolerance, axis=2)
+    structure = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]], dtype=bool)
+    labeled, _ = scipy.ndimage.label(mask, structure=structure)
+    target_label = labeled[y, x]
+    if target_label == 0:
+        return
+    pixel_data[labeled == target_label, :3] = fill_color
+
+
+def scanline_fill(pixel_data, x, y, target_color, fill_color, tolerance):
+    for row, start, end in find_fill_spans(pixel_data, x, y, target_color, tolerance):
+        pixel_data[row, start:end, :3] = fill_color
+
+
+def make_canvas(size, box):
+    """White canvas with a black box outline enclosing a `box` x `box` hole in the middle"""
+    canvas = np.full((size, size, 4), 255, dtype=np.uint8)
+    if box:
+        top = (size - box) // 2 - 1
+        canvas[top, top:top + box + 2, :3] = 0
+        canvas[top + box + 1, top:top + box + 2, :3] = 0
+        canvas[top:top + box + 2, top, :3] = 0
+        canvas[top:top + box + 2, top + box + 1, :3] = 0
+    return canvas
+
+
+def time_fill(fill, canvas, repeat):
+    seed = canvas.shape[0] // 2
+    target = canvas[seed, seed, :3].copy()
+    best = float('inf')
+    for _ in range(repeat):
+        data = canvas.copy()
+        start = time.perf_counter()
+        fill(data, seed, seed, target, FILL_COLOR, 0)
+        best = min(best, time.perf_counter() - start)
+    return best, data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=4000, help='canvas width and height in pixels')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [('small (10x10)', 10), ('medium (500x500)', 500), ('whole canvas', 0)]
+    print(f"Flood fill on a {args.size}x{args.size} canvas (best of {args.repeat})")
+    print(f"{'case':<20}{'label (ms)':>12}{'scanline (ms)':>15}{'speedup':>10}")
+    for name, box in cases:
+        canvas = make_canvas(args.size, box)
+        label_time, label_result = time_fill(label_fill, canvas, args.repeat)
+        scan_time, scan_result = time_fill(scanline_fill, canvas, args.repeat)
+        assert np.array_equal(label_result, scan_result), f"results differ for {name}"
+        print(f"{name:<20}{label_time * 1000:>12.2f}{scan_time * 1000:>15.2f}{label_time / scan_time:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
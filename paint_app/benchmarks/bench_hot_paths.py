@@ -0,0 +1,184 @@
+# This file holds pytest microbenchmarks for the paths users feel while drawing: flood
+# fills, pencil and brush strokes fed through the widget's touch handlers, undo and redo
+# of every command type, loading images and exporting to each format. They run the real
+# PaintWidget on an offscreen window when there is no display. Timings are collected by
+# the `bench` fixture in conftest.py and written to JSON; the tests only check that each
+# operation did what it should.
+#
+# Usage: python -m pytest benchmarks/bench_hot_paths.py [--bench-json FILE] [--bench-compare OLD] [-k fill]
+import math
+import os
+import sys
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+if not os.environ.get('DISPLAY') and sys.platform.startswith('linux'):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')  # Headless GL context
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from kivy.core.window import Window  # noqa: E402,F401  (creates the GL context)
+from file_utils import ExportSettings, FileManager, SUPPORTED_EXPORT_FORMATS  # noqa: E402
+from modules.abstract_tool import BrushStyle, Tool  # noqa: E402
+from modules.bucketfill import FillTool  # noqa: E402
+from paint_widget import PaintWidget  # noqa: E402
+
+FILL_SIZES = [1024, 4096, 8192]
+STROKE_POINTS = [1000, 10000, 50000]
+IMAGE_SIZES = [(1024, 768), (3840, 2160), (7680, 4320)]
+CANVAS_SIZE = (1920, 1080)
+
+
+class Touch:
+    """The parts of a Kivy touch the widget reads"""
+
+    def __init__(self, x, y):
+        self.ud = {}
+        self.move(x, y)
+
+    def move(self, x, y):
+        self.x, self.y, self.pos = x, y, (x, y)
+
+
+def drag(widget, points):
+    touch = Touch(*points[0])
+    widget.on_touch_down(touch)
+    for x, y in points[1:]:
+        touch.move(x, y)
+        widget.on_touch_move(touch)
+    widget.on_touch_up(touch)
+
+
+def spiral(count, width, height):
+    """A stroke winding out from the middle of the canvas"""
+    radius = min(width, height) * 0.45
+    return [(width / 2 + math.cos(i * 0.02) * radius * i / count, height / 2 + math.sin(i * 0.02) * radius * i / count)
+            for i in range(count)]
+
+
+def make_image(path, width, height):
+    ramp = Image.linear_gradient('L').resize((width, height))
+    mandel = Image.effect_mandelbrot((width, height), (-2, -1.2, 1, 1.2), 32)
+    Image.merge('RGB', (ramp, mandel, ramp.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(path, compress_level=1)
+    return path
+
+
+@pytest.fixture(scope='module')
+def images(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('images')
+    return {size: str(make_image(directory / f'{size[0]}x{size[1]}.png', *size)) for size in IMAGE_SIZES}
+
+
+def new_widget(size=CANVAS_SIZE):
+    return PaintWidget(size=size, pos=(0, 0))
+
+
+@pytest.mark.parametrize('size', FILL_SIZES)
+def test_flood_fill(bench, size):
+    # A white canvas with a box outline; the fill covers everything outside the box
+    base = np.full((size, size, 4), 255, dtype=np.uint8)
+    quarter = size // 4
+    base[quarter, quarter:3 * quarter, :3] = 0
+    base[3 * quarter, quarter:3 * quarter, :3] = 0
+    base[quarter:3 * quarter + 1, quarter, :3] = 0
+    base[quarter:3 * quarter + 1, 3 * quarter, :3] = 0
+    pixels = np.empty_like(base)
+    tool = FillTool(None, (0, 0, 1, 1), 1)
+    spans = []
+
+    def fill():
+        spans[:] = tool.flood_fill(pixels, 0, 0, base[0, 0, :3], np.array([0, 0, 255], dtype=np.uint8), 0)
+
+    bench('flood_fill', fill, setup=lambda: np.copyto(pixels, base), rounds=3, size=size)
+    filled = sum(end - start for _, start, end in spans)
+    assert filled == size * size - (2 * quarter + 1) ** 2
+
+
+@pytest.mark.parametrize('points', STROKE_POINTS)
+@pytest.mark.parametrize('tool', ['pencil', 'brush'])
+def test_stroke_ingestion(bench, tool, points):
+    widget = new_widget((1024, 1024))
+    widget.set_tool(Tool.PENCIL if tool == 'pencil' else Tool.BRUSH)
+    widget.tool_manager.set_brush_style(BrushStyle.ROUND)
+    stroke = spiral(points, 1024, 1024)
+    bench(f'{tool}_stroke', lambda: drag(widget, stroke), setup=widget.clear_undo_history, rounds=3, points=points)
+    assert len(widget.undo_stack) == 1
+
+
+def _pencil(widget):
+    widget.set_tool(Tool.PENCIL)
+    drag(widget, spiral(500, *CANVAS_SIZE))
+
+
+def _brush(widget):
+    widget.set_tool(Tool.BRUSH)
+    widget.set_line_width(12)
+    drag(widget, spiral(500, *CANVAS_SIZE))
+
+
+def _rectangle(widget):
+    widget.set_tool(Tool.RECTANGLE)
+    drag(widget, [(200, 200), (900, 700)])
+    widget.confirm_current_shape()
+
+
+def _fill(widget):
+    widget.set_tool(Tool.FILL)
+    widget.set_color((1, 0, 0, 1))
+    drag(widget, [(5, 5)])
+
+
+@pytest.fixture(scope='module')
+def photo(tmp_path_factory):
+    return str(make_image(tmp_path_factory.mktemp('photo') / 'photo.png', *CANVAS_SIZE))
+
+
+@pytest.mark.parametrize('command', ['pencil', 'brush', 'rectangle', 'fill', 'image'])
+def test_undo_redo(bench, photo, command):
+    widget = new_widget()
+    if command == 'image':
+        assert widget.load_image(photo)
+    else:
+        {'pencil': _pencil, 'brush': _brush, 'rectangle': _rectangle, 'fill': _fill}[command](widget)
+    assert len(widget.undo_stack) == 1
+    name = type(widget.undo_stack[-1]).__name__
+
+    def ensure_done():
+        if not widget.undo_stack:
+            widget.redo()
+
+    def ensure_undone():
+        if not widget.redo_stack:
+            widget.undo()
+
+    bench('undo', widget.undo, setup=ensure_done, command=command, type=name)
+    bench('redo', widget.redo, setup=ensure_undone, command=command, type=name)
+    assert len(widget.undo_stack) == 1
+
+
+@pytest.mark.parametrize('size', IMAGE_SIZES, ids=lambda size: f'{size[0]}x{size[1]}')
+def test_load_image(bench, images, size):
+    widget = new_widget()
+    loaded = []
+    bench('load_image', lambda: loaded.append(widget.load_image(images[size])), setup=widget.clear_canvas,
+          rounds=3, size=f'{size[0]}x{size[1]}')
+    assert all(loaded) and (widget.layers.width, widget.layers.height) == size
+
+
+@pytest.fixture(scope='module')
+def export_widget(images):
+    widget = new_widget()
+    assert widget.load_image(images[(3840, 2160)])
+    return widget
+
+
+@pytest.mark.parametrize('format', list(SUPPORTED_EXPORT_FORMATS))
+def test_export_canvas(bench, export_widget, tmp_path, format):
+    settings = ExportSettings(format=format, quality=90, transparency=True)
+    path = str(tmp_path / 'export')
+    results = []
+    bench('export_canvas', lambda: results.append(FileManager.export_canvas(export_widget, path, settings)),
+          rounds=3, format=format, size='3840x2160')
+    assert all(results) and os.path.getsize(path + SUPPORTED_EXPORT_FORMATS[format]['extension']) > 0
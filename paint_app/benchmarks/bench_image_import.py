@@ -0,0 +1,115 @@
+# This file benchmarks the peak memory of opening very large images.
+# A synthetic image (400 megapixels by default) is written as a PNG and a deflate TIFF,
+# then each file is opened in a fresh process, once through the strip-by-strip decode
+# into a TileStore and once the old way (decode the whole image, then copy it into the
+# tiles). Each run reports its time, its peak RSS and how many decoded RGBA copies'
+# worth of memory the decode took on top of the interpreter's own. The old path needs
+# several copies at once, so it runs on a smaller image by default to stay inside memory.
+#
+# Usage: python benchmarks/bench_image_import.py [--megapixels 400] [--whole-megapixels 64]
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from PIL import Image  # noqa: E402
+
+from image_loader import decode_image, decode_tiles  # noqa: E402
+from raster_store import TileStore  # noqa: E402
+
+MIB = 1024 * 1024
+
+
+def peak_rss():
+    """Peak resident set size of this process, in bytes"""
+    try:
+        # Linux carries ru_maxrss over from the parent across exec, so read the high-water mark instead
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def write_images(directory, megapixels):
+    """Write a square synthetic photo-like image as PNG and TIFF; returns their paths"""
+    side = int(math.sqrt(megapixels * 1e6))
+    ramp = Image.linear_gradient('L').resize((side, side))
+    image = Image.merge('RGB', (ramp, ramp.transpose(Image.Transpose.ROTATE_90), Image.effect_noise((side, side), 24)))
+    del ramp
+    paths = []
+    for name, params in (('image.png', {'compress_level': 1}), ('image.tif', {'compression': 'tiff_deflate'})):
+        path = os.path.join(directory, name)
+        image.save(path, **params)
+        paths.append(path)
+    return paths
+
+
+def measure(method, path):
+    """Open one image in this process and print its timing and peak memory as JSON"""
+    start_rss = peak_rss()
+    start = time.perf_counter()
+    if method == 'tiles':
+        raster = decode_tiles(path)
+    else:
+        pixels = decode_image(path)
+        raster = TileStore(pixels.shape[1], pixels.shape[0])
+        raster.load_array(pixels)
+    print(json.dumps({'seconds': time.perf_counter() - start, 'start_rss': start_rss, 'peak_rss': peak_rss(),
+                      'decoded': raster.width * raster.height * 4}))
+
+
+def run(method, path):
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', method, path],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def report(label, result):
+    if result is None:
+        print(f"{label:<28} failed (out of memory?)")
+        return
+    print(f"{label:<28} {result['seconds']:7.1f} s   peak {result['peak_rss'] / MIB:8.0f} MiB"
+          f"   (startup {result['start_rss'] / MIB:.0f} MiB)"
+          f"   decode used {(result['peak_rss'] - result['start_rss']) / result['decoded']:.2f}x the decoded size")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megapixels', type=float, default=400)
+    parser.add_argument('--whole-megapixels', type=float, default=64,
+                        help='image size for the old whole-image path')
+    parser.add_argument('--measure', nargs=2, metavar=('METHOD', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure)
+        return
+
+    Image.MAX_IMAGE_PIXELS = None
+    with tempfile.TemporaryDirectory(prefix='paint-bench-') as directory:
+        for megapixels, methods in ((args.whole_megapixels, ('whole', 'tiles')), (args.megapixels, ('tiles',))):
+            sub = os.path.join(directory, f'{megapixels:g}')
+            os.mkdir(sub)
+            start = time.perf_counter()
+            paths = write_images(sub, megapixels)
+            sizes = ', '.join(f"{os.path.basename(p)} {os.path.getsize(p) / MIB:.0f} MiB" for p in paths)
+            print(f"{megapixels:g} MP images written in {time.perf_counter() - start:.0f} s ({sizes})")
+            for path in paths:
+                for method in methods:
+                    report(f"  {os.path.basename(path)} {method}", run(method, path))
+
+
+if __name__ == '__main__':
+    main()
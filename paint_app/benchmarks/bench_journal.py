@@ -0,0 +1,100 @@
+# This file benchmarks the crash-recovery journal over a simulated drawing session.
+# Strokes, shapes and fills are committed and journaled the way the canvas does it,
+# with a checkpoint whenever one is due. It reports how long append() and checkpoint()
+# hold up the UI thread, how long the writer thread takes to catch up, and how long
+# recover() takes after a crash: once with the usual checkpoints, and once from a
+# single checkpoint at the start, replaying every record.
+#
+# Usage: python benchmarks/bench_journal.py [--commands 10000] [--size 1920 1080]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np  # noqa: E402
+
+import journal  # noqa: E402
+from document import Document, RecordKind  # noqa: E402
+from layers import LayerStack  # noqa: E402
+
+
+def make_records(document, count, width, height, rng):
+    records = []
+    for i in range(count):
+        color = tuple(rng.integers(0, 8, 3) / 7) + (1.0,)
+        if i % 50 == 49:
+            records.append(document.fill(*rng.uniform((0, 0), (width, height)), color, 16))
+        elif i % 10 == 9:
+            geometry = tuple(rng.uniform((0, 0, 0, 0), (width, height, width, height)))
+            records.append(document.shape(RecordKind.RECTANGLE, geometry, color, 2))
+        else:
+            start = rng.uniform((0, 0), (width, height))
+            points = start + np.cumsum(rng.normal(0, 6, (int(rng.integers(10, 60)), 2)), axis=0)
+            records.append(document.stroke(RecordKind.PENCIL, points, color, int(rng.integers(1, 8))))
+    return records
+
+
+def simulate(directory, count, width, height, checkpoints):
+    """Commit and journal a session, leaving it behind as a crash would; returns timings"""
+    layers = LayerStack(width, height)
+    document = Document(width, height)
+    records = make_records(document, count, width, height, np.random.default_rng(0))
+    pixels = layers.active.raster.to_array()
+    session = journal.Journal(directory)
+    session.start(layers, document)
+    appends, checkpoint_times = [], []
+    for record in records:
+        # The canvas checks for a due checkpoint between commands, on a clock tick
+        if checkpoints and session.checkpoint_due:
+            layers.active.raster.write_region(0, 0, pixels)
+            start = time.perf_counter()
+            session.checkpoint(layers, document)
+            checkpoint_times.append(time.perf_counter() - start)
+        record.layer = layers.active.id
+        document.render_record(pixels, record)
+        document.add(record)
+        start = time.perf_counter()
+        session.append(record, document)
+        appends.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    session.close(discard_session=False)
+    drain = time.perf_counter() - start
+    return pixels, np.array(appends), np.array(checkpoint_times), drain, session
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--commands', type=int, default=10000)
+    parser.add_argument('--size', type=int, nargs=2, default=[1920, 1080])
+    args = parser.parse_args()
+    width, height = args.size
+
+    print(f"Journaling {args.commands} commands on a {width}x{height} canvas")
+    for label, checkpoints in (('checkpoints', True), ('no checkpoints', False)):
+        with tempfile.TemporaryDirectory(prefix='paint-bench-') as directory:
+            pixels, appends, checkpoint_times, drain, session = simulate(
+                directory, args.commands, width, height, checkpoints)
+            size = sum(os.path.getsize(os.path.join(directory, name))
+                       for name in (journal.JOURNAL_NAME, journal.CHECKPOINT_NAME))
+            start = time.perf_counter()
+            layers, document, replayed = journal.recover(directory)
+            recovery = time.perf_counter() - start
+            assert len(document.records) == args.commands and session.error is None
+            assert np.array_equal(layers.active.raster.to_array(), pixels)
+
+        print(f"{label}:")
+        print(f"  append      p50 {np.percentile(appends, 50) * 1e6:.0f} us, p99 {np.percentile(appends, 99) * 1e6:.0f} us,"
+              f" max {appends.max() * 1e3:.2f} ms")
+        if len(checkpoint_times):
+            print(f"  checkpoint  {len(checkpoint_times)} taken, p50 {np.percentile(checkpoint_times, 50) * 1e3:.2f} ms,"
+                  f" max {checkpoint_times.max() * 1e3:.2f} ms")
+        print(f"  writer caught up {drain * 1e3:.0f} ms after the last command; {size / 1024:.0f} KB on disk")
+        print(f"  recovery    {recovery * 1e3:.0f} ms, replaying {replayed} records")
+
+
+if __name__ == '__main__':
+    main()
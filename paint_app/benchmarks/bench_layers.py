@@ -0,0 +1,89 @@
+# This file benchmarks drawing with many layers. For each layer count it measures the
+# cost of a frame (drawing the canvas into a window-sized target) and of committing a
+# stroke on the active layer, comparing the cached compositor against drawing every
+# layer's tiles each frame.
+#
+# Usage: python benchmarks/bench_layers.py [--layers 1 20] [--size 1920 1080]
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+if not os.environ.get('DISPLAY') and sys.platform.startswith('linux'):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')  # Headless GL context
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from kivy.core.window import Window  # noqa: E402,F401  (creates the GL context)
+from kivy.graphics import Color, Fbo, InstructionGroup, Line, Rectangle  # noqa: E402
+from kivy.graphics.opengl import glFinish  # noqa: E402
+from paint_widget import PaintWidget  # noqa: E402
+
+
+def build(count, size):
+    widget = PaintWidget(size=size, pos=(0, 0))
+    for _ in range(count - 1):
+        widget.add_layer()
+    widget.set_active_layer(count // 2)
+    return widget
+
+
+def naive_group(widget):
+    """Every visible layer's tiles drawn straight from their textures, as without the caches"""
+    compositor = widget.compositor
+    group = InstructionGroup()
+    for layer in widget.layers.layers:
+        group.add(Color(1, 1, 1, layer.opacity))
+        for row, col in compositor._shown:
+            x, top, width, height = compositor.bounds(row, col)
+            group.add(Rectangle(texture=compositor._texture(layer, row, col),
+                                pos=(x, widget.layers.height - top - height), size=(width, height)))
+    return group
+
+
+def frame_time(group, size, frames):
+    target = Fbo(size=size)
+    target.add(group)
+    target.draw()
+    glFinish()
+    start = time.perf_counter()
+    for _ in range(frames):
+        target.ask_update()  # Otherwise an unchanged Fbo skips drawing
+        target.draw()
+    glFinish()  # Draw calls return before the GPU is done
+    return (time.perf_counter() - start) / frames
+
+
+def stroke_time(widget, strokes):
+    start = time.perf_counter()
+    for i in range(strokes):
+        with widget.canvas:
+            Color(0, 0, 0, 1)
+            Line(points=[50 + i, 50, 400 + i, 300], width=3)
+        widget.commit_live_instructions()
+    return (time.perf_counter() - start) / strokes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--layers', type=int, nargs='+', default=[1, 20])
+    parser.add_argument('--size', type=int, nargs=2, default=[1920, 1080])
+    parser.add_argument('--frames', type=int, default=20)
+    parser.add_argument('--strokes', type=int, default=50)
+    args = parser.parse_args()
+    size = tuple(args.size)
+
+    print(f"{size[0]}x{size[1]} canvas, {args.frames} frames, {args.strokes} strokes")
+    print(f"{'layers':<8}{'naive frame':>14}{'cached frame':>14}{'stroke commit':>15}{'recomposites':>14}")
+    for count in args.layers:
+        widget = build(count, size)
+        naive = frame_time(naive_group(widget), size, args.frames)
+        cached = frame_time(widget.compositor.group, size, args.frames)
+        before = widget.compositor.recomposites
+        commit = stroke_time(widget, args.strokes)
+        print(f"{count:<8}{naive * 1000:>11.2f} ms{cached * 1000:>11.2f} ms{commit * 1000:>12.2f} ms"
+              f"{widget.compositor.recomposites - before:>14}")
+
+
+if __name__ == '__main__':
+    main()
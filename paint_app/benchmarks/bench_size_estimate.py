@@ -0,0 +1,101 @@
+# This file benchmarks the export size estimator against real exports.
+# Three kinds of canvas are exported to every format (and JPEG at several qualities):
+# gradient with strokes, a noisy photo-like image and a mostly white sketch. Each row
+# reports the real file size and how long the export took, then the estimate, its error
+# and how long it took: once encoding the samples (as a new format or quality does) and
+# once from the cache. Reading the samples, done once per canvas version, is reported
+# on its own line.
+#
+# Usage: python benchmarks/bench_size_estimate.py [--size 3840 2160]
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import rasterizer  # noqa: E402
+from file_utils import ExportSettings, export_pixels  # noqa: E402
+from size_estimator import SizeEstimator  # noqa: E402
+
+CASES = [('PNG', 90, True), ('PNG', 90, False), ('JPEG', 50, False), ('JPEG', 75, False), ('JPEG', 90, False),
+         ('JPEG', 100, False), ('BMP', 90, False), ('TIFF', 90, True), ('PDF', 90, False)]
+
+
+def strokes(width, height, rng):
+    pixels = rasterizer.new_canvas(width, height)
+    pixels[..., 0] = np.linspace(120, 255, width, dtype=np.uint8)[None, :]
+    pixels[..., 1] = np.linspace(255, 90, height, dtype=np.uint8)[:, None]
+    for _ in range(40):
+        points = rng.uniform((0, 0), (width, height), (12, 2))
+        rasterizer.draw_pencil(pixels, points, tuple(rng.uniform(0, 1, 3)) + (0.8,), int(rng.integers(2, 12)))
+    pixels[:height // 8, :, 3] = 0
+    return pixels
+
+
+def photo(width, height, rng):
+    ramp = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 24)
+    mandel = Image.effect_mandelbrot((width, height), (-2, -1.2, 1, 1.2), 64)
+    return np.asarray(Image.merge('RGBA', (ramp, mandel, noise, Image.new('L', (width, height), 255)))).copy()
+
+
+def sketch(width, height, rng):
+    pixels = rasterizer.new_canvas(width, height)
+    for _ in range(12):
+        points = rng.uniform((width * 0.2, height * 0.2), (width * 0.8, height * 0.8), (8, 2))
+        rasterizer.draw_pencil(pixels, points, (0, 0, 0, 1), 3)
+    return pixels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, nargs=2, default=[3840, 2160])
+    args = parser.parse_args()
+    width, height = args.size
+    rng = np.random.default_rng(0)
+
+    print(f"Estimating {width}x{height} exports")
+    print(f"{'canvas':<9}{'format':<7}{'q':>4}{'real':>11}{'export':>10}{'estimate':>11}{'error':>8}"
+          f"{'encode':>10}{'cached':>10}")
+    errors = []
+    with tempfile.TemporaryDirectory(prefix='paint-bench-') as directory:
+        for version, make in enumerate((strokes, photo, sketch)):
+            pixels = make(width, height, rng)
+            estimator = SizeEstimator()
+
+            def read_region(x, y, w, h):
+                return pixels[y:y + h, x:x + w].copy()
+
+            start = time.perf_counter()
+            estimator.estimate(version, width, height, read_region, 'BMP')
+            print(f"{make.__name__:<9}samples read in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+            for format, quality, transparency in CASES:
+                settings = ExportSettings(format=format, quality=quality, transparency=transparency)
+                start = time.perf_counter()
+                path = export_pixels(pixels.copy(), os.path.join(directory, 'out'), settings)
+                export_time = time.perf_counter() - start
+                real = os.path.getsize(path)
+
+                start = time.perf_counter()
+                estimate = estimator.estimate(version, width, height, read_region, format, quality, transparency)
+                encode = time.perf_counter() - start
+                start = time.perf_counter()
+                estimator.estimate(version, width, height, read_region, format, quality, transparency)
+                cached = time.perf_counter() - start
+                error = (estimate - real) / real
+                errors.append(abs(error))
+                print(f"{make.__name__:<9}{format:<7}{quality if format == 'JPEG' else '':>4}"
+                      f"{real / 1024:>8.0f} KB{export_time * 1000:>7.0f} ms{estimate / 1024:>8.0f} KB"
+                      f"{error * 100:>7.1f}%{encode * 1000:>7.1f} ms{cached * 1e6:>7.0f} us")
+    print(f"Mean absolute error {np.mean(errors) * 100:.1f}%, worst {np.max(errors) * 100:.1f}%")
+
+
+if __name__ == '__main__':
+    main()
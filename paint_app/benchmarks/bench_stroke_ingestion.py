@@ -0,0 +1,74 @@
+# This file benchmarks free-hand stroke ingestion: appending points to a pencil stroke
+# and drawing a frame after every move event, as the app does while the user drags.
+# It compares the old `line.points += [x, y]` approach with the chunked StrokeBuffer.
+#
+# Usage: python benchmarks/bench_stroke_ingestion.py [--points 20000]
+import argparse
+import math
+import os
+import sys
+import time
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+if not os.environ.get('DISPLAY') and sys.platform.startswith('linux'):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')  # Headless GL context
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from kivy.core.window import Window  # noqa: E402,F401  (creates the GL context)
+from kivy.graphics import Color, Fbo, Line  # noqa: E402
+from modules.stroke_buffer import StrokeBuffer  # noqa: E402
+
+
+def synthetic_stroke(count):
+    """A spiral wandering over a 1000x1000 area"""
+    return [(500 + math.cos(i * 0.01) * (50 + i * 0.02), 500 + math.sin(i * 0.01) * (50 + i * 0.02))
+            for i in range(count)]
+
+
+def run_line(fbo, points, frame_every):
+    with fbo:
+        Color(0, 0, 0, 1)
+        line = Line(points=list(points[0]), width=2)
+    for i, (x, y) in enumerate(points[1:], 1):
+        line.points += [x, y]
+        if i % frame_every == 0:
+            fbo.draw()
+    fbo.draw()
+
+
+def run_buffer(fbo, points, frame_every):
+    with fbo:
+        Color(0, 0, 0, 1)
+    stroke = StrokeBuffer(fbo, 2)
+    for i, (x, y) in enumerate(points):
+        stroke.append(x, y)
+        if i and i % frame_every == 0:
+            fbo.draw()
+    fbo.draw()
+
+
+def measure(run, points, frame_every):
+    fbo = Fbo(size=(64, 64))  # Small target so fill rate does not hide tessellation cost
+    start = time.perf_counter()
+    run(fbo, points, frame_every)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=20000)
+    parser.add_argument('--frame-every', type=int, default=1,
+                        help='draw a frame after this many move events')
+    args = parser.parse_args()
+
+    points = synthetic_stroke(args.points)
+    before = measure(run_line, points, args.frame_every)
+    after = measure(run_buffer, points, args.frame_every)
+    print(f"{args.points}-point stroke, frame every {args.frame_every} event(s)")
+    print(f"{'Line.points +=':<18}{before * 1000:>10.0f} ms  ({before / args.points * 1e6:.1f} us/event)")
+    print(f"{'StrokeBuffer':<18}{after * 1000:>10.0f} ms  ({after / args.points * 1e6:.1f} us/event)")
+    print(f"speedup {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# This file benchmarks viewing a very large image through the zoom/pan viewport.
+# It measures the zoomed-out first view (mip tiles built and uploaded), returning to
+# that view from the cache, and panning at 100% zoom, and reports how many tile bytes
+# reach the GPU compared with uploading the whole image as one texture.
+#
+# Usage: python benchmarks/bench_viewport.py [--size 16384] [--view 1200 800]
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+if not os.environ.get('DISPLAY') and sys.platform.startswith('linux'):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')  # Headless GL context
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np  # noqa: E402
+from kivy.core.window import Window  # noqa: E402,F401  (creates the GL context)
+from kivy.graphics.opengl import glFinish  # noqa: E402
+from layers import Layer, LayerStack  # noqa: E402
+from paint_widget import PaintWidget  # noqa: E402
+from raster_store import TileStore  # noqa: E402
+
+
+def make_raster(size):
+    """A size x size tile store with a different color in every tile"""
+    raster = TileStore(size, size)
+    tile_size = raster.tile_size
+    ramp = np.linspace(0, 255, tile_size, dtype=np.uint8)
+    for row in range(size // tile_size):
+        for col in range(size // tile_size):
+            tile = np.empty((tile_size, tile_size, 4), dtype=np.uint8)
+            tile[..., 0] = ramp[None, :]
+            tile[..., 1] = (row * 7) % 256
+            tile[..., 2] = (col * 13) % 256
+            tile[..., 3] = 255
+            raster.write_region(col * tile_size, row * tile_size, tile)
+    return raster
+
+
+def timed(action):
+    start = time.perf_counter()
+    action()
+    glFinish()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=16384)
+    parser.add_argument('--view', type=int, nargs=2, default=[1200, 800])
+    parser.add_argument('--pans', type=int, default=20)
+    args = parser.parse_args()
+
+    raster = make_raster(args.size)
+    widget = PaintWidget(size=tuple(args.view), pos=(0, 0))
+    widget._set_layers(LayerStack(args.size, args.size, [Layer(0, 'Background', raster)]))
+    widget.canvas_follows_size = False
+    tile_bytes = raster.tile_size ** 2 * 4
+
+    fit = timed(widget.fit_to_window)
+    print(f"{args.size}x{args.size} image in a {args.view[0]}x{args.view[1]} view")
+    print(f"fit to window (level {widget._view_level}): {fit * 1000:.0f} ms, "
+          f"{widget.tile_view.uploads} tiles / {widget.tile_view.uploads * tile_bytes / 2**20:.2f} MiB uploaded "
+          f"(whole image {args.size ** 2 * 4 / 2**20:.0f} MiB)")
+
+    widget.actual_size()
+    uploads = widget.tile_view.uploads
+    again = timed(widget.fit_to_window)
+    print(f"back to fit from cache: {again * 1000:.1f} ms, {widget.tile_view.uploads - uploads} tiles uploaded")
+
+    widget.actual_size()
+    start = widget.compositor.uploads
+    pan = sum(timed(lambda: widget.pan(-100, 0)) for _ in range(args.pans))
+    print(f"100% zoom, {args.pans} pans of 100 px: {pan / args.pans * 1000:.1f} ms each, "
+          f"{(widget.compositor.uploads - start) / args.pans:.1f} tiles uploaded per pan")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# This file provides the `bench` fixture for the pytest microbenchmarks in this directory.
+# A benchmark times a callable over a few rounds, running its setup untimed before each
+# one, and every result is written to a JSON file at the end of the run so runs can be
+# compared. Passing an earlier file with --bench-compare prints how each median moved.
+#
+# Usage: python -m pytest benchmarks/bench_hot_paths.py [--bench-json FILE] [--bench-compare OLD]
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import pytest
+
+_results = []
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--bench-json', default='bench-results.json', help='where to write the benchmark results')
+    group.addoption('--bench-compare', default=None, help='earlier results to compare the medians against')
+
+
+class Bench:
+    """Times callables and keeps the results for the JSON report"""
+
+    def __init__(self, test_name):
+        self.test_name = test_name
+
+    def __call__(self, name, func, setup=None, rounds=5, **params):
+        """Time func() over `rounds` rounds; returns the result dict.
+
+        `params` describe the case (canvas size, point count, ...) and are stored with it.
+        """
+        times = []
+        for _ in range(rounds):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        result = {'name': name, 'test': self.test_name, 'params': params, 'rounds': rounds,
+                  'min': min(times), 'median': statistics.median(times), 'mean': statistics.fmean(times),
+                  'max': max(times)}
+        _results.append(result)
+        return result
+
+
+@pytest.fixture
+def bench(request):
+    return Bench(request.node.name)
+
+
+def _key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def pytest_sessionfinish(session):
+    path = session.config.getoption('bench_json', default=None)
+    if not _results or path is None:
+        return
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'platform': platform.platform(), 'cpus': os.cpu_count(), 'argv': sys.argv[1:],
+              'unit': 'seconds', 'results': _results}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=1)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not _results:
+        return
+    previous = {}
+    compare = config.getoption('bench_compare', default=None)
+    if compare is not None:
+        with open(compare) as f:
+            previous = {_key(result): result for result in json.load(f)['results']}
+    terminalreporter.section('benchmarks')
+    for result in _results:
+        params = ' '.join(f"{key}={value}" for key, value in result['params'].items())
+        line = f"{result['name']:<22}{params:<36}{result['median'] * 1000:>10.2f} ms  (min {result['min'] * 1000:.2f})"
+        old = previous.get(_key(result))
+        if old is not None:
+            line += f"  {result['median'] / old['median']:.2f}x of before"
+        terminalreporter.write_line(line)
+    path = config.getoption('bench_json', default=None)
+    if path is not None:
+        terminalreporter.write_line(f"results written to {path}")
@@ -0,0 +1,113 @@
+# This file replays a recorded drawing session against the canvas and reports how long
+# the touch handlers took: latency percentiles for down, move and up events and for the
+# frames drawn between them, and how many canvas instructions the session left behind.
+# Sessions are recorded by running the app with PAINT_RECORD=session.jsonl, or made up
+# here with --synthetic: strokes of every tool at 120 events a second. The canvas runs
+# on an offscreen window when there is no display, drawing frames as the app would.
+#
+# Usage: python benchmarks/replay_session.py SESSION [--speed 1.0] [--frame-every 1] [--json REPORT]
+#        python benchmarks/replay_session.py SESSION --synthetic [--strokes 50]
+import argparse
+import json
+import math
+import os
+import sys
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+if not os.environ.get('DISPLAY') and sys.platform.startswith('linux'):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')  # Headless GL context
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np  # noqa: E402
+from kivy.config import Config  # noqa: E402
+
+Config.set('graphics', 'maxfps', '0')  # replay() paces the frames itself
+from kivy.base import EventLoop  # noqa: E402
+from kivy.core.window import Window  # noqa: E402  (creates the GL context)
+
+from input_recording import ReplayTouch, load_session, replay  # noqa: E402
+from modules.abstract_tool import BrushStyle, Tool  # noqa: E402
+from paint_widget import PaintWidget  # noqa: E402
+
+SYNTHETIC_SIZE = (1600, 1000)
+EVENT_INTERVAL = 1 / 120  # Seconds between synthetic events, a fast trackpad
+
+
+def record_synthetic(path, strokes):
+    """Draw a mix of strokes, shapes and fills on a widget, recording them to `path`"""
+    rng = np.random.default_rng(0)
+    width, height = SYNTHETIC_SIZE
+    widget = PaintWidget(size=SYNTHETIC_SIZE, pos=(0, 0))
+    widget.start_recording()
+    tools = [Tool.PENCIL] * 5 + [Tool.BRUSH] * 3 + [Tool.ERASER, Tool.LINE, Tool.RECTANGLE, Tool.CIRCLE, Tool.FILL]
+    for number in range(strokes):
+        widget.set_tool(tools[number % len(tools)])
+        widget.tool_manager.set_brush_style(BrushStyle.SQUARE if number % 7 == 0 else BrushStyle.ROUND)
+        widget.set_color(list(rng.uniform(0, 1, 3)) + [1.0])
+        widget.set_line_width(int(rng.integers(1, 20)))
+        x, y = rng.uniform((50, 50), (width - 50, height - 50))
+        if widget.tool_manager.current_tool == Tool.FILL:
+            points = [(x, y)]
+        else:
+            angle = rng.uniform(0, 2 * math.pi)
+            steps = np.arange(int(rng.integers(20, 400)))
+            points = np.stack([x + np.cos(angle + steps * 0.03) * steps, y + np.sin(angle + steps * 0.02) * steps], 1)
+            points = np.clip(points, 1, (width - 1, height - 1)).tolist()
+        touch = ReplayTouch(number % 3, *points[0])
+        widget.on_touch_down(touch)
+        for point in points[1:]:
+            touch.move(*point)
+            widget.on_touch_move(touch)
+        widget.on_touch_up(touch)
+    widget.confirm_current_shape()
+    # Space the events as live input would arrive, rather than as fast as they were made
+    for index, event in enumerate(widget.recorder.events):
+        event[0] = round(index * EVENT_INTERVAL, 6)
+    widget.stop_recording(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('session', help='recorded session (.jsonl)')
+    parser.add_argument('--synthetic', action='store_true', help='record a made-up session to SESSION first')
+    parser.add_argument('--strokes', type=int, default=50, help='strokes in a synthetic session')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='replay at this multiple of the recorded pace (default: as fast as possible)')
+    parser.add_argument('--frame-every', type=int, default=1,
+                        help='at full speed, draw a frame after this many events')
+    parser.add_argument('--json', help='also write the report here')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        record_synthetic(args.session, args.strokes)
+    header, events = load_session(args.session)
+    Window.size = header['size']
+    widget = PaintWidget(size=header['size'], pos=(0, 0), size_hint=(None, None))
+    if header['canvas'] != header['size']:
+        widget.canvas_follows_size = False
+        widget._resize_canvas(*header['canvas'])
+    # In the window, so every frame draws the canvas as the app would
+    Window.add_widget(widget)
+    EventLoop.ensure_window()
+
+    report = replay(widget, events, speed=args.speed, tick=EventLoop.idle, frame_every=args.frame_every)
+    report['session'] = args.session
+    report['speed'] = args.speed or 'max'
+
+    pace = f"{args.speed}x recorded pace" if args.speed else "full speed"
+    print(f"Replayed {report['events']} events from {args.session} at {pace} in {report['seconds']:.1f} s"
+          f" (recorded over {report['recorded_seconds']:.1f} s)")
+    print(f"{'event':<7}{'count':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}   ms")
+    for kind, latency in report['latency_ms'].items():
+        print(f"{kind:<7}{latency['count']:>7}{latency['p50']:>9.2f}{latency['p90']:>9.2f}"
+              f"{latency['p99']:>9.2f}{latency['max']:>9.2f}")
+    instructions = report['instructions']
+    print(f"canvas instructions: {instructions['start']} -> {instructions['end']}"
+          f" (peak {instructions['peak']}, growth {instructions['growth']:+d})")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# This file converts and exports images from the command line, without the GUI.
+# Each input image or .paintproj project is opened as the canvas would show it and
+# exported with the same ExportSettings and writers as File > Export, on a pool of
+# worker processes. Results are printed as each file finishes, with its throughput.
+# Nothing here imports Kivy or AppKit, so it runs without a display.
+#
+# Usage: python src/batch.py [--format JPEG] [--dpi 300] [--quality 90] [--no-transparency]
+#                            [--output-dir DIR] [--jobs N] [--overwrite] [--json] INPUT [INPUT ...]
+# INPUT is a file, a directory (every image in it) or a glob such as 'scans/**/*.tif'.
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from PIL import Image
+
+from file_utils import SUPPORTED_EXPORT_FORMATS, ExportSettings, export_pixels
+from image_loader import decode_image
+from project_file import EXTENSION as PROJECT_EXTENSION, ProjectFile
+
+IMAGE_EXTENSIONS = {ext for ext, format in Image.registered_extensions().items() if format in Image.OPEN}
+
+
+def find_inputs(patterns):
+    """Input files for the command line's paths, directories and globs, in order and without repeats"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(os.path.join(pattern, name) for name in os.listdir(pattern))
+        elif glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+        else:
+            matches = [pattern]
+        for path in matches:
+            if os.path.isdir(path):
+                continue
+            if pattern != path and os.path.splitext(path)[1].lower() not in IMAGE_EXTENSIONS | {PROJECT_EXTENSION}:
+                continue  # Only explicitly named files are tried whatever their extension
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def output_path(path, settings, output_dir=None):
+    """Where an input is exported to: its name with the format's extension, next to it or in output_dir"""
+    base = os.path.splitext(os.path.basename(path))[0]
+    directory = output_dir if output_dir is not None else os.path.dirname(path)
+    return os.path.join(directory, base + SUPPORTED_EXPORT_FORMATS[settings.format]['extension'])
+
+
+def read_pixels(path):
+    """RGBA pixels of an image or project file, as the canvas would show them"""
+    if path.lower().endswith(PROJECT_EXTENSION):
+        _, layers, _ = ProjectFile.open(path)
+        return layers.flatten()
+    return decode_image(path)
+
+
+def convert(path, settings, output_dir=None, overwrite=False):
+    """Export one file; returns a dict describing the result (run in the worker processes)"""
+    result = {'input': path, 'output': output_path(path, settings, output_dir), 'pixels': 0,
+              'seconds': 0.0, 'error': None, 'skipped': False}
+    start = time.perf_counter()
+    try:
+        if not overwrite and os.path.exists(result['output']):
+            result['skipped'] = True
+            return result
+        pixels = read_pixels(path)
+        result['pixels'] = pixels.shape[0] * pixels.shape[1]
+        export_pixels(pixels, result['output'], settings)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run(paths, settings, output_dir=None, jobs=None, overwrite=False):
+    """Convert files on a process pool, yielding each result as soon as it is ready.
+
+    Only a couple of files per worker are queued at a time, so a long list of inputs
+    neither holds up the first results nor piles up in memory.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    pending = iter(paths)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        running = set()
+        while True:
+            for path in pending:
+                running.add(pool.submit(convert, path, settings, output_dir, overwrite))
+                if len(running) >= jobs * 2:
+                    break
+            if not running:
+                return
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def describe(result):
+    if result['error'] is not None:
+        return f"FAILED {result['input']}: {result['error']}"
+    if result['skipped']:
+        return f"exists {result['output']} (use --overwrite to replace it)"
+    megapixels = result['pixels'] / 1e6
+    return (f"ok     {result['input']} -> {result['output']}  {megapixels:.1f} MP in {result['seconds']:.2f} s"
+            f" ({megapixels / max(result['seconds'], 1e-9):.1f} MP/s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert images and Paint projects with the app's export settings")
+    parser.add_argument('inputs', nargs='+', metavar='INPUT', help='files, directories or globs to convert')
+    parser.add_argument('--format', choices=list(SUPPORTED_EXPORT_FORMATS), default='PNG', type=str.upper)
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--quality', type=int, default=90, help='JPEG quality, 1-100')
+    parser.add_argument('--no-transparency', dest='transparency', action='store_false',
+                        help='flatten PNG output onto white')
+    parser.add_argument('-o', '--output-dir', help='write here instead of next to each input')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--overwrite', action='store_true', help='replace outputs that already exist')
+    parser.add_argument('--json', action='store_true', help='print one JSON object per file instead of text')
+    args = parser.parse_args(argv)
+
+    paths = find_inputs(args.inputs)
+    if not paths:
+        parser.error('no input files found')
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    settings = ExportSettings(format=args.format, dpi=args.dpi, quality=max(1, min(args.quality, 100)),
+                              transparency=args.transparency)
+
+    start = time.perf_counter()
+    converted = failed = pixels = 0
+    for result in run(paths, settings, args.output_dir, args.jobs, args.overwrite):
+        print(json.dumps(result) if args.json else describe(result), flush=True)
+        if result['error'] is not None:
+            failed += 1
+        elif not result['skipped']:
+            converted += 1
+            pixels += result['pixels']
+    elapsed = time.perf_counter() - start
+    if not args.json:
+        print(f"{converted} converted, {failed} failed, {len(paths) - converted - failed} skipped in {elapsed:.1f} s"
+              f" ({converted / elapsed:.1f} files/s, {pixels / 1e6 / elapsed:.1f} MP/s)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
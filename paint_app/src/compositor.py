@@ -0,0 +1,226 @@
+# This file composites the layer stack on the GPU at full size.
+# Every layer keeps one texture per tile, uploaded when the tile comes into view and
+# afterwards only updated where the layer changed. For each tile in view, the visible
+# layers below and above the active one are flattened into two tile-sized cached Fbos,
+# so a tile draws at most three quads however many layers there are, and drawing on the
+# active layer never touches the others. Visibility, opacity and order changes only
+# rebuild the cached composites from the tile textures. Nothing is canvas-sized: panning
+# uploads and composites only what is newly visible, and tile textures stay cached for
+# a while after they scroll out of view, as TileView does for the mip levels.
+from collections import OrderedDict
+
+import numpy as np
+from kivy.graphics import (Callback, ClearBuffers, ClearColor, Color, Fbo, InstructionGroup,
+                           Rectangle)
+from kivy.graphics.opengl import (GL_ONE, GL_ONE_MINUS_SRC_ALPHA, GL_SRC_ALPHA, GL_ZERO, glBlendFunc,
+                                  glBlendFuncSeparate)
+from kivy.graphics.texture import Texture
+
+import instrumentation
+
+TEXTURE_CACHE = 512  # Layer tile textures kept, including ones out of view
+
+
+def blend_premultiplied_output(instr):
+    # Accumulate alpha with the "over" operator, leaving premultiplied color in the target
+    glBlendFuncSeparate(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+
+
+def blend_premultiplied_input(instr):
+    # Draw a texture whose color is already premultiplied by its alpha
+    glBlendFunc(GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+
+
+def blend_erase(instr):
+    # Take the source alpha away from the target's alpha, as the eraser does on layers over
+    # the background. Color still goes over, so on screen the live stroke shows white until
+    # it is committed; fully erased pixels have no alpha left for their color to show
+    glBlendFuncSeparate(GL_ONE, GL_ONE_MINUS_SRC_ALPHA, GL_ZERO, GL_ONE_MINUS_SRC_ALPHA)
+
+
+def blend_default(instr):
+    glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+
+
+class _Tile:
+    """What the canvas draws for one tile in view, and the composites it draws from"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds  # (x, top, width, height) in image pixels
+        self.group = InstructionGroup()
+        self.rects = []
+        self.below = None  # Fbo of the layers under the active one
+        self.above = None  # Fbo of the layers over the active one
+
+
+class LayerCompositor:
+    """Keeps per-layer tile textures and per-tile below/above composites for a LayerStack"""
+
+    def __init__(self, stack):
+        self.stack = stack
+        self.group = InstructionGroup()  # What the canvas draws
+        self.pos = (0, 0)
+        self._below = []   # Visible layers under the active one, bottom first
+        self._above = []   # Visible layers over the active one
+        self._textures = OrderedDict()  # (layer id, row, col) -> Texture, least recently shown first
+        self._shown = {}                # (row, col) -> _Tile
+        self._size = None               # Canvas size the textures were uploaded at
+        self.recomposites = 0  # Cached tile composites redrawn, for tests and benchmarks
+        self.uploads = 0       # Tiles uploaded into layer textures
+
+    def bounds(self, row, col):
+        """(x, top, width, height) of a tile in image pixels"""
+        size = self.stack.layers[0].raster.tile_size
+        x, top = col * size, row * size
+        return x, top, min(size, self.stack.width - x), min(size, self.stack.height - top)
+
+    def _check_size(self):
+        # A resize changes the edge tiles of every layer, so start over
+        size = (self.stack.width, self.stack.height)
+        if size != self._size:
+            self._textures.clear()
+            self._hide(list(self._shown))
+            self._size = size
+
+    def drop(self, layer):
+        """Forget a layer's tile textures, e.g. after its pixels were replaced wholesale"""
+        for key in [key for key in self._textures if key[0] == layer.id]:
+            del self._textures[key]
+
+    def release(self):
+        """Drop the tile textures and composites, e.g. while a zoomed-out view draws from mip tiles"""
+        self._textures.clear()
+        self._hide(list(self._shown))
+        self.group.clear()
+
+    def _texture(self, layer, row, col):
+        key = (layer.id, row, col)
+        texture = self._textures.get(key)
+        if texture is None:
+            x, top, width, height = self.bounds(row, col)
+            texture = Texture.create(size=(width, height), colorfmt='rgba', bufferfmt='ubyte')
+            # Flip once so texture rows match image rows (row 0 at the top)
+            texture.flip_vertical()
+            self._blit(texture, 0, 0, layer.raster.read_region(x, top, width, height))
+            self._textures[key] = texture
+            self.uploads += 1
+        self._textures.move_to_end(key)
+        return texture
+
+    def _blit(self, texture, x, y, data):
+        height, width = data.shape[:2]
+        buffer = np.ascontiguousarray(data).reshape(-1)
+        if not buffer.flags.writeable:
+            buffer = buffer.copy()  # blit_buffer only accepts writable buffers
+        texture.blit_buffer(buffer, colorfmt='rgba', bufferfmt='ubyte', pos=(x, y), size=(width, height))
+        instrumentation.count('texture_upload_bytes', buffer.nbytes)
+
+    def _composite(self, layers, row, col):
+        size = self.bounds(row, col)[2:]
+        fbo = Fbo(size=size)
+        with fbo:
+            ClearColor(0, 0, 0, 0)
+            ClearBuffers()
+            Callback(blend_premultiplied_output)
+            for layer in layers:
+                Color(1, 1, 1, layer.opacity)
+                Rectangle(texture=self._texture(layer, row, col), pos=(0, 0), size=size)
+            Callback(blend_default)
+        fbo.draw()
+        self.recomposites += 1
+        return fbo
+
+    def _show(self, row, col):
+        tile = _Tile(self.bounds(row, col))
+        if self._below:
+            tile.below = self._composite(self._below, row, col)
+            self._add_premultiplied(tile, tile.below.texture)
+        active = self.stack.active
+        if active.visible:
+            tile.group.add(Color(1, 1, 1, active.opacity))
+            self._add_rect(tile, self._texture(active, row, col))
+        if self._above:
+            tile.above = self._composite(self._above, row, col)
+            self._add_premultiplied(tile, tile.above.texture)
+        self.group.add(tile.group)
+        self._shown[(row, col)] = tile
+
+    def _hide(self, keys):
+        for key in keys:
+            self.group.remove(self._shown.pop(key).group)
+
+    def show(self, tiles):
+        """Draw exactly the given (row, col) tiles, uploading only layer tiles not cached"""
+        self._check_size()
+        keys = set(tiles)
+        self._hide([key for key in self._shown if key not in keys])
+        for row, col in keys:
+            if (row, col) not in self._shown:
+                self._show(row, col)
+        # Evict the least recently shown layer tiles that are out of view
+        for key in list(self._textures):
+            if len(self._textures) <= TEXTURE_CACHE:
+                break
+            if key[1:] not in self._shown:
+                del self._textures[key]
+
+    def upload(self, layer, x, y, data):
+        """Copy an RGBA array into a layer's tile textures at image position (x, y)"""
+        size = self.stack.layers[0].raster.tile_size
+        height, width = data.shape[:2]
+        for row in range(y // size, (y + height - 1) // size + 1):
+            for col in range(x // size, (x + width - 1) // size + 1):
+                texture = self._textures.get((layer.id, row, col))
+                if texture is None:
+                    continue  # Read from the tile store when it comes into view
+                left, top = max(x, col * size), max(y, row * size)
+                right = min(x + width, (col + 1) * size)
+                bottom = min(y + height, (row + 1) * size)
+                self._blit(texture, left - col * size, top - row * size,
+                           data[top - y:bottom - y, left - x:right - x])
+                # The active layer is drawn straight from its tiles; others live in a cached composite
+                tile = self._shown.get((row, col))
+                if tile is None:
+                    continue
+                for fbo, layers in ((tile.below, self._below), (tile.above, self._above)):
+                    if fbo is not None and layer in layers:
+                        fbo.draw()
+                        self.recomposites += 1
+
+    def refresh(self):
+        """Rebuild the tile composites and canvas quads after any change to the stack itself"""
+        self._check_size()
+        ids = {layer.id for layer in self.stack.layers}
+        for key in [key for key in self._textures if key[0] not in ids]:
+            del self._textures[key]
+        layers = self.stack.layers
+        active_index = self.stack.active_index
+        self._below = [layer for layer in layers[:active_index] if layer.visible]
+        self._above = [layer for layer in layers[active_index + 1:] if layer.visible]
+        keys = list(self._shown)
+        self._hide(keys)
+        for row, col in keys:
+            self._show(row, col)
+
+    def _add_rect(self, tile, texture):
+        x, top, width, height = tile.bounds
+        rect = Rectangle(texture=texture, pos=self._rect_pos(tile), size=(width, height))
+        tile.group.add(rect)
+        tile.rects.append(rect)
+
+    def _add_premultiplied(self, tile, texture):
+        tile.group.add(Callback(blend_premultiplied_input))
+        tile.group.add(Color(1, 1, 1, 1))
+        self._add_rect(tile, texture)
+        tile.group.add(Callback(blend_default))
+
+    def _rect_pos(self, tile):
+        """Canvas position of a tile's quads; canvas y runs up from the image bottom"""
+        x, top, width, height = tile.bounds
+        return self.pos[0] + x, self.pos[1] + self.stack.height - top - height
+
+    def set_pos(self, pos):
+        self.pos = tuple(pos)
+        for tile in self._shown.values():
+            for rect in tile.rects:
+                rect.pos = self._rect_pos(tile)
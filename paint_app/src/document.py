@@ -0,0 +1,308 @@
+# This file defines the document model: a compact record of what was drawn.
+# Strokes, shapes and fills keep their geometry in packed float32 arrays and refer to
+# colors and line widths by palette index. Nothing here imports Kivy, so documents can
+# be built, rendered and tested in worker processes; Kivy instructions are derived on
+# demand by instructions().
+import zlib
+from enum import IntEnum
+
+import numpy as np
+
+import rasterizer
+from layers import flatten_arrays
+
+
+class RecordKind(IntEnum):
+    PENCIL = 0
+    BRUSH = 1
+    ERASER = 2
+    LINE = 3
+    RECTANGLE = 4
+    CIRCLE = 5
+    FILL = 6
+    IMAGE = 7
+
+
+class Stroke:
+    """Free-hand stroke: pencil/eraser polyline points or brush dab centres"""
+    __slots__ = ('kind', 'points', 'color', 'width', 'square', 'layer')
+
+    def __init__(self, kind, points, color, width, square=False):
+        self.kind = kind
+        self.points = np.array(points, dtype=np.float32).reshape(-1, 2)  # Own copy, never a view
+        self.color = color    # Index into Document.colors
+        self.width = width    # Index into Document.widths
+        self.square = square  # Square brush dabs instead of round ones
+        self.layer = 0        # Id of the layer the stroke was drawn on
+
+    @property
+    def nbytes(self):
+        return self.points.nbytes
+
+    def copy(self):
+        record = Stroke(self.kind, self.points, self.color, self.width, self.square)
+        record.layer = self.layer
+        return record
+
+    def translate(self, dx, dy):
+        self.points += (dx, dy)
+
+
+class Shape:
+    """Line (x1, y1, x2, y2), rectangle (x, y, w, h) or circle (cx, cy, r) outline"""
+    __slots__ = ('kind', 'geometry', 'color', 'width', 'layer')
+
+    def __init__(self, kind, geometry, color, width):
+        self.kind = kind
+        self.geometry = np.array(geometry, dtype=np.float32).reshape(-1)
+        self.color = color
+        self.width = width
+        self.layer = 0
+
+    @property
+    def nbytes(self):
+        return self.geometry.nbytes
+
+    def copy(self):
+        record = Shape(self.kind, self.geometry, self.color, self.width)
+        record.layer = self.layer
+        return record
+
+    def translate(self, dx, dy):
+        if self.kind == RecordKind.LINE:
+            self.geometry += (dx, dy, dx, dy)
+        else:
+            self.geometry[:2] += (dx, dy)
+
+
+class Fill:
+    """Bucket fill seeded at a canvas point"""
+    __slots__ = ('kind', 'x', 'y', 'color', 'tolerance', 'layer')
+
+    def __init__(self, x, y, color, tolerance=0):
+        self.kind = RecordKind.FILL
+        self.x = float(x)
+        self.y = float(y)
+        self.color = color
+        self.tolerance = tolerance
+        self.layer = 0
+
+    nbytes = 0
+
+    def copy(self):
+        record = Fill(self.x, self.y, self.color, self.tolerance)
+        record.layer = self.layer
+        return record
+
+    def translate(self, dx, dy):
+        self.x += dx
+        self.y += dy
+
+
+class ImageRecord:
+    """Opened image that replaces the whole canvas (and its size)"""
+    __slots__ = ('kind', 'pixels', 'layer', 'digests')
+
+    def __init__(self, pixels):
+        self.kind = RecordKind.IMAGE
+        self.pixels = pixels  # (height, width, 4) uint8, row 0 at the top
+        self.layer = 0
+        self.digests = None   # Digests of the pixels' tiles once saved, see project_file.image_tiles()
+
+    @property
+    def nbytes(self):
+        return self.pixels.nbytes
+
+    def copy(self):
+        return self  # Never changes once loaded; the digests are only ever filled in once
+
+    def translate(self, dx, dy):
+        pass
+
+
+class Document:
+    """Ordered drawing records plus the color and width palettes they index into"""
+
+    def __init__(self, width, height):
+        self.width = int(width)
+        self.height = int(height)
+        self.colors = []    # RGBA float tuples
+        self.widths = []    # Line widths
+        self._color_ids = {}
+        self._width_ids = {}
+        self.records = []
+        # (crc32, encoded length, record count) of each run of encoded records, see record_chunks()
+        self._chunks = []
+        self._chunk_size = 0
+        self._unchanged = 0  # Records before this index are as they were when _chunks was filled
+
+    def resize(self, width, height):
+        """Change the canvas size, keeping records anchored to the top-left like the tile store"""
+        width, height = int(width), int(height)
+        dy = height - self.height
+        if dy:
+            for record in self.records:
+                record.translate(0, dy)
+            self._unchanged = 0
+        self.width, self.height = width, height
+
+    def copy(self):
+        """A document holding copies of the records and palettes as they are now, e.g. to save on another thread"""
+        document = Document(self.width, self.height)
+        document.colors, document.widths = list(self.colors), list(self.widths)
+        document._color_ids, document._width_ids = dict(self._color_ids), dict(self._width_ids)
+        document.records = [record.copy() for record in self.records]
+        document._chunks, document._chunk_size = list(self._chunks), self._chunk_size
+        document._unchanged = self._unchanged
+        return document
+
+    def color_index(self, color):
+        color = tuple(float(c) for c in color)
+        if len(color) == 3:
+            color += (1.0,)
+        if color not in self._color_ids:
+            self._color_ids[color] = len(self.colors)
+            self.colors.append(color)
+        return self._color_ids[color]
+
+    def width_index(self, width):
+        width = float(width)
+        if width not in self._width_ids:
+            self._width_ids[width] = len(self.widths)
+            self.widths.append(width)
+        return self._width_ids[width]
+
+    # Record factories intern colors and widths into the palettes
+
+    def stroke(self, kind, points, color, width, square=False):
+        return Stroke(kind, points, self.color_index(color), self.width_index(width), square)
+
+    def shape(self, kind, geometry, color, width):
+        return Shape(kind, geometry, self.color_index(color), self.width_index(width))
+
+    def fill(self, x, y, color, tolerance=0):
+        return Fill(x, y, self.color_index(color), tolerance)
+
+    def add(self, record):
+        self.records.append(record)
+
+    def remove(self, record):
+        # Undo nearly always removes the newest record
+        if self.records and self.records[-1] is record:
+            self.records.pop()
+            index = len(self.records)
+        else:
+            index = self.records.index(record)
+            del self.records[index]
+        self._unchanged = min(self._unchanged, index)
+
+    def clear(self):
+        self.records.clear()
+        self._unchanged = 0
+
+    def record_chunks(self, size):
+        """(crc32, length) of encode_records() over each run of `size` records.
+
+        The checksums are kept as records are appended, so only the records added
+        or changed since the last call are encoded.
+        """
+        from project_file import encode_records  # project_file builds on this module
+        if size != self._chunk_size:
+            self._chunks, self._chunk_size = [], size
+        first = min(self._unchanged, len(self.records))
+        # Runs after the first changed record are dropped, and so is the one holding it
+        del self._chunks[first // size + 1:]
+        if len(self._chunks) > first // size and (first // size) * size + self._chunks[-1][2] > first:
+            self._chunks.pop()
+        done = (len(self._chunks) - 1) * size + self._chunks[-1][2] if self._chunks else 0
+        while done < len(self.records):
+            crc, length, count = self._chunks.pop() if self._chunks and self._chunks[-1][2] < size else (0, 0, 0)
+            added = self.records[done:done + size - count]
+            encoded = encode_records(added)
+            self._chunks.append((zlib.crc32(encoded, crc), length + len(encoded), count + len(added)))
+            done += len(added)
+        self._unchanged = len(self.records)
+        return [(crc, length) for crc, length, _ in self._chunks]
+
+    @property
+    def nbytes(self):
+        """Bytes held by record geometry and images"""
+        return sum(record.nbytes for record in self.records)
+
+    def render(self, pixels=None, layers=None):
+        """Replay every record into an RGBA array and return it.
+
+        Without `pixels` a blank canvas of the document size is used; an image
+        record replaces the canvas with a copy of its pixels. With `layers`, a
+        list of (layer id, opacity, background) bottom first as returned by
+        LayerStack.composite_order(), each layer is replayed on its own and the
+        results are composited.
+        """
+        if layers is not None:
+            readers = []
+            for layer_id, opacity, background in layers:
+                canvas = self._replay(rasterizer.new_canvas(self.width, self.height, background),
+                                      [record for record in self.records if record.layer == layer_id],
+                                      transparent=background[3] < 255)
+                readers.append((lambda y, h, canvas=canvas: canvas[y:y + h], opacity))
+            return flatten_arrays(readers, self.height, self.width)
+        if pixels is None:
+            pixels = rasterizer.new_canvas(self.width, self.height)
+        return self._replay(pixels, self.records)
+
+    def _replay(self, pixels, records, transparent=False):
+        for record in records:
+            if record.kind == RecordKind.IMAGE:
+                pixels = record.pixels.copy()
+            else:
+                self.render_record(pixels, record, transparent)
+        return pixels
+
+    def render_record(self, pixels, record, transparent=False):
+        """Draw one record into `pixels`; on a `transparent` layer the eraser clears instead of painting white"""
+        kind = record.kind
+        color = self.colors[record.color]
+        if kind == RecordKind.FILL:
+            rasterizer.fill(pixels, record.x, record.y, color, record.tolerance)
+            return
+        width = self.widths[record.width]
+        if kind == RecordKind.PENCIL:
+            rasterizer.draw_pencil(pixels, record.points, color, width)
+        elif kind == RecordKind.ERASER:
+            rasterizer.draw_eraser(pixels, record.points, width, transparent)
+        elif kind == RecordKind.BRUSH:
+            rasterizer.draw_brush(pixels, record.points, color, width, record.square)
+        elif kind == RecordKind.LINE:
+            rasterizer.draw_line(pixels, record.geometry, color, width)
+        elif kind == RecordKind.RECTANGLE:
+            rasterizer.draw_rectangle(pixels, record.geometry, color, width)
+        elif kind == RecordKind.CIRCLE:
+            rasterizer.draw_circle(pixels, record.geometry, color, width)
+
+    def instructions(self, record):
+        """Build the Kivy instructions that draw a record.
+
+        Fills and images are raster operations and have no vector form; they
+        return an empty list and are only reproduced by render().
+        """
+        # Imported here so the document model stays usable without Kivy
+        from kivy.graphics import Color, Line
+
+        kind = record.kind
+        if kind in (RecordKind.FILL, RecordKind.IMAGE):
+            return []
+        width = self.widths[record.width]
+        if kind == RecordKind.ERASER:
+            return [Color(1, 1, 1, 1), Line(points=record.points.ravel().tolist(), width=width * 2)]
+        color = Color(*self.colors[record.color])
+        if kind == RecordKind.PENCIL:
+            return [color, Line(points=record.points.ravel().tolist(), width=width)]
+        if kind == RecordKind.BRUSH:
+            from modules.brushtool import build_brush_meshes
+            return [color] + build_brush_meshes(record.points, width, record.square)
+        geometry = record.geometry.tolist()
+        if kind == RecordKind.LINE:
+            return [color, Line(points=geometry, width=width)]
+        if kind == RecordKind.RECTANGLE:
+            return [color, Line(rectangle=geometry, width=width)]
+        return [color, Line(circle=geometry, width=width)]
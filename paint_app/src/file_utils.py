@@ -1,14 +1,20 @@
+import logging
 import os
 from pathlib import Path
-from kivy.core.image import Image as CoreImage
 from PIL import Image
-from io import BytesIO
+import numpy as np
+from image_writer import ProgressFile, flatten_on_white, replace_file
+from size_estimator import SizeEstimator
+import instrumentation
+
+log = logging.getLogger(__name__)
 
 DEFAULT_SAVE_DIR = os.path.expanduser("~/Pictures")
 SUPPORTED_FORMATS = {
     'PNG Files': ['*.png'],
     'JPEG Files': ['*.jpg', '*.jpeg'],
     'BMP Files': ['*.bmp'],  # Added BMP support
+    'Paint Projects': ['*.paintproj'],
 }
 
 SUPPORTED_EXPORT_FORMATS = {
@@ -19,6 +25,80 @@ SUPPORTED_EXPORT_FORMATS = {
     'PDF': {'extension': '.pdf', 'description': 'PDF Document'}
 }
 
+def wrap_pixels(pixels, mode='RGBA'):
+    """PIL image sharing the memory of a contiguous (height, width, 4) uint8 RGBA array.
+
+    Nothing is copied, so the array must not change until the image is saved. With
+    mode 'RGBX' the alpha bytes are ignored, which formats like JPEG write directly.
+    """
+    height, width = pixels.shape[:2]
+    return Image.frombuffer(mode, (width, height), np.ascontiguousarray(pixels), 'raw', mode, 0, 1)
+
+
+def opaque_image(pixels):
+    """RGB image of an RGBA array flattened on white; the array is flattened in place"""
+    return wrap_pixels(flatten_on_white(pixels), 'RGBX').convert('RGB')
+
+
+def expected_size(pixels, format, quality=90, transparency=True):
+    """Bytes an export of the pixels should come to, which progress is measured against.
+
+    Exact for the uncompressed formats, estimated from sampled rows for the others.
+    """
+    height, width = pixels.shape[:2]
+    return SizeEstimator().estimate(None, width, height, lambda x, y, w, h: pixels[y:y + h, x:x + w],
+                                    format, quality, transparency)
+
+
+def save_pixels(pixels, filepath, file_format='PNG', jpeg_quality=90, progress=None):
+    """Save canvas pixels as PNG or JPEG; progress(fraction) is called as the file is written.
+
+    The pixels are flattened in place for JPEG.
+    """
+    file_format = file_format.upper()
+    expected = expected_size(pixels, file_format, jpeg_quality) if progress is not None else 1
+    with instrumentation.timer('save.' + file_format), replace_file(filepath) as fp:
+        fp = ProgressFile(fp, expected, progress)
+        if file_format == 'PNG':
+            wrap_pixels(pixels).save(fp, 'PNG')
+        else:
+            # Remove transparency; JPEG encodes straight from the RGBX view
+            wrap_pixels(flatten_on_white(pixels), 'RGBX').save(fp, 'JPEG', quality=jpeg_quality)
+        fp.finish()
+
+
+def export_pixels(pixels, filepath, settings, progress=None):
+    """Export canvas pixels with ExportSettings, replacing filepath's extension with the
+    format's own; returns the path written. The pixels are flattened in place for formats
+    without transparency, and progress(fraction) is called as the file is written.
+    """
+    base_filename, _ = os.path.splitext(filepath)
+    output_path = base_filename + SUPPORTED_EXPORT_FORMATS[settings.format]['extension']
+    dpi = (settings.dpi, settings.dpi)
+    expected = (expected_size(pixels, settings.format, settings.quality, settings.transparency)
+                if progress is not None else 1)
+    with instrumentation.timer('export.' + settings.format), replace_file(output_path) as fp:
+        fp = ProgressFile(fp, expected, progress)
+        if settings.format == 'PNG':
+            # Without transparency, convert RGBA to RGB with white background
+            image = wrap_pixels(pixels) if settings.transparency else opaque_image(pixels)
+            image.save(fp, 'PNG', dpi=dpi, optimize=True)
+        elif settings.format == 'JPEG':
+            # JPEG doesn't support transparency; it encodes straight from the RGBX view
+            image = wrap_pixels(flatten_on_white(pixels), 'RGBX')
+            image.save(fp, 'JPEG', quality=settings.quality, dpi=dpi, optimize=True)
+        elif settings.format == 'TIFF':
+            wrap_pixels(pixels).save(fp, 'TIFF', resolution=settings.dpi)
+        elif settings.format == 'PDF':
+            # The page is sized from the DPI (72 points to the inch)
+            opaque_image(pixels).save(fp, 'PDF', resolution=settings.dpi, quality=settings.quality)
+        elif settings.format == 'BMP':
+            # BMP doesn't support transparency
+            opaque_image(pixels).save(fp, 'BMP', dpi=dpi)
+        fp.finish()
+    return output_path
+
+
 class ExportSettings:
     def __init__(self, format='PNG', dpi=300, quality=90, transparency=True):
         self.format = format
@@ -54,135 +134,56 @@ class FileManager:
     @staticmethod
     def save_canvas_as_image(paint_widget, filepath, file_format='PNG', jpeg_quality=90):
         try:
-            print(f"Attempting to save image to: {filepath}")
-            
-            # Get the image from the paint widget
-            img = paint_widget.export_as_image()
-            data = BytesIO()
-            img.save(data, fmt='png')
-            data.seek(0)
-            
-            # Open the image with PIL
-            image = Image.open(data)
-            
-            # Save the image in the desired format
-            if file_format.upper() == 'PNG':
-                image.save(filepath, 'PNG')
-            else:
-                if image.mode == 'RGBA':
-                    background = Image.new('RGB', image.size, (255, 255, 255))
-                    background.paste(image, mask=image.split()[3])  # Remove transparency
-                    image = background
-                image.save(filepath, 'JPEG', quality=jpeg_quality)
-            print("Save successful")
+            # Get the pixels from the paint widget's tile store; they are encoded in place
+            save_pixels(paint_widget.get_pixels(), filepath, file_format, jpeg_quality)
+            log.debug("Saved image to %s", filepath)
             return True
-        except Exception as e:
-            print(f"Error saving image: {e}")
+        except Exception:
+            log.exception("Error saving image to %s", filepath)
+            return False
+
+    @staticmethod
+    def save_project(paint_widget, filepath):
+        """Save the canvas as a .paintproj project"""
+        try:
+            paint_widget.save_project(filepath)
+            log.debug("Saved project to %s", filepath)
+            return True
+        except Exception:
+            log.exception("Error saving project to %s", filepath)
+            return False
+
+    @staticmethod
+    def open_project(paint_widget, filepath):
+        """Open a .paintproj project onto the canvas"""
+        try:
+            paint_widget.open_project(filepath)
+            return True
+        except Exception:
+            log.exception("Error opening project %s", filepath)
             return False
 
     @staticmethod
     def export_canvas(paint_widget, filepath, settings):
         """Export canvas with specified settings"""
         try:
-            # Get the image from the paint widget
-            img = paint_widget.export_as_image()
-            data = BytesIO()
-            img.save(data, fmt='png')
-            data.seek(0)
-            
-            # Open with PIL for advanced export options
-            image = Image.open(data)
-            
-            # Prepare output filename with correct extension
-            base_filename, _ = os.path.splitext(filepath)
-            output_path = base_filename + SUPPORTED_EXPORT_FORMATS[settings.format]['extension']
-            
-            # Handle format-specific settings
-            if settings.format == 'PNG':
-                if not settings.transparency and image.mode == 'RGBA':
-                    # Convert RGBA to RGB with white background
-                    bg = Image.new('RGB', image.size, (255, 255, 255))
-                    bg.paste(image, mask=image.split()[3])
-                    image = bg
-                image.save(output_path, 'PNG', 
-                         dpi=(settings.dpi, settings.dpi),
-                         optimize=True)
-                
-            elif settings.format == 'JPEG':
-                # JPEG doesn't support transparency, always convert to RGB
-                if image.mode == 'RGBA':
-                    bg = Image.new('RGB', image.size, (255, 255, 255))
-                    bg.paste(image, mask=image.split()[3])
-                    image = bg
-                image.save(output_path, 'JPEG', 
-                         quality=settings.quality, 
-                         dpi=(settings.dpi, settings.dpi),
-                         optimize=True)
-                
-            elif settings.format == 'TIFF':
-                image.save(output_path, 'TIFF', 
-                         resolution=settings.dpi,
-                         quality=settings.quality)
-                
-            elif settings.format == 'PDF':
-                # Convert to RGB for PDF
-                if image.mode == 'RGBA':
-                    bg = Image.new('RGB', image.size, (255, 255, 255))
-                    bg.paste(image, mask=image.split()[3])
-                    image = bg
-                elif image.mode != 'RGB':
-                    image = image.convert('RGB')
-                    
-                # Calculate PDF dimensions (assuming 72 DPI is base PDF unit)
-                width_in_inches = image.width / settings.dpi
-                height_in_inches = image.height / settings.dpi
-                width_in_points = width_in_inches * 72
-                height_in_points = height_in_inches * 72
-                
-                # Save as PDF with correct dimensions
-                image.save(output_path, 'PDF', 
-                         resolution=settings.dpi,
-                         width=width_in_points,
-                         height=height_in_points)
-                
-            elif settings.format == 'BMP':
-                # BMP doesn't support transparency
-                if image.mode == 'RGBA':
-                    bg = Image.new('RGB', image.size, (255, 255, 255))
-                    bg.paste(image, mask=image.split()[3])
-                    image = bg
-                image.save(output_path, 'BMP')
-            
-            print(f"Successfully exported to {output_path}")
-            print(f"Format: {settings.format}, DPI: {settings.dpi}, Quality: {settings.quality}")
+            # Get the pixels from the paint widget's tile store; they are encoded in place
+            output_path = export_pixels(paint_widget.get_pixels(), filepath, settings)
+            log.debug("Exported %s (DPI %s, quality %s) to %s", settings.format, settings.dpi,
+                      settings.quality, output_path)
             return True
-            
-        except Exception as e:
-            print(f"Error exporting image: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            log.exception("Error exporting image to %s", filepath)
             return False
 
     @staticmethod
-    def estimate_file_size(canvas, format='PNG'):
-        """Estimate file size before saving"""
-        buffer = BytesIO()
-        texture = canvas.export_as_image().texture
-        
-        # Convert to PIL Image (similar to save process)
-        pixels = texture.pixels
-        size = (texture.width, texture.height)
-        mode = 'RGBA' if texture.colorfmt == 'rgba' else 'RGB'
-        image = Image.frombytes(mode, size, pixels)
-        
-        # Save to buffer to estimate size
-        if format.upper() == 'PNG':
-            image.save(buffer, format='PNG')
-        else:
-            if image.mode == 'RGBA':
-                background = Image.new('RGB', size, (255, 255, 255))
-                background.paste(image, mask=image.split()[3])
-                image = background
-            image.save(buffer, format='JPEG', quality=90)
-            
-        return len(buffer.getvalue()) / 1024  # Size in KB
\ No newline at end of file
+    def estimate_file_size(canvas, format='PNG', quality=90, transparency=True, on_ready=None):
+        """Estimate file size before saving, in KB, without encoding the whole canvas.
+
+        With `on_ready`, an estimate that isn't cached returns None and is passed to
+        on_ready(kb) from a worker thread once encoded.
+        """
+        if on_ready is not None:
+            size = canvas.estimate_export_size(format, quality, transparency, lambda size: on_ready(size / 1024))
+            return None if size is None else size / 1024
+        return canvas.estimate_export_size(format, quality, transparency) / 1024  # Size in KB
\ No newline at end of file
@@ -0,0 +1,207 @@
+# This file works out which pixels a bucket fill covers as its tolerance changes, fast
+# enough to redraw a preview on every move of the tolerance slider. The first tolerance
+# asked for is traced with the scanline fill, whose cost follows the region, so a plain
+# click costs what a fill always did. After that, from prepare() or the first change of
+# tolerance, each pixel's color distance from the seed (its largest RGB channel
+# difference, what the tolerance is compared against) is computed once into a uint8 map.
+#
+# Drawings have long runs of one color, so the map is cut into runs of equal distance
+# along each row and joined into a graph of touching runs. The widest step on the
+# easiest path from the seed to a run, read off the graph's minimum spanning tree, is
+# the lowest tolerance at which the fill reaches it. Every pixel gets that level once,
+# and after that a tolerance only thresholds the level map.
+#
+# Photos have too many runs for that to pay off. Each tolerance there thresholds the
+# distance map and labels the 4-connected area around the seed. Regions only grow with
+# the tolerance, so one found for a higher tolerance bounds the labelling for a lower
+# one, and a step that admits no pixel touching the region, or drops none inside it,
+# reuses the region as it is. The last few regions are cached either way, so dragging
+# the slider back and forth is cheap. Nothing here imports Kivy.
+from collections import OrderedDict
+
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import breadth_first_order, minimum_spanning_tree
+
+from rasterizer import color_distance, find_fill_spans, spans_bounds
+
+MAX_TOLERANCE = 255
+MAX_RUNS = 1 << 17  # Beyond this many runs the level map takes longer than labelling a few tolerances
+CACHE_SIZE = 8      # Regions kept, each up to a byte per canvas pixel
+
+
+class FillRegion:
+    """The pixels a fill seeded at (x, y) covers, for any tolerance.
+
+    `pixels` is an RGBA array with row 0 at the top, as FillTool reads the canvas;
+    it is read until the distance map is made.
+    """
+
+    def __init__(self, pixels, x, y):
+        self.x, self.y = x, y
+        self.pixels = pixels
+        self.target = pixels[y, x, :3].copy()
+        self.distance = None           # Made by prepare(), at the latest for a second tolerance
+        self.levels = None             # Lowest tolerance reaching each pixel, when worth making
+        self._boxes = None             # Box reached by each tolerance, with the levels
+        self._within = None            # Threshold buffer for labelling, reused
+        self._regions = OrderedDict()  # Tolerance -> (box, mask), most recently used last
+        self.labelled = 0              # Regions that had to be labelled, for benchmarks
+
+    def region(self, tolerance):
+        """Return ((left, top, right, bottom), mask) for a tolerance.
+
+        The box is half-open in image coordinates and the mask is a read-only boolean
+        array covering it, True where the fill reaches.
+        """
+        tolerance = min(max(int(tolerance), 0), MAX_TOLERANCE)
+        found = self._regions.get(tolerance)
+        if found is not None:
+            self._regions.move_to_end(tolerance)
+            return found
+        if not self._regions:
+            found = self._trace(tolerance)
+        else:
+            self.prepare()
+            found = self._threshold(tolerance) if self.levels is not None else self._find(tolerance)
+        self._regions[tolerance] = found
+        if len(self._regions) > CACHE_SIZE:
+            self._regions.popitem(last=False)
+        return found
+
+    def prepare(self):
+        """Make the distance map, and the level map if worth it, ahead of a tolerance change"""
+        if self.distance is None:
+            self.distance = color_distance(self.pixels, self.target)
+            self.levels, self._boxes = level_map(self.distance, self.x, self.y, MAX_RUNS)
+            self.pixels = None
+
+    def _trace(self, tolerance):
+        spans = find_fill_spans(self.pixels, self.x, self.y, self.target, tolerance)
+        left, top, right, bottom = spans_bounds(spans)
+        mask = np.zeros((bottom - top, right - left), dtype=bool)
+        for row, start, end in spans:
+            mask[row - top, start - left:end - left] = True
+        mask.flags.writeable = False
+        return (left, top, right, bottom), mask
+
+    def _threshold(self, tolerance):
+        left, top, right, bottom = (int(edge) for edge in self._boxes[tolerance])
+        mask = self.levels[top:bottom, left:right] <= tolerance
+        mask.flags.writeable = False
+        return (left, top, right, bottom), mask
+
+    def _find(self, tolerance):
+        height, width = self.distance.shape
+        above = min((known for known in self._regions if known > tolerance), default=None)
+        below = max((known for known in self._regions if known < tolerance), default=None)
+        if below is not None:
+            box, mask = self._regions[below]
+            if not self._grows(box, mask, below, tolerance):
+                return box, mask
+        if above is None:
+            return self._label((0, 0, width, height), tolerance)
+        box, mask = self._regions[above]
+        if not self._drops(box, mask, tolerance):
+            return box, mask
+        return self._label(box, tolerance)  # The region lies inside the larger one
+
+    def _drops(self, box, mask, tolerance):
+        """Whether a lower tolerance loses any pixel of the region"""
+        left, top, right, bottom = box
+        return bool(np.any(self.distance[top:bottom, left:right] > tolerance, where=mask))
+
+    def _grows(self, box, mask, known, tolerance):
+        """Whether a pixel admitted above the `known` tolerance touches the region.
+
+        The region can only grow through such a pixel: any other neighbour within
+        the tolerance was already within the known one, and so part of the region.
+        """
+        height, width = self.distance.shape
+        left, top, right, bottom = box
+        x0, y0, x1, y1 = max(left - 1, 0), max(top - 1, 0), min(right + 1, width), min(bottom + 1, height)
+        region = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        region[top - y0:bottom - y0, left - x0:right - x0] = mask
+        touching = region.copy()
+        touching[1:] |= region[:-1]
+        touching[:-1] |= region[1:]
+        touching[:, 1:] |= region[:, :-1]
+        touching[:, :-1] |= region[:, 1:]
+        distance = self.distance[y0:y1, x0:x1]
+        return bool(np.any(touching & (distance > known) & (distance <= tolerance)))
+
+    def _label(self, bounds, tolerance):
+        if self._within is None:
+            self._within = np.empty(self.distance.shape, dtype=bool)
+        left, top, right, bottom = bounds
+        within = self._within[top:bottom, left:right]
+        np.less_equal(self.distance[top:bottom, left:right], tolerance, out=within)
+        labels, _ = ndimage.label(within)
+        mask = labels == labels[self.y - top, self.x - left]
+        self.labelled += 1
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        mask.flags.writeable = False
+        return (left + int(cols[0]), top + int(rows[0]), left + int(cols[-1]) + 1, top + int(rows[-1]) + 1), mask
+
+
+def level_map(distance, x, y, max_runs=MAX_RUNS):
+    """Return the lowest tolerance at which a fill seeded at (x, y) reaches each pixel.
+
+    Returns (levels, boxes): a uint8 array the shape of `distance`, and a (256, 4)
+    array holding the (left, top, right, bottom) box of the pixels reached at each
+    tolerance. Returns (None, None) if the distance map has more than `max_runs` runs.
+    """
+    height, width = distance.shape
+    flat = distance.ravel()
+    # Runs of equal distance, never crossing the end of a row
+    change = np.empty(flat.size, dtype=bool)
+    change[0] = True
+    np.not_equal(flat[1:], flat[:-1], out=change[1:])
+    change[::width] = True
+    starts = np.flatnonzero(change)
+    count = len(starts)
+    if count > max_runs:
+        return None, None
+    values = flat[starts]
+    lengths = np.diff(starts, append=flat.size)
+    rows, cols = np.divmod(starts, width)
+    ends = cols + lengths
+
+    # Each run touches the next run in its row and the runs it overlaps in the row below
+    same_row = np.flatnonzero(rows[1:] == rows[:-1])
+    key_starts = rows * (width + 1) + cols
+    key_ends = rows * (width + 1) + ends
+    below = (rows + 1) * (width + 1)
+    first = np.searchsorted(key_ends, below + cols, side='right')
+    overlaps = np.searchsorted(key_starts, below + ends, side='left') - first
+    upper = np.repeat(np.arange(count), overlaps)
+    lower = np.arange(overlaps.sum()) - np.repeat(np.cumsum(overlaps) - overlaps - first, overlaps)
+    a = np.concatenate([same_row, upper])
+    b = np.concatenate([same_row + 1, lower])
+    # Crossing an edge takes the higher of its runs' distances; + 1 as sparse graphs drop zero weights
+    weights = np.maximum(values[a], values[b]).astype(np.int16) + 1
+    tree = minimum_spanning_tree(coo_matrix((weights, (a, b)), shape=(count, count)).tocsr())
+
+    # The level of a run is the highest distance on its tree path to the seed's run,
+    # found by doubling: each pass folds in the path up to the ancestor 2**n steps away
+    seed = np.searchsorted(starts, y * width + x, side='right') - 1
+    _, ancestors = breadth_first_order(tree, seed, directed=False, return_predecessors=True)
+    ancestors[seed] = seed
+    run_levels = values.copy()
+    while True:
+        np.maximum(run_levels, run_levels[ancestors], out=run_levels)
+        further = ancestors[ancestors]
+        if np.array_equal(further, ancestors):
+            break
+        ancestors = further
+
+    boxes = np.empty((MAX_TOLERANCE + 1, 4), dtype=np.int64)
+    for edge, reduce, start, empty in ((0, np.minimum, cols, width), (1, np.minimum, rows, height),
+                                       (2, np.maximum, ends, 0), (3, np.maximum, rows + 1, 0)):
+        boxes[:, edge] = empty
+        reduce.at(boxes[:, edge], run_levels, start)
+        boxes[:, edge] = reduce.accumulate(boxes[:, edge])
+    return np.repeat(run_levels, lengths).reshape(height, width), boxes
@@ -0,0 +1,161 @@
+# This file manages the undo/redo history with a memory budget. Commands report the
+# bytes they hold; when the history goes over budget the oldest heavy payloads are
+# spilled to a temporary file and memory-mapped back in if they are ever needed again.
+import tempfile
+import threading
+import weakref
+from collections import deque
+
+import numpy as np
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024  # Resident bytes held by undo/redo payloads
+DEFAULT_SPILL_THRESHOLD = 256 * 1024       # Commands smaller than this are never spilled
+DEFAULT_MAX_COMMANDS = 1000                # Hard cap on history depth
+
+
+class SpillStore:
+    """Temporary file holding spilled undo payloads.
+
+    A payload's bytes are freed once nothing references its view any more (the
+    command was evicted or dropped with the redo history, and no document record
+    shares it), and later payloads reuse the freed ranges, so the file only grows
+    with the payloads still alive.
+    """
+
+    def __init__(self):
+        self._file = None
+        self._size = 0
+        self._free = []  # Sorted, non-adjacent [offset, size] ranges inside the file
+        self._lock = threading.Lock()  # Views can be released from any thread
+
+    @property
+    def size(self):
+        """Bytes the file spans, live payloads and free ranges inside it"""
+        return self._size
+
+    def put(self, data):
+        """Write an array or bytes-like payload and return a read-only memory-mapped view of it.
+
+        The view has the same shape as `data`; pages are only read back from disk when touched.
+        """
+        array = np.ascontiguousarray(np.frombuffer(data, dtype=np.uint8) if isinstance(data, bytes) else data)
+        with self._lock:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(prefix='paint-undo-')
+            offset = self._allocate(array.nbytes)
+            self._file.seek(offset)
+            self._file.write(array.tobytes())
+            self._file.flush()
+            view = np.memmap(self._file, dtype=array.dtype, mode='r', offset=offset, shape=array.shape)
+            weakref.finalize(view, self._release, self._file, offset, array.nbytes)
+        return view
+
+    def _allocate(self, nbytes):
+        # First fit among the freed ranges, otherwise append
+        for index, (offset, size) in enumerate(self._free):
+            if size >= nbytes:
+                if size == nbytes:
+                    del self._free[index]
+                else:
+                    self._free[index] = [offset + nbytes, size - nbytes]
+                return offset
+        offset = self._size
+        self._size += nbytes
+        return offset
+
+    def _release(self, file, offset, nbytes):
+        with self._lock:
+            if file is not self._file or not nbytes:
+                return  # Written before a reset
+            index = 0
+            while index < len(self._free) and self._free[index][0] < offset:
+                index += 1
+            self._free.insert(index, [offset, nbytes])
+            # Merge with the following range, then the preceding one
+            if index + 1 < len(self._free) and offset + nbytes == self._free[index + 1][0]:
+                self._free[index][1] += self._free.pop(index + 1)[1]
+            if index and sum(self._free[index - 1]) == offset:
+                self._free[index - 1][1] += self._free.pop(index)[1]
+                index -= 1
+            # Give a free range at the end of the file back to the filesystem
+            if sum(self._free[index]) == self._size:
+                self._size = self._free.pop(index)[0]
+                self._file.truncate(self._size)
+
+    def reset(self):
+        """Discard everything written so far"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+            self._size = 0
+            self._free = []
+
+
+class UndoHistory:
+    """Undo and redo stacks limited by the bytes their commands hold rather than their count.
+
+    Commands expose `nbytes` (resident payload bytes). Commands that also provide
+    `spill(store)` and `spilled_nbytes` can have their payload moved to disk.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, spill_threshold=DEFAULT_SPILL_THRESHOLD,
+                 max_commands=DEFAULT_MAX_COMMANDS):
+        self.memory_budget = memory_budget
+        self.spill_threshold = spill_threshold
+        self.max_commands = max_commands
+        self.undo_stack = deque()
+        self.redo_stack = deque()
+        self.spill_store = SpillStore()
+
+    def _commands(self):
+        return list(self.undo_stack) + list(self.redo_stack)
+
+    @property
+    def memory_bytes(self):
+        """Payload bytes currently held in memory by the history"""
+        return sum(getattr(command, 'nbytes', 0) for command in self._commands())
+
+    @property
+    def spilled_bytes(self):
+        """Payload bytes currently spilled to the temporary file"""
+        return sum(getattr(command, 'spilled_nbytes', 0) for command in self._commands())
+
+    def stats(self):
+        return {
+            'commands': len(self.undo_stack) + len(self.redo_stack),
+            'memory_bytes': self.memory_bytes,
+            'spilled_bytes': self.spilled_bytes,
+            'memory_budget': self.memory_budget,
+        }
+
+    def push(self, command):
+        """Record a newly executed command, dropping the redo history"""
+        self.undo_stack.append(command)
+        self.redo_stack.clear()
+        self.enforce_budget()
+
+    def enforce_budget(self):
+        """Spill, then evict, the oldest commands until the history fits its limits"""
+        while len(self.undo_stack) > self.max_commands:
+            self.undo_stack.popleft()
+
+        memory = self.memory_bytes
+        if memory <= self.memory_budget:
+            return
+        # Spill the oldest heavy payloads first; the newest command stays resident
+        for command in list(self.undo_stack)[:-1]:
+            size = getattr(command, 'nbytes', 0)
+            if size >= self.spill_threshold and hasattr(command, 'spill'):
+                command.spill(self.spill_store)
+                memory -= size - getattr(command, 'nbytes', 0)
+                if memory <= self.memory_budget:
+                    return
+        # Everything heavy is on disk already; give up the oldest light commands
+        while memory > self.memory_budget and len(self.undo_stack) > 1:
+            memory -= getattr(self.undo_stack.popleft(), 'nbytes', 0)
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.spill_store.reset()
@@ -0,0 +1,360 @@
+# This file decodes images for the canvas off the UI thread.
+# Images are decoded in strips straight into a TileStore, so a huge scan never needs a
+# second full-size copy while it loads: PNG and TIFF are decoded one strip at a time,
+# other formats are decoded whole and then split. An ImageLoadJob shows a downscaled
+# preview first (the decoder's own reduced-size decode for JPEG, otherwise built up from
+# the strips as they arrive). Callbacks run on the worker thread; the canvas widget hands
+# them to the Kivy clock. Nothing here imports Kivy.
+import io
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+from PIL import Image, TiffImagePlugin
+
+from raster_store import TILE_SIZE, TileStore
+
+PREVIEW_SIZE = 1024      # Longest side of the preview, in pixels
+PREVIEW_INTERVAL = 0.25  # Seconds between preview updates while strips are decoded
+WHITE = (255, 255, 255, 255)
+# Largest image the loader opens, in pixels. Pillow's own decompression bomb limit stops
+# short of the scans the strip decode is meant for, but it is process-wide, so the loader
+# checks this one itself rather than raising Pillow's
+MAX_IMAGE_PIXELS = 1 << 30
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_PNG_SAMPLES = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # Color type -> samples per pixel
+_PNG_READ = 1 << 20
+
+# Tags describing how TIFF strip data decodes to pixels, copied into per-strip files
+_TIFF_PIXEL_TAGS = (256, 258, 259, 262, 266, 277, 284, 317, 320, 338, 339, 347, 529, 530, 531, 532)
+
+
+_open_lock = threading.Lock()
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+def open_image(path):
+    """Image.open() with MAX_IMAGE_PIXELS in place of Pillow's decompression bomb limit"""
+    # Pillow only checks the size while it reads the header, so its limit is lifted for
+    # just that long; the lock stops two loads from restoring each other's lifted value
+    with _open_lock:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            source = Image.open(path)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+    if source.width * source.height > MAX_IMAGE_PIXELS:
+        source.close()
+        raise Image.DecompressionBombError(
+            f'Image size ({source.width * source.height} pixels) exceeds limit of {MAX_IMAGE_PIXELS} pixels')
+    return source
+
+
+def flatten_on_white(image):
+    """RGBA array of an image composited onto the white canvas background"""
+    image = image.convert('RGBA')
+    background = Image.new('RGBA', image.size, WHITE)
+    background.alpha_composite(image)
+    return np.asarray(background).copy()
+
+
+def decode_image(path):
+    """Full-resolution pixels of an image file, as they would appear on the canvas"""
+    with open_image(path) as source:
+        return flatten_on_white(source)
+
+
+def decode_preview(path, max_size=PREVIEW_SIZE):
+    """Downscaled pixels of an image file and the image's full (width, height).
+
+    JPEG decodes straight to a reduced size through draft(); other formats are
+    decoded in full and then reduced.
+    """
+    with open_image(path) as source:
+        size = source.size
+        scale = max(size) // max_size
+        if scale < 2:
+            return flatten_on_white(source), size
+        # Formats without a reduced-size decode ignore this
+        source.draft(None, (size[0] // scale, size[1] // scale))
+        factor = max(1, max(source.size) // max_size)
+        preview = source.reduce(factor) if factor > 1 else source
+        return flatten_on_white(preview), size
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)))
+
+
+def _png_strips(source, rows):
+    """Strips of a non-interlaced 8-bit PNG, decoded one at a time, or None for other PNGs.
+
+    The filtered rows of each strip are inflated from the file and wrapped in a small
+    PNG of their own, headed by the unfiltered row above them, so Pillow's decoder sees
+    exactly the filter inputs it would for the whole image.
+    """
+    if source.tile[0].args != source.mode:
+        return None
+    fp = source.fp
+    fp.seek(len(_PNG_SIGNATURE))
+    header, extra = None, []
+    while True:
+        length, kind = struct.unpack('>I4s', fp.read(8))
+        if kind == b'IDAT':
+            break
+        data = fp.read(length)
+        fp.seek(4, io.SEEK_CUR)  # CRC
+        if kind == b'IHDR':
+            header = data
+        elif kind in (b'PLTE', b'tRNS'):
+            # Every strip needs the palette and transparency to decode like the whole image
+            extra.append(_png_chunk(kind, data))
+    width, height, depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', header)
+    if depth != 8 or interlace or color_type not in _PNG_SAMPLES:
+        return None
+    return _png_strip_iter(fp, length, header, extra, width * _PNG_SAMPLES[color_type] + 1, rows)
+
+
+def _png_idat(fp, length):
+    """Yield the compressed image data from the first IDAT chunk's data onwards"""
+    while True:
+        while length:
+            data = fp.read(min(length, _PNG_READ))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+        fp.seek(4, io.SEEK_CUR)  # CRC
+        length, kind = struct.unpack('>I4s', fp.read(8))
+        if kind != b'IDAT':
+            return
+
+
+def _png_strip_iter(fp, length, header, extra, row_bytes, rows):
+    width, height = struct.unpack('>II', header[:8])
+    compressed = _png_idat(fp, length)
+    inflate = zlib.decompressobj()
+    above = bytes(row_bytes)  # Filter type 0 and a zero row, which is what the first row is filtered against
+    for y in range(0, height, rows):
+        count = min(rows, height - y)
+        wanted = count * row_bytes
+        filtered = bytearray()
+        while len(filtered) < wanted:
+            data = inflate.unconsumed_tail or next(compressed, b'')
+            out = inflate.decompress(data, wanted - len(filtered))
+            if not data and not out:
+                raise OSError('PNG image data is truncated')
+            filtered += out
+        png = b''.join([_PNG_SIGNATURE, _png_chunk(b'IHDR', struct.pack('>II', width, count + 1) + header[8:]),
+                        *extra, _png_chunk(b'IDAT', zlib.compress(above + filtered, 0)), _png_chunk(b'IEND', b'')])
+        with open_image(io.BytesIO(png)) as image:
+            image.load()
+            above = b'\0' + image.crop((0, count, width, count + 1)).tobytes()
+            yield image.crop((0, 1, width, count + 1))
+
+
+def _tiff_strips(source, rows):
+    """Strips of a striped, chunky TIFF, decoded a few file strips at a time, or None for other TIFFs.
+
+    Compressed strips are copied as they are into a small TIFF of their own for Pillow
+    to decode; uncompressed files are cut into strips of exactly `rows` rows.
+    """
+    tags = source.tag_v2
+    if 322 in tags or tags.get(284, 1) != 1 or 273 not in tags or 279 not in tags:
+        return None
+    width, height = source.size
+    per_strip = min(tags.get(278, height), height)
+    if tags.get(259, 1) == 1:
+        bits = tags.get(258, (1,))
+        samples = tags.get(277, 1)
+        row_bytes = (width * (sum(bits) if len(bits) == samples else bits[0] * samples) + 7) // 8
+        return _tiff_raw_iter(source, per_strip, row_bytes, rows)
+    return _tiff_strip_iter(source, per_strip, max(1, rows // per_strip))
+
+
+def _tiff_raw_iter(source, per_strip, row_bytes, rows):
+    tags, fp = source.tag_v2, source.fp
+    width, height = source.size
+    for y in range(0, height, rows):
+        count = min(rows, height - y)
+        parts = []
+        for strip in range(y // per_strip, (y + count - 1) // per_strip + 1):
+            first, last = max(y, strip * per_strip), min(y + count, (strip + 1) * per_strip)
+            fp.seek(tags[273][strip] + (first - strip * per_strip) * row_bytes)
+            parts.append(fp.read((last - first) * row_bytes))
+        yield _tiff_part(tags, [b''.join(parts)], count, count)
+
+
+def _tiff_strip_iter(source, per_strip, group):
+    tags, fp = source.tag_v2, source.fp
+    height = source.size[1]
+    strips = -(-height // per_strip)
+    for first in range(0, strips, group):
+        parts = []
+        for strip in range(first, min(first + group, strips)):
+            fp.seek(tags[273][strip])
+            parts.append(fp.read(tags[279][strip]))
+        yield _tiff_part(tags, parts, per_strip, min(len(parts) * per_strip, height - first * per_strip))
+
+
+def _tiff_part(tags, parts, per_strip, height):
+    """Image of a run of strips, wrapped in a minimal TIFF that copies the source's pixel tags"""
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=tags.prefix)
+    for tag in _TIFF_PIXEL_TAGS:
+        if tag in tags:
+            ifd.tagtype[tag] = tags.tagtype[tag]
+            ifd[tag] = tags[tag]
+    ifd[257] = height
+    ifd[278] = per_strip
+    # Pillow writes the directory first and moves strip offsets past it, as in its own files
+    offsets = np.cumsum([0] + [len(part) for part in parts[:-1]])
+    ifd.tagtype[273] = ifd.tagtype[279] = TiffImagePlugin.TiffTags.LONG
+    ifd[273] = tuple(int(offset) for offset in offsets)
+    ifd[279] = tuple(len(part) for part in parts)
+    order = '<' if tags.prefix == b'II' else '>'
+    data = b''.join([tags.prefix, struct.pack(order + 'HI', 42, 8), ifd.tobytes(8), *parts])
+    return open_image(io.BytesIO(data))
+
+
+def _whole_strips(source, rows):
+    source.load()
+    width, height = source.size
+    for y in range(0, height, rows):
+        yield source.crop((0, y, width, min(y + rows, height)))
+
+
+def iter_strips(source, rows=TILE_SIZE):
+    """Yield (y, pixels) for consecutive strips of an open image, flattened on white, from the top.
+
+    PNG and TIFF are decoded strip by strip, so only about one strip of decoded rows is
+    in memory at a time; other formats are decoded whole and then split.
+    """
+    strips = None
+    if source.format == 'PNG':
+        strips = _png_strips(source, rows)
+    elif source.format == 'TIFF':
+        strips = _tiff_strips(source, rows)
+    if strips is None:
+        strips = _whole_strips(source, rows)
+    y = 0
+    for strip in strips:
+        yield y, flatten_on_white(strip)
+        y += strip.height
+
+
+def decode_tiles(path, tile_size=TILE_SIZE, scratch=None, on_strip=None, check=None):
+    """TileStore holding an image file as it would appear on the canvas, decoded strip by strip.
+
+    Each strip is written into the tiles (and appended to `scratch`, a binary file, if
+    given) before the next one is decoded. on_strip(y, pixels) sees every strip, and
+    check() runs after each so a caller can abandon the decode by raising.
+    """
+    with open_image(path) as source:
+        raster = TileStore(source.width, source.height, tile_size)
+        for y, pixels in iter_strips(source, tile_size):
+            if check is not None:
+                check()
+            raster.write_region(0, y, pixels)
+            if scratch is not None:
+                scratch.write(pixels)
+            if on_strip is not None:
+                on_strip(y, pixels)
+    return raster
+
+
+def load_tiles(path, tile_size=TILE_SIZE, on_strip=None, check=None):
+    """(raster, pixels) for an image file: a TileStore from decode_tiles() and the same
+    image as a read-only memory map of a scratch file, which costs no memory until read.
+    """
+    with tempfile.TemporaryFile(prefix='paint-image-') as scratch:
+        raster = decode_tiles(path, tile_size, scratch, on_strip, check)
+        scratch.flush()
+        return raster, np.memmap(scratch, dtype=np.uint8, mode='r', shape=raster.shape)
+
+
+class ImageLoadJob:
+    """Reads and decodes one image file on a worker thread.
+
+    on_preview(pixels, size) gets a downscaled preview and the full image size, possibly
+    several times as more of the image is decoded. on_done(raster, pixels) gets a
+    TileStore holding the image and the same pixels memory-mapped from a scratch file,
+    as load_tiles() returns them. on_error(exception) reports
+    any failure. After cancel() no further callbacks are made.
+    """
+
+    def __init__(self, path, on_preview=None, on_done=None, on_error=None, preview_size=PREVIEW_SIZE,
+                 tile_size=TILE_SIZE):
+        self.path = path
+        self.on_preview = on_preview
+        self.on_done = on_done
+        self.on_error = on_error
+        self.preview_size = preview_size
+        self.tile_size = tile_size
+        self._cancelled = threading.Event()
+        self.thread = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='image-load', daemon=True)
+        self.thread.start()
+        return self
+
+    def _check(self):
+        if self.cancelled:
+            raise LoadCancelled(self.path)
+
+    def _strip_preview(self, size, scale):
+        """on_strip callback building a preview from every scale-th row and column"""
+        width, height = size
+        preview = np.empty((-(-height // scale), -(-width // scale), 4), dtype=np.uint8)
+        preview[:] = WHITE
+        shown = [float('-inf')]
+
+        def on_strip(y, pixels):
+            skip = -y % scale
+            rows = pixels[skip::scale, ::scale]
+            top = (y + skip) // scale
+            preview[top:top + len(rows)] = rows
+            now = time.monotonic()
+            if now - shown[0] >= PREVIEW_INTERVAL and y + len(pixels) < height:
+                shown[0] = now
+                self.on_preview(preview.copy(), size)
+
+        return on_strip
+
+    def run(self):
+        try:
+            with open_image(self.path) as source:
+                size, reduced = source.size, source.format == 'JPEG'
+            scale = max(size) // self.preview_size
+            on_strip = None
+            if self.on_preview is not None and scale >= 2:
+                if reduced:
+                    preview, size = decode_preview(self.path, self.preview_size)
+                    self._check()
+                    self.on_preview(preview, size)
+                else:
+                    on_strip = self._strip_preview(size, scale)
+            raster, pixels = load_tiles(self.path, self.tile_size, on_strip, self._check)
+            self._check()
+            if self.on_done is not None:
+                self.on_done(raster, pixels)
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            if not self.cancelled and self.on_error is not None:
+                self.on_error(e)
@@ -0,0 +1,131 @@
+# This file holds the plumbing for writing canvas pixels to image files off the UI thread.
+# The encoding itself is Pillow's; a ProgressFile sits between the encoder and the file
+# and reports progress as the encoded blocks arrive, so an export running on a worker
+# thread can show how far it has got and stop between blocks when cancelled. An
+# ExportJob runs an export on such a thread. Nothing here imports Kivy.
+import contextlib
+import io
+import os
+import threading
+
+import numpy as np
+
+FLATTEN_ROWS = 256  # Rows composited onto white at a time, bounding the temporaries
+PROGRESS_CAP = 99  # Percent reported until the encoder is done, as compressed sizes are estimated
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def replace_file(path):
+    """Binary file that replaces `path` only once the block completes, so a failed or
+    cancelled export never leaves a half-written file behind"""
+    partial = path + '.part'
+    try:
+        with open(partial, 'wb') as fp:
+            yield fp
+        os.replace(partial, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(partial)
+        raise
+
+
+def flatten_on_white(pixels):
+    """Composite an RGBA array onto a white background in place, leaving it opaque"""
+    for y in range(0, pixels.shape[0], FLATTEN_ROWS):
+        band = pixels[y:y + FLATTEN_ROWS]
+        alpha = band[..., 3:]
+        if (alpha == 255).all():
+            continue
+        alpha = alpha.astype(np.uint16)
+        band[..., :3] = (band[..., :3] * alpha + 255 * (255 - alpha) + 127) // 255
+        band[..., 3] = 255
+    return pixels
+
+
+class ProgressFile:
+    """Wraps a binary file, reporting progress(fraction) as encoded bytes are written to it.
+
+    `expected` is the size the file should reach: exact for uncompressed formats, an
+    estimate otherwise, so the fraction stops short of 1 until finish() is called.
+    fileno() is refused, which keeps Pillow's encoders writing through write() in
+    blocks instead of straight to the file descriptor.
+    """
+
+    def __init__(self, fp, expected, progress=None):
+        self.fp = fp
+        self.expected = max(int(expected), 1)
+        self.progress = progress
+        self.written = 0
+        self._reported = 0
+
+    def write(self, data):
+        written = self.fp.write(data)
+        self.written += len(data)
+        if self.progress is not None:
+            # Reported in whole percents, so a big file doesn't flood the UI
+            percent = min(self.written * 100 // self.expected, PROGRESS_CAP)
+            if percent > self._reported:
+                self._reported = percent
+                self.progress(percent / 100)
+        return written
+
+    def fileno(self):
+        raise io.UnsupportedOperation('fileno')
+
+    def finish(self):
+        if self.progress is not None:
+            self.progress(1.0)
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+
+class ExportJob:
+    """Runs an export on a worker thread.
+
+    `export(progress)` does the work, calling progress(fraction) as it goes; once the
+    job is cancelled that call raises ExportCancelled, stopping the export at its next
+    report. on_progress(fraction), on_done(result) and on_error(exception) are called
+    on the worker thread, and not at all after cancel().
+    """
+
+    def __init__(self, export, on_progress=None, on_done=None, on_error=None):
+        self.export = export
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self._cancelled = threading.Event()
+        self.thread = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='export', daemon=True)
+        self.thread.start()
+        return self
+
+    def _progress(self, fraction):
+        if self.cancelled:
+            raise ExportCancelled()
+        if self.on_progress is not None:
+            self.on_progress(fraction)
+
+    def run(self):
+        try:
+            result = self.export(self._progress)
+            if self.on_done is not None and not self.cancelled:
+                self.on_done(result)
+        except ExportCancelled:
+            pass
+        except Exception as e:
+            if not self.cancelled and self.on_error is not None:
+                self.on_error(e)
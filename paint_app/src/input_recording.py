@@ -0,0 +1,145 @@
+# This file records the touch events that reach the canvas and replays them, so a real
+# drawing session can be reproduced to measure how responsive the canvas is. Every
+# down, move and up event is kept with its time and its position relative to the
+# widget; down events also carry the tool, brush style, color and line width in use,
+# which is everything the widget reads when it starts a stroke. Sessions are saved as
+# JSON lines: a header, then one event per line. replay() feeds them back through the
+# widget's touch handlers at the recorded pace or as fast as possible, timing every
+# handler and following the number of canvas instructions. Nothing here imports Kivy.
+import json
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+DOWN, MOVE, UP = 'down', 'move', 'up'
+FRAME = 'frame'  # Timings of tick() in replay reports
+FRAME_INTERVAL = 1 / 60  # Seconds between frames while replaying at the recorded pace
+
+
+class InputRecorder:
+    """Collects the touch events a PaintWidget receives"""
+
+    def __init__(self):
+        self.events = []   # [seconds since start, kind, x, y, touch id(, state for down events)]
+        self._start = time.perf_counter()
+
+    def record(self, kind, touch, widget):
+        event = [round(time.perf_counter() - self._start, 6), kind, touch.x - widget.x, touch.y - widget.y,
+                 getattr(touch, 'uid', 0)]
+        if kind == DOWN:
+            event.append({'tool': widget.tool_manager.current_tool.name,
+                          'style': widget.tool_manager.brush_style.name,
+                          'color': [float(c) for c in widget.current_color],
+                          'width': widget.line_width,
+                          'button': getattr(touch, 'button', None)})
+        self.events.append(event)
+
+    def save(self, path, widget):
+        header = {'version': FORMAT_VERSION, 'size': [widget.width, widget.height],
+                  'canvas': [widget.layers.width, widget.layers.height], 'events': len(self.events)}
+        with open(path, 'w') as f:
+            f.write(json.dumps(header) + '\n')
+            for event in self.events:
+                f.write(json.dumps(event) + '\n')
+
+
+def load_session(path):
+    """Read a recorded session, returning (header, events)"""
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get('version', 0) > FORMAT_VERSION:
+            raise ValueError(f"{path} was recorded by a newer version of Paint")
+        return header, [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayTouch:
+    """The parts of a Kivy touch the widget reads"""
+
+    def __init__(self, uid, x, y, button=None):
+        self.uid = uid
+        self.button = button
+        self.ud = {}
+        self.x, self.y, self.pos = x, y, (x, y)
+        self.dx = self.dy = 0
+
+    def move(self, x, y):
+        self.dx, self.dy = x - self.x, y - self.y
+        self.x, self.y, self.pos = x, y, (x, y)
+
+
+def _apply_state(widget, state):
+    # The Tool and BrushStyle enums are looked up through the widget's own values
+    manager = widget.tool_manager
+    tool = type(manager.current_tool)[state['tool']]
+    if manager.current_tool != tool:
+        widget.set_tool(tool)  # Only on a change: switching tools confirms a live shape
+    manager.set_brush_style(type(manager.brush_style)[state['style']])
+    widget.set_color(list(state['color']))
+    widget.set_line_width(state['width'])
+
+
+def replay(widget, events, speed=None, tick=None, frame_every=1):
+    """Feed recorded events to a widget and report how long its handlers took.
+
+    tick() should run a frame, e.g. Clock.tick. With `speed` (1.0 is the recorded pace)
+    events are spaced out as recorded and frames run while waiting; without it events
+    are sent back to back with a frame after every `frame_every` of them. Returns a dict
+    of latency percentiles in milliseconds per event kind and for frames, and the
+    instruction count's growth.
+    """
+    touches = {}
+    latencies = {DOWN: [], MOVE: [], UP: [], FRAME: []}
+
+    def frame():
+        began = time.perf_counter()
+        tick()
+        latencies[FRAME].append(time.perf_counter() - began)
+
+    start_count = peak = widget.instruction_count()
+    origin = events[0][0] if events else 0.0
+    start = time.perf_counter()
+    for number, event in enumerate(events, 1):
+        at, kind, x, y, uid = event[:5]
+        if speed:
+            while True:
+                wait = start + (at - origin) / speed - time.perf_counter()
+                if wait <= 0:
+                    break
+                if tick is not None:
+                    frame()
+                time.sleep(max(0.0, min(wait, FRAME_INTERVAL)))
+        x, y = x + widget.x, y + widget.y
+        if kind == DOWN:
+            state = event[5]
+            _apply_state(widget, state)
+            touch = touches[uid] = ReplayTouch(uid, x, y, state.get('button'))
+            handler = widget.on_touch_down
+        else:
+            touch = touches.get(uid)
+            if touch is None:
+                continue  # Recording started mid-touch
+            touch.move(x, y)
+            handler = widget.on_touch_move if kind == MOVE else widget.on_touch_up
+            if kind == UP:
+                del touches[uid]
+        began = time.perf_counter()
+        handler(touch)
+        latencies[kind].append(time.perf_counter() - began)
+        if tick is not None and not speed and number % frame_every == 0:
+            frame()
+        peak = max(peak, widget.instruction_count())
+    elapsed = time.perf_counter() - start
+    end_count = widget.instruction_count()
+
+    report = {'events': sum(len(latencies[kind]) for kind in (DOWN, MOVE, UP)), 'seconds': elapsed,
+              'recorded_seconds': events[-1][0] - events[0][0] if events else 0.0,
+              'latency_ms': {}, 'instructions': {'start': start_count, 'end': end_count, 'peak': peak,
+                                                 'growth': end_count - start_count}}
+    for kind, times in latencies.items():
+        if times:
+            ms = np.array(times) * 1000
+            report['latency_ms'][kind] = {
+                'count': len(times), 'p50': float(np.percentile(ms, 50)), 'p90': float(np.percentile(ms, 90)),
+                'p99': float(np.percentile(ms, 99)), 'max': float(ms.max()), 'total': float(ms.sum())}
+    return report
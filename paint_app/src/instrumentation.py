@@ -0,0 +1,154 @@
+# This file collects named counters, timers and gauges about a session for performance
+# analysis. It is off unless the PAINT_STATS environment variable is set, to the path of
+# the JSON report written when the app exits. While off every call returns straight
+# away and timer() hands back one shared do-nothing context, so the calls can stay in
+# the hot paths; code that would do work just to produce a value should check `enabled`
+# first. Probes are functions read only when a report is taken, for values such as the
+# number of canvas instructions that cost nothing to leave alone. Nothing here imports Kivy.
+#
+# Usage: PAINT_STATS=stats.json python src/main.py
+import atexit
+import json
+import os
+import threading
+import time
+
+enabled = False
+_counters = {}      # Name -> total
+_timers = {}        # Name -> [calls, total seconds, longest]
+_gauges = {}        # Name -> last value set
+_probes = {}        # Name -> function returning the current value
+_lock = threading.Lock()  # Export and image load jobs report from worker threads
+_started = time.time()
+_report_path = None
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable(report_path=None):
+    """Start collecting; with a path, the JSON report is written there when the process exits"""
+    global enabled, _report_path
+    enabled = True
+    if report_path is not None:
+        if _report_path is None:
+            atexit.register(lambda: write_report(_report_path))
+        _report_path = report_path
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Forget everything collected so far (probes stay registered)"""
+    global _started
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+        _gauges.clear()
+        _started = time.time()
+
+
+def count(name, amount=1):
+    """Add to a counter, e.g. bytes uploaded to textures"""
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def gauge(name, value):
+    """Set a value that goes up and down, e.g. the size of the canvas"""
+    if enabled:
+        _gauges[name] = value
+
+
+def record_time(name, seconds):
+    if not enabled:
+        return
+    with _lock:
+        timing = _timers.get(name)
+        if timing is None:
+            _timers[name] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+
+def timer(name):
+    """Context manager timing its block under `name`"""
+    return _Timer(name) if enabled else _NULL_TIMER
+
+
+def probe(name, func):
+    """Register func() to be read for `name` whenever a report is taken"""
+    _probes[name] = func
+
+
+def snapshot():
+    """Everything collected so far, as a JSON-serializable dict"""
+    with _lock:
+        counters = dict(_counters)
+        timers = {name: {'calls': calls, 'total': total, 'mean': total / calls, 'max': longest}
+                  for name, (calls, total, longest) in _timers.items()}
+        gauges = dict(_gauges)
+    for name, func in list(_probes.items()):
+        try:
+            gauges[name] = func()
+        except Exception as e:
+            gauges[name] = f"error: {e}"
+    return {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(_started)),
+            'seconds': time.time() - _started, 'counters': counters, 'timers': timers, 'gauges': gauges}
+
+
+def write_report(path):
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=1, sort_keys=True)
+
+
+def summary_lines():
+    """Short lines describing the snapshot, for an on-screen overlay"""
+    stats = snapshot()
+    lines = [f"{name}: {_format_count(name, value)}" for name, value in sorted(stats['gauges'].items())]
+    lines += [f"{name}: {_format_count(name, value)}" for name, value in sorted(stats['counters'].items())]
+    lines += [f"{name}: {timing['calls']}x, mean {timing['mean'] * 1000:.1f} ms, max {timing['max'] * 1000:.1f} ms"
+              for name, timing in sorted(stats['timers'].items())]
+    return lines
+
+
+def _format_count(name, value):
+    if name.endswith('bytes') and isinstance(value, (int, float)) and value >= 1 << 20:
+        return f"{value / (1 << 20):.1f} MB"
+    return str(value)
+
+
+if os.environ.get('PAINT_STATS'):
+    enable(os.environ['PAINT_STATS'])
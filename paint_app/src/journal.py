@@ -0,0 +1,314 @@
+# This file keeps a crash-safe journal of the drawing session for autosave.
+# Every committed stroke, shape and fill is appended to session.journal as its encoded
+# document record, and every so often the whole canvas is written as a checkpoint
+# project next to it. Anything that can't be replayed forward from a record (undo,
+# redo, opening an image, layer changes, resizing) takes a checkpoint straight away.
+# The files are written by a background thread: the UI thread only encodes a record or
+# copies the tiles changed since the last checkpoint and queues them, so drawing never
+# waits on the disk. After a crash, recover() opens the checkpoint and replays the
+# records journaled after it, or replays the whole journal onto a blank canvas of the
+# size its header records if the checkpoint is missing. Nothing here imports Kivy.
+#
+# Journal layout: header | entry | entry | ...
+#   header  MAGIC, format version and the canvas size when the journal was started
+#   entry   sequence number, payload length and CRC-32, then the payload: the record's
+#           RGBA color and line width followed by encode_records() of the record
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from document import Document, RecordKind
+from layers import Layer, LayerStack
+from project_file import RECORDS_PER_CHUNK, ProjectFile, decode_records, encode_records
+from raster_store import TileStore
+
+log = logging.getLogger(__name__)
+
+JOURNAL_NAME = 'session.journal'
+CHECKPOINT_NAME = 'checkpoint.paintproj'
+MAGIC = b'PAINTJNL'
+FORMAT_VERSION = 2
+CHECKPOINT_COMMANDS = 100  # Records journaled before a periodic checkpoint is due, bounding replay at recovery
+CHECKPOINT_SECONDS = 60    # ... or seconds since the last checkpoint, if anything was journaled
+FLUSH_SECONDS = 0.05       # How long the writer gathers entries before writing and syncing them together
+
+_HEADER = struct.Struct('<8sIII')  # magic, version, canvas width and height
+_ENTRY = struct.Struct('<QII')   # sequence number, payload length, CRC-32 of the payload
+_STYLE = struct.Struct('<5f')    # RGBA color and line width the record's palette indices stand for
+
+
+def default_directory():
+    """Where the app keeps its session journal"""
+    return os.path.join(os.path.expanduser('~'), 'Library', 'Application Support', 'Paint', 'journal')
+
+
+def has_session(directory):
+    """Whether a journaled session was left behind, e.g. by a crash"""
+    if os.path.exists(os.path.join(directory, CHECKPOINT_NAME)):
+        return True
+    return next(read_entries(os.path.join(directory, JOURNAL_NAME)), None) is not None
+
+
+def discard(directory):
+    """Delete a journaled session"""
+    for name in (JOURNAL_NAME, CHECKPOINT_NAME):
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def _read(path):
+    """(canvas width, canvas height, file contents) of a journal, or None if there is none"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < _HEADER.size:
+        return None
+    magic, version, width, height = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    return width, height, data
+
+
+def read_entries(path):
+    """Yield (sequence number, color, width, record) for each intact journal entry.
+
+    Reading stops at the first torn or corrupt entry, which is where a crash cut the
+    journal off.
+    """
+    journal = _read(path)
+    if journal is None:
+        return
+    data = journal[2]
+    offset = _HEADER.size
+    while offset + _ENTRY.size <= len(data):
+        seq, length, crc = _ENTRY.unpack_from(data, offset)
+        payload = data[offset + _ENTRY.size:offset + _ENTRY.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        offset += _ENTRY.size + length
+        style = _STYLE.unpack_from(payload)
+        for record in decode_records(payload[_STYLE.size:]):
+            yield seq, style[:4], style[4], record
+
+
+def recover(directory):
+    """Rebuild a journaled session: returns (layers, document, records replayed).
+
+    The layers come from the checkpoint, and the records journaled after it are drawn
+    onto them with the rasterizer, the same way Document.render() replays them. Without
+    a checkpoint every record is drawn onto a blank canvas of the journal's size.
+    """
+    checkpoint_path = os.path.join(directory, CHECKPOINT_NAME)
+    if os.path.exists(checkpoint_path):
+        project, layers, document = ProjectFile.open(checkpoint_path)
+        start = project.meta.get('journal_seq', 0)
+    else:
+        width, height, _ = _read(os.path.join(directory, JOURNAL_NAME))
+        layers, document, start = LayerStack(width, height), Document(width, height), 0
+    canvases = {}  # Layer id -> pixels being replayed onto
+    replayed = 0
+    for seq, color, width, record in read_entries(os.path.join(directory, JOURNAL_NAME)):
+        layer = layers.layer_by_id(record.layer)
+        if seq <= start or layer is None:
+            continue
+        # Palette indices are looked up again, in case the palettes differ
+        record.color = document.color_index(color)
+        if record.kind != RecordKind.FILL:
+            record.width = document.width_index(width)
+        pixels = canvases.get(layer.id)
+        if pixels is None:
+            pixels = canvases[layer.id] = layer.raster.to_array()
+        document.render_record(pixels, record, transparent=layer.raster.background[3] < 255)
+        document.add(record)
+        replayed += 1
+    for layer_id, pixels in canvases.items():
+        layers.layer_by_id(layer_id).raster.write_region(0, 0, pixels)
+    return layers, document, replayed
+
+
+class _Checkpoint:
+    """State of the canvas to write as a checkpoint, captured on the UI thread"""
+    __slots__ = ('seq', 'width', 'height', 'tile_size', 'active', 'layers', 'document')
+
+
+class Journal:
+    """Appends committed records to a session journal on a background thread.
+
+    start() writes the first checkpoint, append() journals a record, and checkpoint()
+    captures the canvas (only the tiles changed since the last one are copied). Call
+    them from the thread that changes the canvas; none of them touch the disk.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.seq = 0                # Sequence number of the last record journaled
+        self.pending = 0            # Records journaled since the last checkpoint
+        self.checkpoints = 0
+        self.error = None           # First exception the writer hit, after which it stops
+        self._checkpoint_time = time.monotonic()
+        self._seen = {}             # Layer id -> (tile store, {tile key: revision}) at the last checkpoint
+        self._queue = queue.Queue()
+        self._thread = None
+        # Owned by the writer thread
+        self._file = None
+        self._project = None
+        self._mirror = {}           # Layer id -> Layer holding copies of the checkpointed tiles
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.directory, JOURNAL_NAME)
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.directory, CHECKPOINT_NAME)
+
+    @property
+    def checkpoint_due(self):
+        """Whether enough has been journaled since the last checkpoint to take another"""
+        return self.pending >= CHECKPOINT_COMMANDS or (
+            self.pending > 0 and time.monotonic() - self._checkpoint_time >= CHECKPOINT_SECONDS)
+
+    def start(self, layers, document):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='journal', daemon=True)
+        self._thread.start()
+        self.checkpoint(layers, document)
+
+    def append(self, record, document):
+        """Journal a stroke, shape or fill record that has just been added to the document"""
+        if record.kind == RecordKind.IMAGE:
+            raise ValueError("Image records are kept by checkpoints, not journaled")
+        self.seq += 1
+        self.pending += 1
+        width = document.widths[record.width] if record.kind != RecordKind.FILL else 0.0
+        payload = _STYLE.pack(*document.colors[record.color], width) + encode_records([record])
+        self._queue.put(('entry', self.seq, payload))
+
+    def checkpoint(self, layers, document):
+        """Queue a checkpoint of the canvas as it is now"""
+        state = _Checkpoint()
+        state.seq = self.seq
+        state.width, state.height = layers.width, layers.height
+        state.tile_size = layers.layers[0].raster.tile_size
+        state.active = layers.active_index
+        state.layers = [self._capture(layer) for layer in layers.layers]
+        self._seen = {layer.id: self._seen[layer.id] for layer in layers.layers}
+        # Only records added since the last checkpoint are encoded to update the chunk
+        # checksums; the writer then encodes just the chunks that changed
+        document.record_chunks(RECORDS_PER_CHUNK)
+        state.document = document.copy()
+        self.pending = 0
+        self._checkpoint_time = time.monotonic()
+        self._queue.put(('checkpoint', state))
+
+    def _capture(self, layer):
+        """(id, name, opacity, visible, background, changed tiles, dropped tile keys) of a layer"""
+        raster = layer.raster
+        seen_raster, seen = self._seen.get(layer.id, (None, {}))
+        if seen_raster is not raster:
+            seen = {}
+        revisions = {key: raster.tile_revisions.get(key, 0) for key in raster.tile_keys()}
+        size = raster.tile_size
+        tiles = {}
+        for (row, col), revision in revisions.items():
+            if seen.get((row, col)) != revision:
+                x, y = col * size, row * size
+                tiles[(row, col)] = raster.read_region(x, y, min(size, raster.width - x),
+                                                       min(size, raster.height - y))
+        self._seen[layer.id] = (raster, revisions)
+        return (layer.id, layer.name, layer.opacity, layer.visible, tuple(int(c) for c in raster.background),
+                tiles, set(seen) - set(revisions))
+
+    def close(self, discard_session=True):
+        """Stop the writer once it has caught up, deleting the session files unless asked to keep them"""
+        if self._thread is None:
+            return
+        self._queue.put(('close', discard_session))
+        self._thread.join()
+        self._thread = None
+
+    # Writer thread
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Wake at most every FLUSH_SECONDS, so a burst of strokes shares one write and fsync
+            time.sleep(FLUSH_SECONDS)
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for index, item in enumerate(batch):
+                if item[0] == 'close':
+                    self._finish(item[1])
+                    return
+                if self.error is not None:
+                    continue
+                try:
+                    if item[0] == 'entry':
+                        _, seq, payload = item
+                        self._file.write(_ENTRY.pack(seq, len(payload), zlib.crc32(payload)) + payload)
+                    else:
+                        # Back-to-back checkpoints, e.g. while a window is resized, only write the last
+                        following = batch[index + 1][0] if index + 1 < len(batch) else None
+                        self._write_checkpoint(item[1], save=following != 'checkpoint')
+                except Exception as e:
+                    self.error = e
+                    log.warning("Journal stopped: %s", e)
+            if self._file is not None and self.error is None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def _write_checkpoint(self, state, save=True):
+        layers = []
+        for layer_id, name, opacity, visible, background, tiles, dropped in state.layers:
+            layer = self._mirror.get(layer_id)
+            if layer is None or tuple(int(c) for c in layer.raster.background) != background:
+                layer = Layer(layer_id, name, TileStore(state.width, state.height, state.tile_size, background))
+                self._mirror[layer_id] = layer
+            layer.name, layer.opacity, layer.visible = name, opacity, visible
+            raster = layer.raster
+            raster.resize(state.width, state.height)
+            for key in dropped:
+                raster.tiles.pop(key, None)
+                raster.tile_revisions.pop(key, None)
+            size = raster.tile_size
+            for (row, col), pixels in tiles.items():
+                raster.write_region(col * size, row * size, pixels)
+            layers.append(layer)
+        self._mirror = {layer.id: layer for layer in layers}
+        if not save:
+            return
+        stack = LayerStack(state.width, state.height, layers, state.active)
+        if self._project is None:
+            self._project = ProjectFile(self.checkpoint_path)
+        self._project.meta = {'journal_seq': state.seq}
+        self._project.save(stack, state.document)
+        self.checkpoints += 1
+
+        # The checkpoint holds everything journaled so far, so start the journal over
+        temp_path = self.journal_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, state.width, state.height))
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(temp_path, self.journal_path)
+        self._file = open(self.journal_path, 'ab')
+
+    def _finish(self, discard_session):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if discard_session:
+            discard(self.directory)
@@ -0,0 +1,133 @@
+# This file defines the layer stack. Each layer owns its own tile store; the stack keeps
+# their order, visibility and opacity and can flatten them into one image with NumPy.
+# GPU caching of the layers lives in compositor.py, so nothing here imports Kivy.
+import numpy as np
+
+from raster_store import TileStore, BACKGROUND
+
+TRANSPARENT = (0, 0, 0, 0)
+FLATTEN_BAND = 256  # Rows composited at a time, to bound the float working set
+
+
+class Layer:
+    """One canvas layer: its pixels and how it blends"""
+
+    def __init__(self, layer_id, name, raster, opacity=1.0, visible=True):
+        self.id = layer_id
+        self.name = name
+        self.raster = raster
+        self.opacity = opacity
+        self.visible = visible
+
+
+def unpremultiply(pixels):
+    """Convert premultiplied RGBA (as read back from a blended Fbo) to straight alpha, in place"""
+    alpha = pixels[..., 3:].astype(np.float32)
+    partial = (alpha > 0) & (alpha < 255)
+    rgb = pixels[..., :3].astype(np.float32) * 255 / np.maximum(alpha, 1)
+    pixels[..., :3] = np.where(partial, np.clip(np.rint(rgb), 0, 255), pixels[..., :3]).astype(np.uint8)
+    return pixels
+
+
+def flatten_arrays(layers, height, width, out=None):
+    """Composite (reader, opacity) pairs bottom-up with the "over" operator.
+
+    reader(y, h) returns the (h, width, 4) band of a layer's rows y..y+h, so only one
+    band of each layer is held as floats at a time. Returns straight-alpha uint8 RGBA.
+    """
+    if out is None:
+        out = np.empty((height, width, 4), dtype=np.uint8)
+    for y in range(0, height, FLATTEN_BAND):
+        h = min(FLATTEN_BAND, height - y)
+        color = np.zeros((h, width, 3), dtype=np.float32)  # Premultiplied
+        alpha = np.zeros((h, width, 1), dtype=np.float32)
+        for read, opacity in layers:
+            band = read(y, h).astype(np.float32) / 255
+            a = band[..., 3:] * opacity
+            color = band[..., :3] * a + color * (1 - a)
+            alpha = a + alpha * (1 - a)
+        straight = color / np.maximum(alpha, 1e-6)
+        out[y:y + h, :, :3] = np.rint(np.clip(straight, 0, 1) * 255)
+        out[y:y + h, :, 3:] = np.rint(alpha * 255)
+    return out
+
+
+class LayerStack:
+    """Ordered layers, bottom first, with one of them active for drawing"""
+
+    def __init__(self, width, height, layers=None, active_index=0):
+        if not layers:
+            layers = [Layer(0, 'Background', TileStore(width, height, background=BACKGROUND))]
+        self.layers = list(layers)
+        self.active_index = active_index
+        self._next_id = max(layer.id for layer in self.layers) + 1
+
+    @property
+    def active(self):
+        return self.layers[self.active_index]
+
+    @property
+    def width(self):
+        return self.layers[0].raster.width
+
+    @property
+    def height(self):
+        return self.layers[0].raster.height
+
+    def layer_by_id(self, layer_id):
+        for layer in self.layers:
+            if layer.id == layer_id:
+                return layer
+        return None
+
+    def add_layer(self, name=None):
+        """Add a transparent layer above the active one and make it active"""
+        layer_id = self._next_id
+        self._next_id += 1
+        raster = TileStore(self.width, self.height, background=TRANSPARENT)
+        layer = Layer(layer_id, name or f'Layer {layer_id}', raster)
+        self.active_index += 1
+        self.layers.insert(self.active_index, layer)
+        return layer
+
+    def remove_layer(self, index=None):
+        """Remove a layer (the active one by default); the last layer cannot be removed"""
+        if len(self.layers) == 1:
+            return None
+        index = self.active_index if index is None else index
+        layer = self.layers.pop(index)
+        if self.active_index > index or self.active_index == len(self.layers):
+            self.active_index -= 1
+        return layer
+
+    def move_layer(self, index, new_index):
+        """Move a layer to a new position in the stack; the same layer stays active"""
+        new_index = max(0, min(new_index, len(self.layers) - 1))
+        active = self.active
+        self.layers.insert(new_index, self.layers.pop(index))
+        self.active_index = self.layers.index(active)
+
+    def set_active(self, index):
+        self.active_index = max(0, min(index, len(self.layers) - 1))
+
+    def resize(self, width, height):
+        for layer in self.layers:
+            layer.raster.resize(width, height)
+
+    def composite_order(self):
+        """(layer id, opacity, background) of the visible layers, bottom first"""
+        return [(layer.id, layer.opacity, tuple(int(c) for c in layer.raster.background))
+                for layer in self.layers if layer.visible]
+
+    def flatten(self):
+        """Return the visible layers composited into one (height, width, 4) RGBA array"""
+        return self.flatten_region(0, 0, self.width, self.height)
+
+    def flatten_region(self, x, y, width, height):
+        """Return the visible layers composited over a region that lies inside the canvas"""
+        visible = [layer for layer in self.layers if layer.visible]
+        if len(visible) == 1 and visible[0].opacity == 1 and visible[0] is self.layers[0]:
+            return visible[0].raster.read_region(x, y, width, height)
+        readers = [(lambda y0, h, raster=layer.raster: raster.read_region(x, y + y0, width, h), layer.opacity)
+                   for layer in visible]
+        return flatten_arrays(readers, height, width)
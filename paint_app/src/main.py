@@ -25,7 +25,11 @@ from kivy.properties import StringProperty, ObjectProperty, ListProperty
 from kivy.core.text import LabelBase
 from kivy.animation import Animation
 from kivy.uix.filechooser import FileChooserListView
-from file_utils import FileManager, SUPPORTED_FORMATS
+from file_utils import FileManager, SUPPORTED_FORMATS, export_pixels, save_pixels
+from image_writer import ExportJob
+from project_file import EXTENSION as PROJECT_EXTENSION
+import journal
+import instrumentation
 from kivy.uix.progressbar import ProgressBar
 import threading
 import os
@@ -37,6 +41,9 @@ from file_utils import SUPPORTED_EXPORT_FORMATS, ExportSettings
 from AppKit import NSMenuItem, NSPopUpButton, NSSlider, NSButton, NSOnState, NSOffState
 from Foundation import NSObject
 import objc
+import logging
+
+log = logging.getLogger(__name__)
 
 # Initialize font before creating any widgets
 FontManager.initialize()
@@ -127,6 +134,7 @@ class SliderHandler(NSObject):
         if self is None: return None
         self.dpi_value = None
         self.quality_value = None
+        self.on_change = None  # Called after any control changes, to refresh the size estimate
         return self
 
     def setupWithDpiValue_qualityValue_(self, dpi_value, quality_value):
@@ -144,8 +152,10 @@ class SliderHandler(NSObject):
                 self.dpi_value.setStringValue_(value)
             elif tag == 2:  # Quality slider
                 self.quality_value.setStringValue_(value)
+            if self.on_change is not None:
+                self.on_change()
         except Exception as e:
-            print(f"Error in slider change: {e}")
+            log.exception("Error in slider change: %s", e)
 
 class PaintApp(App):
     def __init__(self, **kwargs):
@@ -181,7 +191,7 @@ class PaintApp(App):
             return root
             
         except Exception as e:
-            print(f"Error loading application: {e}")
+            log.exception("Error loading application: %s", e)
             return None
 
     def select_tool(self, tool_name):
@@ -195,7 +205,7 @@ class PaintApp(App):
                     child.active = (child.tool == tool_name)
                     
         except KeyError:
-            print(f"Invalid tool: {tool_name}")
+            log.warning("Invalid tool: %s", tool_name)
 
     def _on_keyboard(self, window, key, scancode, codepoint, modifier):
         paint_widget = self.root.ids.paint_widget
@@ -224,6 +234,27 @@ class PaintApp(App):
         if codepoint == 'o' and modifier == ['meta']:
             self.open_image()
             return True
+
+        # Command + plus / minus / 0 (zoom in, zoom out, actual size)
+        if codepoint in ('=', '+') and modifier == ['meta']:
+            paint_widget.zoom_in()
+            return True
+
+        if codepoint == '-' and modifier == ['meta']:
+            paint_widget.zoom_out()
+            return True
+
+        if codepoint == '0' and modifier == ['meta']:
+            paint_widget.actual_size()
+            return True
+
+        # Return fills a previewed fill region, escape drops it
+        if paint_widget.has_fill_preview and key in (13, 27):
+            if key == 13:
+                paint_widget.commit_fill_preview()
+            else:
+                paint_widget.cancel_fill_preview()
+            return True
         
         return False
 
@@ -237,7 +268,7 @@ class PaintApp(App):
             save_panel = NSSavePanel.alloc().init()
             save_panel.setTitle_("Save Image")
             save_panel.setNameFieldStringValue_("Untitled")  # Remove .png extension
-            save_panel.setAllowedFileTypes_(["png", "jpg", "jpeg"])  # Allowed formats
+            save_panel.setAllowedFileTypes_(["png", "jpg", "jpeg", "paintproj"])  # Allowed formats
             save_panel.setAllowsOtherFileTypes_(False)  # Restrict to allowed types
             save_panel.setExtensionHidden_(True)  # Show the file extension field
 
@@ -255,7 +286,7 @@ class PaintApp(App):
 
             # Create pop-up button for format selection
             format_pop_up = NSPopUpButton.alloc().initWithFrame_(NSMakeRect(65, 15, 120, 25))
-            format_pop_up.addItemsWithTitles_(["PNG", "JPEG"])
+            format_pop_up.addItemsWithTitles_(["PNG", "JPEG", "Paint Project"])
             format_pop_up.selectItemWithTitle_("PNG")  # Set default selection
 
             # Add label and pop-up button to the accessory view
@@ -284,11 +315,25 @@ class PaintApp(App):
                     extension = ".png"
                 elif selected_format == "JPEG":
                     extension = ".jpg"
+                elif selected_format == "Paint Project":
+                    extension = PROJECT_EXTENSION
 
                 # Replace existing extension with the selected one
                 filename, ext = os.path.splitext(filename)
                 filename += extension
 
+                if selected_format != "Paint Project":
+                    # Images are encoded on a worker thread while the progress bar follows along
+                    def saved(result, position):
+                        self._finish_save(None, True, filename, position)
+                        if callback:
+                            callback()
+
+                    self._run_export(
+                        lambda pixels, progress: save_pixels(pixels, filename, selected_format, progress=progress),
+                        saved, "Error while saving")
+                    return
+
                 # Show progress dialog
                 progress = ModalView(size_hint=(0.4, 0.2))
                 progress_bar = ProgressBar(max=100, value=0)
@@ -298,21 +343,12 @@ class PaintApp(App):
                 # Save the file on the main thread
                 def save_on_main_thread(dt):
                     try:
-                        file_format = selected_format
                         progress_bar.value = 50
-
-                        # Save the file
-                        success = FileManager.save_canvas_as_image(
-                            self.root.ids.paint_widget,
-                            filename,
-                            file_format=file_format
-                        )
+                        success = FileManager.save_project(self.root.ids.paint_widget, filename)
                         progress_bar.value = 100
                         self._finish_save(progress, success, filename)
                         if success and callback:
                             callback()
-                        elif not success:
-                            self.show_error("Failed to save file")
                     except Exception as e:
                         self._handle_save_error(progress, str(e))
 
@@ -329,11 +365,61 @@ class PaintApp(App):
             if callback:
                 callback()
 
-    def _finish_save(self, progress, success, filename):
-        """Handle completion of save operation"""
-        progress.dismiss()
+    def _run_export(self, export, on_success, error_prefix):
+        """Encode a snapshot of the canvas on a worker thread, with a small progress panel in the corner.
+
+        export(pixels, progress) writes the file, calling progress(fraction) as it goes;
+        on_success(result, position) runs on the main thread once it has finished, with the
+        history position the snapshot was taken at.
+        """
+        # The canvas stays usable while the worker encodes, so the export works from a copy
+        paint_widget = self.root.ids.paint_widget
+        pixels = paint_widget.get_pixels()
+        position = paint_widget.history_position()
+
+        panel = BoxLayout(orientation='horizontal', padding=6, spacing=6,
+                          size_hint=(None, None), size=(300, 40), pos=(Window.width - 308, 8))
+        progress_bar = ProgressBar(max=100, value=0)
+        cancel_button = Button(text='Cancel', size_hint_x=None, width=70)
+        panel.add_widget(progress_bar)
+        panel.add_widget(cancel_button)
+
+        def done(result):
+            Window.remove_widget(panel)
+            on_success(result, position)
+
+        def failed(error):
+            Window.remove_widget(panel)
+            self.show_error(f"{error_prefix}: {error}")
+
+        def set_progress(fraction):
+            progress_bar.value = fraction * 100
+
+        # The job calls back on its own thread; the widgets are only touched from the main thread
+        job = ExportJob(lambda report: export(pixels, report),
+                        on_progress=lambda fraction: Clock.schedule_once(lambda dt: set_progress(fraction)),
+                        on_done=lambda result: Clock.schedule_once(lambda dt: done(result)),
+                        on_error=lambda error: Clock.schedule_once(lambda dt: failed(error)))
+
+        def cancel(*args):
+            job.cancel()
+            Window.remove_widget(panel)
+
+        cancel_button.bind(on_release=cancel)
+        Window.add_widget(panel)
+        job.start()
+        return job
+
+    def _finish_save(self, progress, success, filename, position=None):
+        """Handle completion of save operation
+
+        position is the history position the saved pixels were taken at, for saves that
+        ran while the canvas stayed editable; the document is only marked clean if it still matches.
+        """
+        if progress is not None:
+            progress.dismiss()
         if success:
-            self.root.ids.paint_widget.clear_unsaved_changes()
+            self.root.ids.paint_widget.clear_unsaved_changes(position)
             self.title = f"Paint - {os.path.basename(filename)}"
         else:
             self.show_error("Failed to save file")
@@ -389,6 +475,68 @@ class PaintApp(App):
     def on_start(self):
         # Ensure icons are loaded when the app starts
         self.icon_manager = IconManager.get_instance()
+        # Offer back a session the last run left behind, then journal this one
+        directory = journal.default_directory()
+        if journal.has_session(directory):
+            self.offer_recovery(directory)
+        else:
+            self.root.ids.paint_widget.start_journal(directory)
+        if instrumentation.enabled:
+            self.show_stats_overlay()
+        if os.environ.get('PAINT_RECORD'):
+            # Saved on exit, for benchmarks/replay_session.py
+            self.root.ids.paint_widget.start_recording()
+
+    def show_stats_overlay(self):
+        """Show the instrumentation counters and timers in a corner of the window, refreshed every second"""
+        overlay = Label(font_size=11, halign='left', valign='bottom', color=(0.1, 0.1, 0.1, 0.8),
+                        size_hint=(None, None), size=(380, 220), pos=(8, 8))
+        overlay.bind(size=overlay.setter('text_size'))
+
+        def refresh(dt):
+            overlay.text = '\n'.join(instrumentation.summary_lines())
+
+        refresh(0)
+        Window.add_widget(overlay)
+        Clock.schedule_interval(refresh, 1)
+
+    def on_stop(self):
+        # A clean exit leaves nothing to recover
+        self.root.ids.paint_widget.stop_journal(discard=True)
+        if os.environ.get('PAINT_RECORD'):
+            self.root.ids.paint_widget.stop_recording(os.environ['PAINT_RECORD'])
+
+    def offer_recovery(self, directory):
+        """Ask whether to restore the session journaled before Paint last quit unexpectedly"""
+        paint_widget = self.root.ids.paint_widget
+        content = BoxLayout(orientation='vertical', spacing=10)
+        content.add_widget(Label(text='Paint quit unexpectedly.\nRecover your last drawing?', halign='center'))
+        buttons = BoxLayout(size_hint_y=None, height=40, spacing=10)
+        discard_button = Button(text='Discard')
+        recover_button = Button(text='Recover')
+        buttons.add_widget(discard_button)
+        buttons.add_widget(recover_button)
+        content.add_widget(buttons)
+        popup = Popup(title='Recover Session', content=content, size_hint=(0.4, 0.3), auto_dismiss=False)
+
+        def recover(*args):
+            popup.dismiss()
+            try:
+                replayed = paint_widget.recover_session(directory)
+                log.info("Recovered session, replaying %d journaled records", replayed)
+                self.title = "Paint - Recovered"
+            except Exception as e:
+                self.show_error(f"Could not recover the session: {e}")
+            paint_widget.start_journal(directory)
+
+        def discard(*args):
+            popup.dismiss()
+            journal.discard(directory)
+            paint_widget.start_journal(directory)
+
+        recover_button.bind(on_release=recover)
+        discard_button.bind(on_release=discard)
+        popup.open()
 
     def create_unsaved_changes_dialog(self, on_save, on_dont_save, on_cancel):
         """Create and return a styled save changes dialog"""
@@ -438,7 +586,7 @@ class PaintApp(App):
             # Create open panel
             open_panel = NSOpenPanel.alloc().init()
             open_panel.setTitle_("Open Image")
-            open_panel.setAllowedFileTypes_(["png", "jpg", "jpeg", "bmp"])
+            open_panel.setAllowedFileTypes_(["png", "jpg", "jpeg", "bmp", "paintproj"])
             open_panel.setAllowsMultipleSelection_(False)
             # Remember last directory
             initial_dir = FileManager.get_last_directory()
@@ -449,18 +597,23 @@ class PaintApp(App):
 
             if response == NSModalResponseOK:
                 filename = open_panel.URLs()[0].path()
-                print(f"Selected file: {filename}")  # Add this line for debugging
+                log.debug("Selected file: %s", filename)
                 # Update last directory
                 FileManager.set_last_directory(os.path.dirname(filename))
-                # Load the image onto the canvas
-                success = self.root.ids.paint_widget.load_image(filename)
-                if success:
-                    # Clear undo/redo stacks
-                    self.root.ids.paint_widget.clear_undo_history()
-                    # Update window title
-                    self.title = f"Paint - {os.path.basename(filename)}"
+                def opened(success):
+                    if success:
+                        # Clear undo/redo stacks
+                        self.root.ids.paint_widget.clear_undo_history()
+                        # Update window title
+                        self.title = f"Paint - {os.path.basename(filename)}"
+                    else:
+                        self.show_error("Failed to open image.")
+
+                # Load the project or image onto the canvas; images decode in the background
+                if filename.endswith(PROJECT_EXTENSION):
+                    opened(FileManager.open_project(self.root.ids.paint_widget, filename))
                 else:
-                    self.show_error("Failed to open image.")
+                    self.root.ids.paint_widget.load_image_async(filename, on_done=opened)
         except Exception as e:
             self.show_error(f"Error opening image: {str(e)}")
 
@@ -473,63 +626,93 @@ class PaintApp(App):
             save_panel.setNameFieldStringValue_("Untitled")
             
             # Create accessory view with more vertical space for controls
-            accessory_view = NSView.alloc().initWithFrame_(NSMakeRect(0, 0, 300, 150))
+            accessory_view = NSView.alloc().initWithFrame_(NSMakeRect(0, 0, 300, 175))
             
             # Format selection (near top)
-            format_label = NSTextField.alloc().initWithFrame_(NSMakeRect(10, 120, 60, 25))
+            format_label = NSTextField.alloc().initWithFrame_(NSMakeRect(10, 145, 60, 25))
             format_label.setStringValue_("Format:")
             format_label.setEditable_(False)
             format_label.setBezeled_(False)
             format_label.setDrawsBackground_(False)
             
-            format_popup = NSPopUpButton.alloc().initWithFrame_(NSMakeRect(80, 120, 200, 25))
+            format_popup = NSPopUpButton.alloc().initWithFrame_(NSMakeRect(80, 145, 200, 25))
             formats = list(SUPPORTED_EXPORT_FORMATS.keys())
             format_popup.addItemsWithTitles_(formats)
             
             # DPI selection with value display
-            dpi_label = NSTextField.alloc().initWithFrame_(NSMakeRect(10, 90, 60, 25))
+            dpi_label = NSTextField.alloc().initWithFrame_(NSMakeRect(10, 115, 60, 25))
             dpi_label.setStringValue_("DPI:")
             dpi_label.setEditable_(False)
             dpi_label.setBezeled_(False)
             dpi_label.setDrawsBackground_(False)
             
-            dpi_value = NSTextField.alloc().initWithFrame_(NSMakeRect(250, 90, 40, 25))
+            dpi_value = NSTextField.alloc().initWithFrame_(NSMakeRect(250, 115, 40, 25))
             dpi_value.setStringValue_("300")
             dpi_value.setEditable_(False)
             dpi_value.setBezeled_(False)
             dpi_value.setDrawsBackground_(False)
             
-            dpi_slider = NSSlider.alloc().initWithFrame_(NSMakeRect(80, 90, 160, 25))
+            dpi_slider = NSSlider.alloc().initWithFrame_(NSMakeRect(80, 115, 160, 25))
             dpi_slider.setMinValue_(72)
             dpi_slider.setMaxValue_(600)
             dpi_slider.setIntValue_(300)
             
             # Quality selection with value display
-            quality_label = NSTextField.alloc().initWithFrame_(NSMakeRect(10, 60, 60, 25))
+            quality_label = NSTextField.alloc().initWithFrame_(NSMakeRect(10, 85, 60, 25))
             quality_label.setStringValue_("Quality:")
             quality_label.setEditable_(False)
             quality_label.setBezeled_(False)
             quality_label.setDrawsBackground_(False)
             
-            quality_value = NSTextField.alloc().initWithFrame_(NSMakeRect(250, 60, 40, 25))
+            quality_value = NSTextField.alloc().initWithFrame_(NSMakeRect(250, 85, 40, 25))
             quality_value.setStringValue_("90")
             quality_value.setEditable_(False)
             quality_value.setBezeled_(False)
             quality_value.setDrawsBackground_(False)
             
-            quality_slider = NSSlider.alloc().initWithFrame_(NSMakeRect(80, 60, 160, 25))
+            quality_slider = NSSlider.alloc().initWithFrame_(NSMakeRect(80, 85, 160, 25))
             quality_slider.setMinValue_(1)
             quality_slider.setMaxValue_(100)
             quality_slider.setIntValue_(90)
             
             # Transparency checkbox
-            transparency_check = NSButton.alloc().initWithFrame_(NSMakeRect(10, 30, 200, 25))
+            transparency_check = NSButton.alloc().initWithFrame_(NSMakeRect(10, 55, 200, 25))
             transparency_check.setTitle_("Preserve Transparency")
             transparency_check.setButtonType_(1)
             transparency_check.setState_(NSOnState)
             
+            # Estimated size of the export, kept up to date as the settings change
+            size_value = NSTextField.alloc().initWithFrame_(NSMakeRect(10, 10, 280, 25))
+            size_value.setEditable_(False)
+            size_value.setBezeled_(False)
+            size_value.setDrawsBackground_(False)
+
+            def size_text(kb):
+                return f"Estimated size: {kb / 1024:.1f} MB" if kb >= 1024 else f"Estimated size: {kb:.0f} KB"
+
+            # Estimates not cached yet arrive from a worker thread; only the latest request is shown
+            requests = [0]
+
+            def update_size_estimate():
+                requests[0] += 1
+                request = requests[0]
+
+                def ready(kb):
+                    if request == requests[0]:
+                        size_value.performSelectorOnMainThread_withObject_waitUntilDone_(
+                            'setStringValue:', size_text(kb), False)
+
+                kb = FileManager.estimate_file_size(
+                    self.root.ids.paint_widget,
+                    format_popup.titleOfSelectedItem(),
+                    quality=int(quality_slider.doubleValue()),
+                    transparency=(transparency_check.state() == NSOnState),
+                    on_ready=ready)
+                size_value.setStringValue_("Estimating size..." if kb is None else size_text(kb))
+
             # Assign dpi_value and quality_value to handler
             self.slider_handler.setupWithDpiValue_qualityValue_(dpi_value, quality_value)
+            self.slider_handler.on_change = update_size_estimate
             
             # Tag the sliders to identify them
             dpi_slider.setTag_(1)
@@ -544,6 +727,13 @@ class PaintApp(App):
             
             quality_slider.setTarget_(self.slider_handler)
             quality_slider.setAction_(action)
+
+            # The format and transparency change the estimate too
+            format_popup.setTarget_(self.slider_handler)
+            format_popup.setAction_(action)
+            transparency_check.setTarget_(self.slider_handler)
+            transparency_check.setAction_(action)
+            update_size_estimate()
             
             # Store handler reference to prevent garbage collection
             self._current_handler = self.slider_handler
@@ -552,7 +742,7 @@ class PaintApp(App):
             for control in [format_label, format_popup, 
                             dpi_label, dpi_slider, dpi_value,
                             quality_label, quality_slider, quality_value,
-                            transparency_check]:
+                            transparency_check, size_value]:
                 accessory_view.addSubview_(control)
             
             save_panel.setAccessoryView_(accessory_view)
@@ -565,6 +755,7 @@ class PaintApp(App):
             
             # Run panel
             response = save_panel.runModal()
+            self.slider_handler.on_change = None
             
             if response == NSModalResponseOK:
                 filename = save_panel.URL().path()
@@ -578,33 +769,12 @@ class PaintApp(App):
                     transparency=(transparency_check.state() == NSOnState)
                 )
                 
-                # Show progress dialog
-                progress = ModalView(size_hint=(0.4, 0.2))
-                progress_bar = ProgressBar(max=100, value=0)
-                progress.add_widget(progress_bar)
-                progress.open()
-                
-                def export_on_main_thread(dt):
-                    try:
-                        progress_bar.value = 50
-                        success = FileManager.export_canvas(
-                            self.root.ids.paint_widget,
-                            filename,
-                            settings
-                        )
-                        progress_bar.value = 100
-                        progress.dismiss()
-                        
-                        if success:
-                            self.title = f"Paint - {os.path.basename(filename)} (Exported)"
-                        else:
-                            self.show_error("Failed to export file")
-                            
-                    except Exception as e:
-                        progress.dismiss()
-                        self.show_error(f"Error during export: {str(e)}")
-                
-                Clock.schedule_once(export_on_main_thread, 0)
+                def exported(output_path, position):
+                    self.title = f"Paint - {os.path.basename(output_path)} (Exported)"
+
+                self._run_export(
+                    lambda pixels, progress: export_pixels(pixels, filename, settings, progress),
+                    exported, "Error during export")
                 
         except Exception as e:
             self.show_error(f"Error in export dialog: {str(e)}")
@@ -613,4 +783,4 @@ if __name__ == '__main__':
     try:
         PaintApp().run()
     except Exception as e:
-        print(f"Application failed to start: {e}")
+        log.exception("Application failed to start: %s", e)
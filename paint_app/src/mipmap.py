@@ -0,0 +1,101 @@
+# This file builds mip levels over a tile store for zoomed-out views.
+# Level k halves level k-1 in both directions, and its tiles use the same tile grid size,
+# so a level-k tile stands for (tile_size * 2**k) image pixels each way. Tiles are built
+# from the level below on first use and kept until the pixels under them change, so a
+# zoomed-out view of a huge image draws from a handful of small tiles.
+import math
+
+import numpy as np
+
+
+def downsample(pixels):
+    """Halve an RGBA array with a 2x2 box filter, weighting colors by alpha"""
+    height, width = pixels.shape[:2]
+    if height % 2 or width % 2:
+        # Repeat the last row/column so odd edges keep their color
+        pixels = np.pad(pixels, ((0, height % 2), (0, width % 2), (0, 0)), mode='edge')
+    def pool(array):
+        return array[0::2, 0::2] + array[1::2, 0::2] + array[0::2, 1::2] + array[1::2, 1::2]
+
+    if (pixels[..., 3] == 255).all():
+        # Opaque, the common case: a plain average fits in 16 bits
+        return ((pool(pixels.astype(np.uint16)) + 2) // 4).astype(np.uint8)
+    values = pixels.astype(np.uint32)
+    alpha = values[..., 3:]
+    weighted = values[..., :3] * alpha
+    alpha_sum = pool(alpha)
+    out = np.empty(alpha_sum.shape[:2] + (4,), dtype=np.uint8)
+    out[..., :3] = (pool(weighted) + alpha_sum // 2) // np.maximum(alpha_sum, 1)
+    out[..., 3:] = (alpha_sum + 2) // 4
+    return out
+
+
+class MipPyramid:
+    """Lazily built, cached mip levels of one TileStore"""
+
+    def __init__(self, raster):
+        self.raster = raster
+        self.tile_size = raster.tile_size
+        self._tiles = {}  # (level, row, col) -> RGBA array, for levels >= 1
+
+    @property
+    def max_level(self):
+        """Level at which the whole image fits in one tile"""
+        longest = max(self.raster.width, self.raster.height)
+        return max(0, math.ceil(math.log2(longest / self.tile_size))) if longest > self.tile_size else 0
+
+    @property
+    def nbytes(self):
+        return sum(tile.nbytes for tile in self._tiles.values())
+
+    def grid(self, level):
+        """(rows, cols) of the tile grid at a level"""
+        span = self.tile_size << level
+        return -(-self.raster.height // span), -(-self.raster.width // span)
+
+    def tile(self, level, row, col):
+        """RGBA pixels of a tile, clipped to the image edge"""
+        if level == 0:
+            size = self.tile_size
+            x, y = col * size, row * size
+            return self.raster.read_region(x, y, min(size, self.raster.width - x), min(size, self.raster.height - y))
+        key = (level, row, col)
+        tile = self._tiles.get(key)
+        if tile is None:
+            if level == 1:
+                # Straight from the tile store rather than through four level-0 copies
+                size = self.tile_size * 2
+                x, y = col * size, row * size
+                source = self.raster.read_region(x, y, min(size, self.raster.width - x),
+                                                 min(size, self.raster.height - y))
+            else:
+                rows, cols = self.grid(level - 1)
+                source = np.concatenate([
+                    np.concatenate([self.tile(level - 1, r, c)
+                                    for c in range(col * 2, min(col * 2 + 2, cols))], axis=1)
+                    for r in range(row * 2, min(row * 2 + 2, rows))])
+            tile = downsample(source)
+            self._tiles[key] = tile
+        return tile
+
+    def build(self):
+        """Compute every level up front"""
+        for level in range(1, self.max_level + 1):
+            rows, cols = self.grid(level)
+            for row in range(rows):
+                for col in range(cols):
+                    self.tile(level, row, col)
+
+    def invalidate(self, x, y, width, height):
+        """Forget the tiles above an image region; returns the (level, row, col) keys affected"""
+        affected = []
+        for level in range(1, self.max_level + 1):
+            span = self.tile_size << level
+            for row in range(y // span, (y + height - 1) // span + 1):
+                for col in range(x // span, (x + width - 1) // span + 1):
+                    affected.append((level, row, col))
+                    self._tiles.pop((level, row, col), None)
+        return affected
+
+    def clear(self):
+        self._tiles.clear()
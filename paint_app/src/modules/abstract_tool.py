@@ -34,4 +34,8 @@ class AbstractTool(ABC):
 
     @abstractmethod
     def on_touch_up(self, x, y):
-        pass
\ No newline at end of file
+        pass
+
+    def to_record(self, document):
+        """Describe the finished operation as a document record (see document.py), or None"""
+        return None
@@ -1,33 +1,103 @@
-from kivy.graphics import Color, Ellipse, Rectangle
+from kivy.graphics import Color, Mesh
+from kivy.graphics.texture import Texture
+import numpy as np
+from document import RecordKind
 from .abstract_tool import AbstractTool, BrushStyle
 
+STAMP_SIZE = 64
+MAX_DABS_PER_MESH = 65535 // 4  # Mesh indices are unsigned shorts, 4 vertices per dab
+# Setting Mesh.vertices copies and re-uploads the whole list, so a stroke being drawn
+# starts a new small mesh when the last one fills and each move uploads at most this many
+LIVE_DABS_PER_MESH = 256
+
+# Each dab is a quad of (x, y, u, v) vertices drawn as two triangles
+_CORNERS = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype=np.float32)
+_UVS = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.float32)
+_QUAD_INDICES = (np.arange(MAX_DABS_PER_MESH, dtype=np.uint16)[:, None] * 4
+                 + np.array([0, 1, 2, 2, 3, 0], dtype=np.uint16)).reshape(-1)
+
+_round_stamp = None
+
+
+def round_stamp():
+    """White anti-aliased disc shared by every round brush stroke, tinted by Color"""
+    global _round_stamp
+    if _round_stamp is None:
+        center = (STAMP_SIZE - 1) / 2
+        yy, xx = np.mgrid[:STAMP_SIZE, :STAMP_SIZE]
+        distance = np.hypot(xx - center, yy - center)
+        alpha = np.clip(STAMP_SIZE / 2 - distance, 0, 1)
+        pixels = np.full((STAMP_SIZE, STAMP_SIZE, 4), 255, dtype=np.uint8)
+        pixels[..., 3] = (alpha * 255).astype(np.uint8)
+        _round_stamp = Texture.create(size=(STAMP_SIZE, STAMP_SIZE), colorfmt='rgba', bufferfmt='ubyte')
+        _round_stamp.blit_buffer(pixels.reshape(-1), colorfmt='rgba', bufferfmt='ubyte')
+    return _round_stamp
+
+
+def build_brush_meshes(dabs, line_width, square=False):
+    """Meshes drawing a finished stroke from its (n, 2) dab centres"""
+    dabs = np.asarray(dabs, dtype=np.float32).reshape(-1, 2)
+    texture = None if square else round_stamp()
+    meshes = []
+    for start in range(0, len(dabs), MAX_DABS_PER_MESH):
+        chunk = dabs[start:start + MAX_DABS_PER_MESH]
+        vertices = np.empty((len(chunk), 4, 4), dtype=np.float32)
+        vertices[:, :, :2] = _CORNERS * line_width + chunk[:, None, :]
+        vertices[:, :, 2:] = _UVS
+        meshes.append(Mesh(vertices=vertices.reshape(-1), indices=_QUAD_INDICES[:len(chunk) * 6],
+                           mode='triangles', texture=texture))
+    return meshes
+
+
 class BrushTool(AbstractTool):
     def __init__(self, canvas, color, line_width, style=BrushStyle.ROUND):
         super().__init__(canvas, color, line_width)
         self.style = style
         self.instructions = []  # Initialize instructions list
+        self.dabs = np.empty((256, 2), dtype=np.float32)  # Dab centres, grown as needed
+        self.dab_count = 0
+        self.mesh = None
 
     def on_touch_down(self, x, y):
-        self.instructions = []  # Reset instructions for new stroke
+        # One Color and one Mesh per stroke, however many dabs it ends up with
+        self.instructions = []
+        self.dab_count = 0
         with self.canvas:
-            Color(*self.color)
-            self._add_brush_point(x, y)
+            self.instructions.append(Color(*self.color))
+        self._start_mesh()
+        self._add_brush_point(x, y)
         return None  # Don't return instructions yet
 
     def on_touch_move(self, x, y):
-        with self.canvas:
-            Color(*self.color)
-            self._add_brush_point(x, y)
+        self._add_brush_point(x, y)
 
     def on_touch_up(self, x, y):
         return self.instructions  # Return all instructions for undo/redo
 
-    def _add_brush_point(self, x, y):
-        size = self.line_width * 2
+    def to_record(self, document):
+        return document.stroke(RecordKind.BRUSH, self.dabs[:self.dab_count], self.color, self.line_width,
+                               square=self.style == BrushStyle.SQUARE)
+
+    def _start_mesh(self):
+        texture = round_stamp() if self.style == BrushStyle.ROUND else None
         with self.canvas:
-            Color(*self.color)
-            if self.style == BrushStyle.ROUND:
-                point = Ellipse(pos=(x - size/2, y - size/2), size=(size, size))
-            else:  # SQUARE
-                point = Rectangle(pos=(x - size/2, y - size/2), size=(size, size))
-            self.instructions.append(point)
+            self.mesh = Mesh(mode='triangles', texture=texture)
+        self.instructions.append(self.mesh)
+        self._vertices = np.empty((LIVE_DABS_PER_MESH, 4, 4), dtype=np.float32)
+        self._mesh_dabs = 0
+
+    def _add_brush_point(self, x, y):
+        if self.dab_count == len(self.dabs):
+            self.dabs = np.concatenate([self.dabs, np.empty_like(self.dabs)])
+        self.dabs[self.dab_count] = (x, y)
+        self.dab_count += 1
+
+        if self._mesh_dabs == LIVE_DABS_PER_MESH:
+            self._start_mesh()
+        count = self._mesh_dabs
+        quad = self._vertices[count]
+        quad[:, :2] = _CORNERS * self.line_width + (x, y)
+        quad[:, 2:] = _UVS
+        self._mesh_dabs = count + 1
+        self.mesh.vertices = self._vertices[:count + 1].reshape(-1)
+        self.mesh.indices = _QUAD_INDICES[:(count + 1) * 6]
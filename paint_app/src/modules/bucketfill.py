@@ -1,78 +1,59 @@
-from kivy.graphics import Color, Fbo, ClearColor, ClearBuffers, Rectangle
 from .abstract_tool import AbstractTool
+import instrumentation
+from raster_store import RegionDelta
+from rasterizer import find_fill_spans, paint_spans, spans_bounds
+from fill_region import FillRegion
 import numpy as np
-from kivy.core.image import Image as CoreImage
-from kivy.graphics.texture import Texture
-import scipy.ndimage
 
 
 class FillCommand:
     """Command class for fill operations to integrate with the global undo/redo system"""
-    def __init__(self, canvas_widget, old_image_data, new_image_data, texture, widget_size, widget_pos, old_instructions):
+    def __init__(self, canvas_widget, delta, layer=None):
         """
         Initialize a fill command.
         
         Args:
             canvas_widget: Reference to the PaintWidget
-            old_image_data: Numpy array of pixel data before fill
-            new_image_data: Numpy array of pixel data after fill
-            texture: The texture to update
-            widget_size: Size of the widget when fill was performed
-            widget_pos: Position of the widget when fill was performed
-            old_instructions: Canvas instructions before the fill (to restore drawing commands)
+            delta: RegionDelta holding the filled bounding box before and after the fill
+            layer: Layer the fill was applied to
         """
         self.canvas_widget = canvas_widget
-        self.old_image_data = old_image_data.copy()  # Store a copy of the old state
-        self.new_image_data = new_image_data.copy()  # Store a copy of the new state
-        self.texture = texture
-        self.widget_size = tuple(widget_size)
-        self.widget_pos = tuple(widget_pos)
-        self.old_instructions = old_instructions[:]  # Store a copy of the canvas instructions
+        self.delta = delta
+        self.layer = layer
+
+    @property
+    def nbytes(self):
+        """Memory held by this undo record, which scales with the filled area"""
+        return self.delta.nbytes
+
+    @property
+    def spilled_nbytes(self):
+        return self.delta.spilled_nbytes
+
+    def spill(self, store):
+        self.delta.spill(store)
     
     def undo(self, canvas):
         """Restore the canvas to the state before the fill operation"""
-        # Restore the old canvas instructions (this includes all drawing commands)
-        canvas.clear()
-        for instr in self.old_instructions:
-            try:
-                canvas.add(instr)
-            except Exception as e:
-                print(f"Error restoring instruction during fill undo: {e}")
+        self.delta.revert(self.canvas_widget, layer=self.layer)
     
     def redo(self, canvas):
         """Reapply the fill operation"""
-        # Create a new texture from new image data
-        height, width = self.new_image_data.shape[:2]
-        from kivy.graphics.texture import Texture
-        new_texture = Texture.create(size=(width, height), colorfmt='rgba', bufferfmt='ubyte')
-        
-        # Blit the new image data to the new texture
-        pixels = self.new_image_data.tobytes()
-        new_texture.blit_buffer(pixels, colorfmt='rgba', bufferfmt='ubyte')
-        new_texture.flip_vertical()
-        
-        # Update the canvas widget's texture reference
-        self.texture = new_texture
-        
-        # Redraw the canvas
-        canvas.clear()
-        with canvas:
-            Color(1, 1, 1, 1)
-            Rectangle(pos=self.widget_pos, size=self.widget_size)
-            Color(1, 1, 1, 1)
-            Rectangle(texture=new_texture, pos=self.widget_pos, size=self.widget_size)
+        self.delta.apply(self.canvas_widget, layer=self.layer)
 
 
 class FillTool(AbstractTool):
     name = 'bucket_fill'
 
-    def __init__(self, canvas, color, line_width, tolerance=0, canvas_widget=None):
+    def __init__(self, canvas, color, line_width, tolerance=0, canvas_widget=None, preview=False):
         super(FillTool, self).__init__(canvas, color, line_width)
         self.tolerance = tolerance          # Tolerance level
+        self.preview = preview              # Whether a click previews the fill instead of filling
+        self.region = None                  # FillRegion being previewed, see start_preview()
         self.active = False                 # Whether the tool is active
         self.image_data = None              # The image data as a numpy array
-        self.texture = None                 # The texture used for drawing
         self.canvas_widget = canvas_widget  # Reference to the canvas widget
+        self.seed = None                    # Last fill point, in canvas coordinates
 
     def activate(self):
         self.active = True
@@ -84,21 +65,15 @@ class FillTool(AbstractTool):
         self.active = False
 
     def capture_canvas(self):
-        # Capture the canvas as an image and store the pixel data
-        img = self.canvas_widget.export_as_image()
-        width, height = img.texture.size
-        pixels = img.texture.pixels
-        pixel_data = np.frombuffer(pixels, dtype=np.uint8)
-        pixel_data = pixel_data.reshape(height, width, 4).copy()  # Make writable
-        self.image_data = pixel_data
-        self.texture = img.texture
+        # Use the canvas widget's cached pixel snapshot (row 0 is the top, read-only)
+        self.image_data = self.canvas_widget.get_pixel_snapshot()
 
     def on_touch_down(self, x, y):
         if not self.active:
             return super(FillTool, self).on_touch_down(x, y)
         
-        # Check if touch is within the canvas bounds
-        if not self.canvas_widget.collide_point(x, y):
+        # Check if touch is within the image (the view may be zoomed or panned)
+        if not self.canvas_widget.canvas_contains(x, y):
             return False
 
         # Get the touch position relative to the canvas
@@ -112,8 +87,11 @@ class FillTool(AbstractTool):
         # Adjust y coordinate because image origin is at top-left
         y = self.image_data.shape[0] - y - 1
 
-        # Perform the fill operation
-        self.fill(x, y)
+        # Perform the fill operation, or show where it would go
+        if self.preview:
+            self.start_preview(x, y)
+        else:
+            self.fill(x, y)
         return True
 
     def on_touch_move(self, x, y):
@@ -125,6 +103,10 @@ class FillTool(AbstractTool):
         pass
 
     def fill(self, x, y):
+        with instrumentation.timer('fill'):
+            self._fill(x, y)
+
+    def _fill(self, x, y):
         # Ensure image data is available
         if self.image_data is None:
             self.capture_canvas()
@@ -136,67 +118,106 @@ class FillTool(AbstractTool):
         if x < 0 or x >= width or y < 0 or y >= height:
             return
 
+        # Remember the seed in canvas coordinates (y up) for the document record
+        self.seed = (x, height - y - 1)
+
         # Get the target color at the clicked position
         target_color = pixel_data[y, x][:3]
 
         # Get the fill color from the tool's color property
-        fill_color = np.array([int(c * 255) for c in self.color[:3]], dtype=np.uint8)
+        fill_color = self.fill_color()
 
         # If the target color is the same as fill color, do nothing
         if np.array_equal(target_color, fill_color):
             return
 
-        # Save the current image data for undo (before modification)
-        old_image_data = pixel_data.copy()
-        
-        # Save the current canvas instructions before we clear them
-        old_instructions = self.canvas_widget.canvas.children[:]
+        # Find the region to fill and the bounding box of the pixels it changes
+        spans = find_fill_spans(pixel_data, x, y, target_color, self.tolerance)
+        if not spans:
+            return
+        left, top, right, bottom = spans_bounds(spans)
+        # Save the pixels inside the bounding box for undo (before modification)
+        old_pixels = pixel_data[top:bottom, left:right].copy()
 
-        # Perform the flood fill using optimized method
-        self.flood_fill(pixel_data, x, y, target_color, fill_color, self.tolerance)
+        # Paint the spans into a copy of the box; the snapshot itself is shared and read-only
+        new_pixels = old_pixels.copy()
+        paint_spans(new_pixels, [(row - top, start - left, end - left) for row, start, end in spans], fill_color)
+        self._commit(left, top, old_pixels, new_pixels)
 
+    def _commit(self, left, top, old_pixels, new_pixels):
+        height, width = old_pixels.shape[:2]
         # Create a FillCommand and add it to the global undo stack
-        command = FillCommand(
-            self.canvas_widget,
-            old_image_data,
-            pixel_data,
-            self.texture,
-            self.canvas_widget.size,
-            self.canvas_widget.pos,
-            old_instructions
-        )
-        self.canvas_widget.undo_stack.append(command)
-        self.canvas_widget.redo_stack.clear()
-
-        # Update the texture with the modified image data
-        new_pixels = pixel_data.tobytes()
-        self.texture.blit_buffer(new_pixels, colorfmt='rgba', bufferfmt='ubyte')
-        self.texture.flip_vertical()  # Ensure correct orientation after blit
-
-        # Update the canvas with the new texture
-        self.canvas_widget.canvas.clear()
-        with self.canvas_widget.canvas:
-            Rectangle(texture=self.texture, pos=self.canvas_widget.pos, size=self.canvas_widget.size)
+        command = FillCommand(self.canvas_widget, RegionDelta((left, top, width, height), old_pixels, new_pixels),
+                              self.canvas_widget.active_layer)
+        self.canvas_widget.push_command(command, self.to_record(self.canvas_widget.document))
+
+        # Write only the changed rectangle back into the canvas tile store and texture
+        self.canvas_widget.write_pixels(left, top, new_pixels)
         
         # Deactivate the FillTool after filling
         self.deactivate()
 
-    def flood_fill(self, pixel_data, x, y, target_color, fill_color, tolerance):
-        height, width, _ = pixel_data.shape
-        # Create a boolean mask where pixels match the target color within the given tolerance
-        mask = np.all(np.abs(pixel_data[:, :, :3].astype(int) - target_color.astype(int)) <= tolerance, axis=2)
+    def fill_color(self):
+        return np.array([int(c * 255) for c in self.color[:3]], dtype=np.uint8)
 
-        # Use scipy.ndimage.label to label connected regions in the mask
-        structure = np.array([[0,1,0],[1,1,1],[0,1,0]], dtype=bool)  # 4-connectivity
-        labeled, num_features = scipy.ndimage.label(mask, structure=structure)
+    def start_preview(self, x, y):
+        """Show the region a fill at image point (x, y) would cover, without filling it.
 
-        # Get the label of the region containing the starting point
-        target_label = labeled[y, x]
-        if target_label == 0:
-            return  # The starting point is not in any connected region
+        The region follows set_tolerance() until commit_preview() fills it or the
+        canvas widget drops the preview.
+        """
+        if self.image_data is None:
+            self.capture_canvas()
+        height, width, _ = self.image_data.shape
+        if x < 0 or x >= width or y < 0 or y >= height:
+            return
+        self.seed = (x, height - y - 1)
+        self.region = FillRegion(self.image_data, x, y)
+        self.canvas_widget.show_fill_preview(self)
+
+    def set_tolerance(self, tolerance):
+        self.tolerance = tolerance
+
+    def preview_region(self):
+        """((left, top, right, bottom), mask) of the previewed fill at the current tolerance"""
+        return self.region.region(self.tolerance)
 
-        # Create a mask for the region to fill
-        region_mask = (labeled == target_label)
+    def preview_contains(self, x, y):
+        """Whether canvas point (x, y) is inside the previewed fill"""
+        if self.region is None or not self.canvas_widget.canvas_contains(x, y):
+            return False
+        x = int(x - self.canvas_widget.pos[0])
+        y = self.image_data.shape[0] - int(y - self.canvas_widget.pos[1]) - 1
+        (left, top, right, bottom), mask = self.preview_region()
+        return left <= x < right and top <= y < bottom and bool(mask[y - top, x - left])
+
+    def commit_preview(self):
+        """Fill the previewed region at the current tolerance"""
+        if self.region is None:
+            return
+        with instrumentation.timer('fill'):
+            region, self.region = self.region, None
+            (left, top, right, bottom), mask = region.region(self.tolerance)
+            fill_color = self.fill_color()
+            if np.array_equal(region.target, fill_color):
+                return
+            old_pixels = self.image_data[top:bottom, left:right].copy()
+            new_pixels = old_pixels.copy()
+            new_pixels[mask, :3] = fill_color
+            self._commit(left, top, old_pixels, new_pixels)
+
+    def cancel_preview(self):
+        self.region = None
+        self.deactivate()
+
+    def to_record(self, document):
+        if self.seed is None:
+            return None
+        return document.fill(*self.seed, self.color, self.tolerance)
+
+    def flood_fill(self, pixel_data, x, y, target_color, fill_color, tolerance):
+        # Find the connected spans matching the target color and paint them
+        spans = find_fill_spans(pixel_data, x, y, target_color, tolerance)
+        paint_spans(pixel_data, spans, fill_color)
+        return spans
 
-        # Fill the region
-        pixel_data[region_mask, :3] = fill_color
@@ -1,16 +1,33 @@
 
-from kivy.graphics import Color, Line
+from kivy.graphics import Callback, Canvas, Color
+from compositor import blend_default, blend_erase
+from document import RecordKind
 from .abstract_tool import AbstractTool
+from .stroke_buffer import StrokeBuffer
 
 class EraserTool(AbstractTool):
+    def __init__(self, canvas, color, line_width, transparent=False):
+        super().__init__(canvas, color, line_width)
+        self.transparent = transparent  # Clear alpha instead of painting white
+
     def on_touch_down(self, x, y):
-        with self.canvas:
-            Color(1, 1, 1, 1)  # White
-            self.line = Line(points=[x, y], width=self.line_width * 2)
-        return [self.line]
+        target = self.canvas
+        if self.transparent:
+            # The stroke's lines go in a group so the blend is reset right after them
+            target = Canvas()
+            target.add(Callback(blend_erase))
+            self.canvas.add(target)
+            self.canvas.add(Callback(blend_default))
+        target.add(Color(1, 1, 1, 1))  # White
+        self.stroke = StrokeBuffer(target, self.line_width * 2)
+        self.stroke.append(x, y)
+        return self.stroke.lines
 
     def on_touch_move(self, x, y):
-        self.line.points += [x, y]
+        self.stroke.append(x, y)
 
     def on_touch_up(self, x, y):
-        pass
\ No newline at end of file
+        self.stroke.finish()
+
+    def to_record(self, document):
+        return document.stroke(RecordKind.ERASER, self.stroke.points, (1, 1, 1, 1), self.line_width)
@@ -1,16 +1,23 @@
-from kivy.graphics import Color, Line
+from kivy.graphics import Color
+from document import RecordKind
 from .abstract_tool import AbstractTool
+from .stroke_buffer import StrokeBuffer
 
 class PencilTool(AbstractTool):
     def on_touch_down(self, x, y):
         with self.canvas:
-            Color(*self.color)
-            self.line = Line(points=[x, y], width=self.line_width)
-        self.instructions = [self.line]  # Store instructions
+            self.color_instruction = Color(*self.color)
+        self.stroke = StrokeBuffer(self.canvas, self.line_width)
+        self.stroke.append(x, y)
         return None  # Don't return instructions yet
 
     def on_touch_move(self, x, y):
-        self.line.points += [x, y]
+        self.stroke.append(x, y)
 
     def on_touch_up(self, x, y):
-        return self.instructions  # Return instructions for undo/redo
+        self.stroke.finish()
+        # Return instructions for undo/redo
+        return [self.color_instruction] + self.stroke.lines
+
+    def to_record(self, document):
+        return document.stroke(RecordKind.PENCIL, self.stroke.points, self.color, self.line_width)
@@ -1,7 +1,10 @@
 from kivy.graphics import Color, Line
+from document import RecordKind
 from .shapetool import ShapeTool
 
 class RectangleTool(ShapeTool):
+    record_kind = RecordKind.RECTANGLE
+
     def on_touch_down(self, x, y):
         if self.shape and self.contains_point(x, y):
             if self.resize_handle:
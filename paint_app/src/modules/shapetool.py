@@ -2,6 +2,7 @@
 # It includes shared functionality for shape manipulation, resizing, and movement.
 from abc import abstractmethod
 from kivy.graphics import Color, Line, Rectangle, InstructionGroup
+from document import RecordKind
 from .abstract_tool import AbstractTool
 
 class ShapeTool(AbstractTool):
@@ -177,6 +178,17 @@ class ShapeTool(AbstractTool):
             return list(self.shape.circle)
         return None
 
+    def to_record(self, document):
+        if not self.shape:
+            return None
+        if self.record_kind == RecordKind.LINE:
+            geometry = self.shape.points
+        elif self.record_kind == RecordKind.RECTANGLE:
+            geometry = self.shape.rectangle
+        else:
+            geometry = self.shape.circle
+        return document.shape(self.record_kind, geometry, self.color, self.line_width)
+
     @abstractmethod
     def resize_shape(self, x, y):
         pass
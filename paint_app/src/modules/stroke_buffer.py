@@ -0,0 +1,70 @@
+# This file provides the append-only point buffer used by the free-hand tools.
+# Points go into a preallocated array and are drawn as fixed-size Line chunks, so a
+# move event only re-tessellates the last chunk instead of the whole stroke.
+from kivy.graphics import Line
+import numpy as np
+from .stroke_smoothing import StrokeSmoother
+
+CHUNK_POINTS = 128
+
+
+class StrokeBuffer:
+    """Growable (x, y) point array rendered as a chain of Line instructions.
+
+    With smoothing on, raw samples go through a StrokeSmoother and only its final
+    (smoothed and decimated) points are stored; the provisional tail is drawn but
+    never kept.
+    """
+
+    def __init__(self, canvas, width, chunk_points=CHUNK_POINTS, smooth=True):
+        self.canvas = canvas
+        self.width = width
+        self.chunk_points = chunk_points
+        self.smoother = StrokeSmoother() if smooth else None
+        self._points = np.empty((1024, 2), dtype=np.float32)
+        self.count = 0
+        self.lines = []
+        self._chunk_start = 0  # Index of the first point drawn by the last Line
+
+    @property
+    def points(self):
+        """All stored points so far, as a (count, 2) array view"""
+        return self._points[:self.count]
+
+    def _extend(self, points):
+        needed = self.count + len(points)
+        if needed > len(self._points):
+            grown = np.empty((max(needed, 2 * len(self._points)), 2), dtype=np.float32)
+            grown[:self.count] = self.points
+            self._points = grown
+        self._points[self.count:needed] = points
+        self.count = needed
+
+    def _draw(self, tail=None):
+        if not self.lines or self.count - self._chunk_start > self.chunk_points:
+            if self.lines:
+                # The finished chunk keeps only stored points, not the provisional tail
+                self.lines[-1].points = self._points[self._chunk_start:self.count].ravel().tolist()
+            # Start a new chunk that shares its first point with the end of the previous one
+            self._chunk_start = max(self.count - 1, 0)
+            with self.canvas:
+                self.lines.append(Line(width=self.width))
+        points = self._points[self._chunk_start:self.count]
+        if tail is not None and len(tail):
+            points = np.concatenate([points, tail])
+        self.lines[-1].points = points.ravel().tolist()
+
+    def append(self, x, y):
+        if self.smoother is None:
+            self._extend(((x, y),))
+            self._draw()
+            return
+        final, tail = self.smoother.add(x, y)
+        self._extend(final)
+        self._draw(tail)
+
+    def finish(self):
+        """End the stroke, storing whatever the smoother still holds"""
+        if self.smoother is not None:
+            self._extend(self.smoother.finish())
+            self._draw()
@@ -0,0 +1,120 @@
+# This file implements streaming smoothing and decimation for free-hand strokes.
+# Raw input samples are interpolated with a Catmull-Rom spline as they arrive and then
+# thinned with Ramer-Douglas-Peucker in small blocks, so a committed stroke keeps only
+# the points needed to draw it within a fraction of a pixel.
+import numpy as np
+
+SMOOTH_SPACING = 4.0      # Pixels between interpolated samples on a spline segment
+DECIMATE_TOLERANCE = 0.5  # Maximum deviation, in pixels, allowed when dropping points
+DECIMATE_BLOCK = 32       # Smoothed samples collected before running decimation
+MIN_SAMPLE_DISTANCE = 1.0 # Raw samples closer than this to the previous one are ignored
+
+
+def catmull_rom(p0, p1, p2, p3, t):
+    """Evaluate the uniform Catmull-Rom segment between p1 and p2 at parameters t"""
+    t = t[:, None]
+    t2 = t * t
+    t3 = t2 * t
+    return 0.5 * (2 * p1 + (p2 - p0) * t + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t2
+                  + (3 * p1 - p0 - 3 * p2 + p3) * t3)
+
+
+def rdp_mask(points, tolerance):
+    """Ramer-Douglas-Peucker: return a boolean mask of the points to keep.
+
+    The first and last points are always kept. Distances for each sub-range are
+    computed with NumPy; only the range splitting is done in Python.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        inner = points[first + 1:last]
+        chord = end - start
+        length = np.hypot(*chord)
+        if length == 0:
+            distances = np.hypot(*(inner - start).T)
+        else:
+            distances = np.abs(chord[0] * (inner[:, 1] - start[1]) - chord[1] * (inner[:, 0] - start[0])) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+class StrokeSmoother:
+    """Turns a stream of raw input samples into smoothed, decimated stroke points.
+
+    add() returns the points that are final (they will never change again) plus a
+    provisional tail that reaches the latest input sample, for drawing the stroke
+    live. finish() returns the remaining final points once the stroke ends.
+    """
+
+    def __init__(self, spacing=SMOOTH_SPACING, tolerance=DECIMATE_TOLERANCE, block=DECIMATE_BLOCK):
+        self.spacing = spacing
+        self.tolerance = tolerance
+        self.block = block
+        self._raw = []      # Last (up to) four distinct raw samples, as float arrays
+        self._pending = []  # Smoothed samples not yet run through decimation
+        self.raw_count = 0
+
+    def _segment(self, p0, p1, p2, p3):
+        """Interpolated samples from p1 (exclusive) to p2 (inclusive)"""
+        steps = max(1, int(np.hypot(*(p2 - p1)) / self.spacing))
+        return catmull_rom(p0, p1, p2, p3, np.arange(1, steps + 1) / steps)
+
+    def _decimate(self, flush=False):
+        points = np.array(self._pending, dtype=np.float32)
+        kept = points[rdp_mask(points, self.tolerance)]
+        if flush:
+            self._pending = []
+            return kept
+        # The last kept point starts the next block, so it is not final yet
+        self._pending = [kept[-1]]
+        return kept[:-1]
+
+    def _empty(self):
+        return np.empty((0, 2), dtype=np.float32)
+
+    def add(self, x, y):
+        """Feed one raw sample; returns (final_points, tail_points) as (n, 2) arrays"""
+        point = np.array((x, y), dtype=np.float64)
+        if self._raw and np.hypot(*(point - self._raw[-1])) < MIN_SAMPLE_DISTANCE:
+            return self._empty(), self._tail(point)
+        self.raw_count += 1
+        self._raw.append(point)
+        if len(self._raw) == 1:
+            self._pending.append(point)
+        elif len(self._raw) >= 3:
+            # The segment ending at the second-to-last sample is now fully determined
+            p0 = self._raw[-4] if len(self._raw) >= 4 else self._raw[0]
+            self._pending.extend(self._segment(p0, self._raw[-3], self._raw[-2], self._raw[-1]))
+            del self._raw[:-3]
+        final = self._decimate() if len(self._pending) >= self.block else self._empty()
+        return final, self._tail(point)
+
+    def _tail(self, latest):
+        """Points that are not final yet, ending at the latest input sample"""
+        tail = list(self._pending)
+        if self._raw and (not tail or np.any(tail[-1] != self._raw[-1])):
+            tail.append(self._raw[-1])
+        if np.any(tail[-1] != latest):
+            tail.append(latest)
+        return np.array(tail, dtype=np.float32)
+
+    def finish(self):
+        """End the stroke and return the remaining final points"""
+        if len(self._raw) >= 2:
+            p0 = self._raw[-3] if len(self._raw) >= 3 else self._raw[0]
+            self._pending.extend(self._segment(p0, self._raw[-2], self._raw[-1], self._raw[-1]))
+        self._raw = []
+        if not self._pending:
+            return self._empty()
+        return self._decimate(flush=True)
@@ -1,86 +1,136 @@
 from kivy.uix.widget import Widget
-from kivy.graphics import Color, Line, Bezier, Rectangle  # Add Rectangle to imports
+from kivy.graphics import (Color, Line, Bezier, Rectangle, Ellipse, Mesh, Fbo, ClearColor,
+                           ClearBuffers, Translate, InstructionGroup, VertexInstruction, BindTexture,
+                           Callback, PushMatrix, PopMatrix, Scale, StencilPush, StencilPop,
+                           StencilUse, StencilUnUse)
 from kivy.properties import ColorProperty, NumericProperty, ObjectProperty
-from collections import deque
 from kivy.core.window import Window
+from kivy.clock import Clock
 from tools import ToolManager, Tool, BrushStyle, ShapeTool
 from modules.bucketfill import FillTool  # Add this import
 from kivy.core.image import Image as CoreImage  # Ensure CoreImage is imported
 from kivy.graphics.texture import Texture  # Add this import
 from PIL import Image  # Add this import
 import io  # Add this import
+import numpy as np
+from raster_store import RegionDelta, TileStore
+from history import UndoHistory
+from document import Document, ImageRecord
+from project_file import ProjectFile
+from layers import LayerStack, unpremultiply
+from compositor import LayerCompositor, blend_premultiplied_output, blend_default
+from tile_view import TileView
+from viewport import Viewport, ZOOM_STEP, PAN_STEP
+from image_loader import ImageLoadJob, load_tiles
+from size_estimator import SizeEstimator
+import journal
+import instrumentation
+from input_recording import DOWN, MOVE, UP, InputRecorder
+import logging
+import math
+
+log = logging.getLogger(__name__)
 
 class DrawCommand:
-    def __init__(self, canvas_instructions):
-        # Store instructions as a list even if a single instruction is passed
-        self.instructions = canvas_instructions if isinstance(canvas_instructions, list) else [canvas_instructions]
+    """Command for a committed stroke or shape, stored as the pixels it changed"""
+    def __init__(self, widget, delta, layer=None):
+        self.widget = widget
+        self.delta = delta  # RegionDelta covering the stroke's bounding box
+        self.layer = layer  # Layer the stroke was drawn on
+
+    @property
+    def nbytes(self):
+        return self.delta.nbytes
+
+    @property
+    def spilled_nbytes(self):
+        return self.delta.spilled_nbytes
+
+    def spill(self, store):
+        self.delta.spill(store)
 
     def undo(self, canvas):
-        # Remove instructions in reverse order to handle Color instructions properly
-        for instr in reversed(self.instructions):
-            try:
-                canvas.remove(instr)
-            except ValueError:
-                # Skip if instruction is already removed
-                pass
+        self.delta.revert(self.widget, layer=self.layer)
 
     def redo(self, canvas):
-        # Add instructions in original order
-        for instr in self.instructions:
-            canvas.add(instr)
+        self.delta.apply(self.widget, layer=self.layer)
 
 class ImageLoadCommand:
     """Command for loading images with undo/redo support"""
-    def __init__(self, widget, old_instructions, new_instructions, old_size, new_size, texture=None):
-        print(f"Creating ImageLoadCommand:")
-        print(f"- Old size: {old_size}")
-        print(f"- New size: {new_size}")
-        print(f"- Old instructions count: {len(old_instructions) if old_instructions else 0}")
-        print(f"- New instructions count: {len(new_instructions) if new_instructions else 0}")
-        
+    def __init__(self, widget, old_pixels, new_pixels, layer=None):
+        log.debug("Image load command: %s -> %s", old_pixels.shape[1::-1], new_pixels.shape[1::-1])
         self.widget = widget
-        # Create deep copies of instructions
-        self.old_instructions = old_instructions[:]  # Use slice to create a copy
-        self.new_instructions = []
-        # Create new instructions with new Color and Rectangle objects
-        with widget.canvas:
-            Color(1, 1, 1, 1)
-            Rectangle(pos=widget.pos, size=new_size)
-            Color(1, 1, 1, 1)
-            Rectangle(texture=texture, pos=widget.pos, size=new_size)
-            self.new_instructions = widget.canvas.children[:]
-        
-        self.old_size = tuple(old_size)
-        self.new_size = tuple(new_size)
-        self.texture = texture
+        self.old_pixels = old_pixels
+        self.new_pixels = new_pixels
+        self.layer = layer
+
+    @property
+    def nbytes(self):
+        return sum(p.nbytes for p in (self.old_pixels, self.new_pixels) if not isinstance(p, np.memmap))
+
+    @property
+    def spilled_nbytes(self):
+        return sum(p.nbytes for p in (self.old_pixels, self.new_pixels) if isinstance(p, np.memmap))
+
+    def spill(self, store):
+        """Move both full-canvas images into the history's spill file"""
+        if not isinstance(self.old_pixels, np.memmap):
+            self.old_pixels = store.put(self.old_pixels)
+        if not isinstance(self.new_pixels, np.memmap):
+            self.new_pixels = store.put(self.new_pixels)
+        # The document record shares the loaded image; point it at the spilled copy too
+        record = getattr(self, 'record', None)
+        if record is not None:
+            record.pixels = self.new_pixels
 
     def undo(self, canvas):
-        print(f"Undoing image load:")
-        print(f"- Restoring size: {self.old_size}")
-        print(f"- Restoring {len(self.old_instructions)} instructions")
-        
-        # Clear and restore old state
-        canvas.clear()
-        self.widget.size = self.old_size
-        for instr in self.old_instructions:
-            try:
-                canvas.add(instr)
-            except Exception as e:
-                print(f"Error restoring instruction: {e}")
+        log.debug("Undoing image load, restoring %s", self.old_pixels.shape[1::-1])
+        self.widget.replace_pixels(self.old_pixels, self.layer)
 
     def redo(self, canvas):
-        print(f"Redoing image load:")
-        print(f"- Setting size: {self.new_size}")
-        print(f"- Has texture: {self.texture is not None}")
-        
-        # Clear and restore new state
-        canvas.clear()
-        self.widget.size = self.new_size
-        for instr in self.new_instructions:
-            try:
-                canvas.add(instr)
-            except Exception as e:
-                print(f"Error restoring instruction: {e}")
+        log.debug("Redoing image load, setting %s", self.new_pixels.shape[1::-1])
+        self.widget.replace_pixels(self.new_pixels, self.layer)
+
+def _instruction_bounds(instr):
+    """Return the (x0, y0, x1, y1) window-space bounds an instruction can paint, or None"""
+    if isinstance(instr, InstructionGroup):
+        bounds = [b for b in map(_instruction_bounds, instr.children) if b]
+        if not bounds:
+            return None
+        return (min(b[0] for b in bounds), min(b[1] for b in bounds),
+                max(b[2] for b in bounds), max(b[3] for b in bounds))
+    if isinstance(instr, Line):
+        pad = instr.width + 2
+        if instr.circle:
+            cx, cy, r = instr.circle[:3]
+            return (cx - r - pad, cy - r - pad, cx + r + pad, cy + r + pad)
+        if instr.rectangle:
+            x, y, w, h = instr.rectangle
+            return (x - pad, y - pad, x + w + pad, y + h + pad)
+        if instr.ellipse:
+            x, y, w, h = instr.ellipse[:4]
+            return (x - pad, y - pad, x + w + pad, y + h + pad)
+        points = instr.points
+        if not points:
+            # Shape lines only compute their geometry when first drawn
+            return (float('-inf'), float('-inf'), float('inf'), float('inf'))
+        xs, ys = points[0::2], points[1::2]
+        return (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+    if isinstance(instr, (Rectangle, Ellipse)):
+        x, y = instr.pos
+        w, h = instr.size
+        return (x - 1, y - 1, x + w + 1, y + h + 1)
+    if isinstance(instr, Mesh):
+        # Default mesh format: x, y, u, v per vertex
+        vertices = np.asarray(instr.vertices, dtype=np.float32).reshape(-1, 4)
+        if not len(vertices):
+            return None
+        (x0, y0), (x1, y1) = vertices[:, :2].min(axis=0), vertices[:, :2].max(axis=0)
+        return (x0 - 1, y0 - 1, x1 + 1, y1 + 1)
+    if isinstance(instr, VertexInstruction):
+        # Unknown geometry, assume it may cover anything
+        return (float('-inf'), float('-inf'), float('inf'), float('inf'))
+    return None
 
 # This is the main canvas widget where drawing occurs. It handles touch/mouse input,
 # manages the undo/redo system, and coordinates with the active drawing tools.
@@ -92,11 +142,335 @@ class PaintWidget(Widget):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.tool_manager = ToolManager()
-        self.undo_stack = deque(maxlen=50)  # Limit stack size to prevent memory issues
-        self.redo_stack = deque(maxlen=50)
-        self.points = []  # Initialize points list
+        # Undo history is limited by payload bytes; heavy entries spill to a temp file
+        self.history = UndoHistory()
+        self.undo_stack = self.history.undo_stack
+        self.redo_stack = self.history.redo_stack
         self.current_instructions = None
         self.current_tool = None  # Add this to maintain tool reference
+        # Committed drawing lives in per-layer tile stores; the canvas shows them through
+        # the compositor's cached tile textures
+        self.layers = LayerStack(*self.size)
+        self.compositor = LayerCompositor(self.layers)
+        # Zoomed-out views draw from mip tiles instead of the full-size layer tiles
+        self.tile_view = TileView(self.layers)
+        self.viewport = Viewport()
+        # A new canvas grows with the widget; an opened image keeps its own size
+        self.canvas_follows_size = True
+        self._view_level = None  # Mip level currently drawn, None when the display needs rebuilding
+        self._view_group = InstructionGroup()
+        self._preview_group = InstructionGroup()  # Downscaled image shown while one is loading
+        self._image_job = None
+        self._fill_preview = None  # FillTool whose region is shown, see show_fill_preview()
+        self._fill_overlay = InstructionGroup()
+        # Slider moves and view changes within a frame redraw the overlay once
+        self._fill_overlay_update = Clock.create_trigger(self._update_fill_overlay)
+        with self.canvas.before:
+            # Clip to the widget like a StencilView and map canvas coordinates through the viewport
+            StencilPush()
+            self._view_clip = Rectangle(pos=self.pos, size=self.size)
+            StencilUse()
+            PushMatrix()
+            self._view_translate = Translate()
+            self._view_scale = Scale()
+            self._view_origin = Translate()
+        with self.canvas.after:
+            PopMatrix()
+            StencilUnUse()
+            self._view_unclip = Rectangle(pos=self.pos, size=self.size)
+            StencilPop()
+        # What was drawn, as compact records that can be replayed without Kivy
+        self.document = Document(*self.size)
+        self.project = None  # ProjectFile last opened or saved, for incremental saves
+        # Bumped on every change to the tile store; tags the cached pixel snapshot
+        self.version = 0
+        self._snapshot = None
+        self._snapshot_version = -1
+        self.snapshot_hits = 0
+        self.snapshot_misses = 0
+        self.size_estimator = SizeEstimator()
+        # Crash-recovery journal, see start_journal(); changes it can't replay take a
+        # checkpoint on the next frame, coalescing e.g. the steps of a window resize
+        self.journal = None
+        self._journal_event = None
+        self._journal_checkpoint = Clock.create_trigger(self._checkpoint_journal)
+        self._rebuild_canvas()
+        self.bind(size=self._on_size, pos=self._on_pos)
+        # Touch events are recorded while this is set, see start_recording()
+        self.recorder = None
+        # Read only when an instrumentation report is taken
+        instrumentation.probe('canvas.instructions', self.instruction_count)
+        instrumentation.probe('undo.commands', lambda: len(self.undo_stack) + len(self.redo_stack))
+        instrumentation.probe('undo.memory_bytes', lambda: self.history.memory_bytes)
+        instrumentation.probe('undo.spilled_bytes', lambda: self.history.spilled_bytes)
+
+    @property
+    def raster(self):
+        """Tile store of the active layer"""
+        return self.layers.active.raster
+
+    @property
+    def active_layer(self):
+        return self.layers.active
+
+    def _rebuild_canvas(self):
+        """Reset the canvas to just the composited layers, dropping any live instructions"""
+        self.tile_view.reset()
+        self._view_level = None
+        self.canvas.clear()
+        self.canvas.add(self._view_group)
+        # canvas.before and canvas.after are children too; live instructions go between them
+        self._base_instructions = self.canvas.children.index(self._view_group) + 1
+        self._update_view()
+
+    def _update_view(self):
+        """Apply the viewport and draw the layers at the matching mip level.
+
+        Level 0 composites the full-size layer tiles in view, uploading only ones not cached;
+        zoomed out, the view draws composited mip tiles and the layer tiles are freed.
+        """
+        scale = self.viewport.scale
+        offset_x, offset_y = self.viewport.offset
+        for clip in (self._view_clip, self._view_unclip):
+            clip.pos = self.pos
+            clip.size = self.size
+        self._view_translate.xy = (self.x + offset_x, self.y + offset_y)
+        self._view_scale.xyz = (scale, scale, 1)
+        self._view_origin.xy = (-self.x, -self.y)
+
+        level = self.viewport.level(self.tile_view.max_level)
+        tiles = self.viewport.visible_tiles(self.layers.width, self.layers.height, self.width, self.height,
+                                            self.raster.tile_size, level)
+        if level != self._view_level:
+            self._view_group.clear()
+            if level == 0:
+                self.compositor.set_pos(self.pos)
+                self.compositor.refresh()
+                self._view_group.add(self.compositor.group)
+            else:
+                self.compositor.release()
+                self.tile_view.set_pos(self.pos)
+                self._view_group.add(self.tile_view.group)
+            self._view_group.add(self._preview_group)
+            self._view_group.add(self._fill_overlay)
+            self._view_level = level
+        if level == 0:
+            self.compositor.show(tiles)
+        else:
+            self.tile_view.show(level, tiles)
+        if self._fill_preview is not None:
+            self._fill_overlay_update()
+        self.canvas.ask_update()
+
+    def _resize_canvas(self, width, height):
+        """Resize every layer and the document, e.g. to follow the widget"""
+        if (int(width), int(height)) == (self.layers.width, self.layers.height):
+            return
+        self._bump_version(invalidate=True)
+        self.layers.resize(width, height)
+        self.document.resize(self.raster.width, self.raster.height)
+        self.tile_view.reset(pyramids=True)
+        self._view_level = None
+        self._journal_checkpoint()
+
+    def _on_size(self, instance, size):
+        if self.canvas_follows_size:
+            self._resize_canvas(*size)
+        self._update_view()
+
+    def _on_pos(self, instance, pos):
+        self.compositor.set_pos(pos)
+        self.tile_view.set_pos(pos)
+        self._update_view()
+
+    def to_canvas(self, x, y):
+        """Map a window-space point through the viewport to the canvas coordinates tools draw in"""
+        image_x, image_y = self.viewport.to_image(x - self.x, y - self.y)
+        return self.x + image_x, self.y + image_y
+
+    def canvas_contains(self, x, y):
+        """Whether a point in canvas coordinates lies on the image"""
+        return 0 <= x - self.x < self.layers.width and 0 <= y - self.y < self.layers.height
+
+    def zoom(self, factor, x=None, y=None):
+        """Zoom by `factor` about window point (x, y), the widget centre by default"""
+        x = self.center_x if x is None else x
+        y = self.center_y if y is None else y
+        self.confirm_current_shape()
+        self.viewport.zoom_about(factor, x - self.x, y - self.y)
+        self._update_view()
+
+    def zoom_in(self):
+        self.zoom(ZOOM_STEP)
+
+    def zoom_out(self):
+        self.zoom(1 / ZOOM_STEP)
+
+    def actual_size(self):
+        self.zoom(1 / self.viewport.scale)
+
+    def fit_to_window(self):
+        self.confirm_current_shape()
+        self.viewport.fit(self.layers.width, self.layers.height, self.width, self.height)
+        self._update_view()
+
+    def pan(self, dx, dy):
+        self.viewport.pan(dx, dy)
+        self._update_view()
+
+    def upload_region(self, x, y, width, height):
+        """Copy a region of the active layer's tile store into its tile textures"""
+        self.compositor.upload(self.active_layer, x, y, self.raster.read_region(x, y, width, height))
+        self.canvas.ask_update()
+
+    def _bump_version(self, invalidate=False):
+        """Record a change to the canvas pixels.
+
+        A current snapshot stays valid when the caller patches it itself;
+        whole-canvas changes pass invalidate=True to drop it instead.
+        """
+        self.cancel_fill_preview()  # Its region was found on the old pixels
+        snapshot_current = self._snapshot_version == self.version
+        self.version += 1
+        if invalidate:
+            self._snapshot = None
+        elif snapshot_current:
+            self._snapshot_version = self.version
+
+    def write_pixels(self, x, y, data, layer=None):
+        """Write an RGBA array into a layer (the active one by default) at image position (x, y).
+
+        Only the rectangle covered by `data` is uploaded to the layer's tile textures.
+        """
+        layer = layer or self.active_layer
+        layer.raster.write_region(x, y, data)
+        self.compositor.upload(layer, x, y, data)
+        self.tile_view.invalidate(layer, x, y, data.shape[1], data.shape[0])
+        self.canvas.ask_update()
+        if layer is not self.active_layer:
+            return  # The snapshot and version only follow the active layer
+        if self._snapshot is not None and self._snapshot_version == self.version:
+            # Keep the cached snapshot in step instead of reading the whole canvas again
+            self._snapshot.flags.writeable = True
+            self._snapshot[y:y + data.shape[0], x:x + data.shape[1]] = data
+            self._snapshot.flags.writeable = False
+        self._bump_version()
+
+    def get_pixel_snapshot(self):
+        """Return a cached, read-only copy of the canvas pixels.
+
+        The snapshot is reused for as long as the canvas version is unchanged,
+        so repeated fills without any drawing in between skip the full readback.
+        """
+        self.confirm_current_shape()
+        if self._snapshot is not None and self._snapshot_version == self.version:
+            self.snapshot_hits += 1
+        else:
+            self.snapshot_misses += 1
+            self._snapshot = self.raster.to_array()
+            self._snapshot.flags.writeable = False
+            self._snapshot_version = self.version
+        return self._snapshot
+
+    def snapshot_stats(self):
+        """Return the pixel snapshot cache counters for monitoring"""
+        return {'version': self.version, 'hits': self.snapshot_hits, 'misses': self.snapshot_misses}
+
+    def replace_pixels(self, data, layer=None):
+        """Replace a layer (the active one by default) with an RGBA array or the tiles of a TileStore.
+
+        The whole canvas, and every other layer, is resized to match and the view
+        zooms out if needed to fit it in the widget.
+        """
+        layer = layer or self.active_layer
+        self._bump_version(invalidate=True)
+        if isinstance(data, TileStore):
+            layer.raster.load_store(data)
+        else:
+            layer.raster.load_array(data)
+        self.compositor.drop(layer)  # Re-uploaded as tiles come into view
+        self.layers.resize(layer.raster.width, layer.raster.height)
+        self.tile_view.reset(pyramids=True)
+        self.canvas_follows_size = False
+        self.viewport.fit(self.layers.width, self.layers.height, self.width, self.height)
+        self._rebuild_canvas()
+
+    def get_pixels(self):
+        """Return the visible layers flattened into a (height, width, 4) RGBA array, row 0 at the top"""
+        self.confirm_current_shape()
+        return self.layers.flatten()
+
+    def estimate_export_size(self, format='PNG', quality=90, transparency=True, on_ready=None):
+        """Estimate the bytes an export would take from rows sampled across the flattened layers.
+
+        Estimates are cached until the canvas changes. With `on_ready`, one that isn't cached
+        yet is encoded on a worker thread: this returns None and on_ready(size) is called from
+        that thread, so the export panel's sliders never wait on an encoder.
+        """
+        self.confirm_current_shape()
+        # Writes to layers other than the active one don't bump the version, but do their revision
+        version = (self.version, tuple((layer.id, layer.visible, layer.opacity, layer.raster.revision)
+                                       for layer in self.layers.layers))
+        args = (version, self.layers.width, self.layers.height, self.layers.flatten_region)
+        if on_ready is not None:
+            return self.size_estimator.estimate_later(*args, on_ready, format, quality, transparency)
+        return self.size_estimator.estimate(*args, format, quality, transparency)
+
+    def commit_live_instructions(self):
+        """Rasterize the live canvas instructions into the tile store.
+
+        Returns a DrawCommand covering the changed region, or None if nothing was drawn.
+        """
+        # Texture bindings are added and removed together with their vertex instruction
+        live = [instr for instr in self.canvas.children[self._base_instructions:]
+                if not isinstance(instr, BindTexture) and instr is not self.canvas.after]
+        if not live:
+            return None
+        bounds = [b for b in map(_instruction_bounds, live) if b]
+        region = None
+        if bounds:
+            # Convert window-space bounds to image coordinates (row 0 at the top)
+            x0 = min(b[0] for b in bounds) - self.x
+            y0 = min(b[1] for b in bounds) - self.y
+            x1 = max(b[2] for b in bounds) - self.x
+            y1 = max(b[3] for b in bounds) - self.y
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, self.raster.width), min(y1, self.raster.height)
+            if x1 > x0 and y1 > y0:
+                region = self.raster.clip(int(x0), int(self.raster.height - y1),
+                                          int(x1 - x0) + 1, int(y1 - y0) + 1)
+        for instr in live:
+            self.canvas.remove(instr)
+        if region is None:
+            return None
+
+        x, y, width, height = region
+        bottom = self.raster.height - y - height  # Region bottom edge in widget space
+        old_pixels = self.raster.read_region(x, y, width, height)
+        # The region's own pixels are the backdrop, so the layer texture need not be resident
+        backdrop = Texture.create(size=(width, height), colorfmt='rgba', bufferfmt='ubyte')
+        backdrop.flip_vertical()
+        backdrop.blit_buffer(old_pixels.reshape(-1), colorfmt='rgba', bufferfmt='ubyte')
+        instrumentation.count('texture_upload_bytes', old_pixels.nbytes)
+        # Wide translucent Lines mask their overlaps with the stencil buffer
+        fbo = Fbo(size=(width, height), with_stencilbuffer=True)
+        with fbo:
+            ClearColor(0, 0, 0, 0)
+            ClearBuffers()
+            # Blend so the alpha of transparent layers accumulates correctly
+            Callback(blend_premultiplied_output)
+            Color(1, 1, 1, 1)
+            Rectangle(texture=backdrop, pos=(0, 0), size=(width, height))
+            Translate(-self.x - x, -self.y - bottom)
+        for instr in live:
+            fbo.add(instr)
+        fbo.add(Callback(blend_default))
+        fbo.draw()
+        # Fbo rows are bottom-up, the tile store is top-down
+        new_pixels = np.frombuffer(fbo.pixels, dtype=np.uint8).reshape(height, width, 4)[::-1].copy()
+        unpremultiply(new_pixels)
+        self.write_pixels(x, y, new_pixels)
+        return DrawCommand(self, RegionDelta(region, old_pixels, new_pixels), self.active_layer)
 
     def set_color(self, color):
         self.current_color = color
@@ -107,47 +481,196 @@ class PaintWidget(Widget):
     def set_tool(self, tool):
         # Confirm any active shape before switching tools
         self.confirm_current_shape()
+        self.cancel_fill_preview()
         # Deactivate the current tool if it has a deactivate method
         if self.current_tool and hasattr(self.current_tool, 'deactivate'):
             self.current_tool.deactivate()
         self.tool_manager.set_tool(tool)
 
+    def set_fill_tolerance(self, tolerance):
+        """Set the bucket fill tolerance; a fill being previewed follows it"""
+        self.tool_manager.set_fill_tolerance(tolerance)
+        if self._fill_preview is not None:
+            self._fill_preview.set_tolerance(self.tool_manager.fill_tolerance)
+            self._fill_overlay_update()
+
+    def set_fill_preview(self, preview):
+        """Have fill clicks preview their region, filling on a second click inside it"""
+        self.tool_manager.set_fill_preview(preview)
+        if not preview:
+            self.cancel_fill_preview()
+
+    @property
+    def has_fill_preview(self):
+        return self._fill_preview is not None
+
+    def show_fill_preview(self, tool):
+        """Overlay the region of a FillTool's preview until it is committed or cancelled"""
+        if tool is not self._fill_preview:
+            self.cancel_fill_preview()
+        self._fill_preview = tool
+        self._update_fill_overlay()
+        # Build the maps a tolerance change reads on the next frame, not on the first slider move
+        Clock.schedule_once(lambda dt: self._prepare_fill_preview(tool))
+
+    def _prepare_fill_preview(self, tool):
+        if tool is self._fill_preview:
+            tool.region.prepare()
+
+    def commit_fill_preview(self):
+        """Fill the previewed region at the current tolerance"""
+        tool, self._fill_preview = self._fill_preview, None
+        self._fill_overlay.clear()
+        if tool is not None:
+            tool.commit_preview()
+
+    def cancel_fill_preview(self):
+        if self._fill_preview is None:
+            return
+        self._fill_preview.cancel_preview()
+        self._fill_preview = None
+        self._fill_overlay.clear()
+        self.canvas.ask_update()
+
+    def _update_fill_overlay(self, *args):
+        """Draw the previewed fill over the part of the image in view.
+
+        Only the visible part of the region's mask is uploaded, sampled at the view's
+        mip level, so a tolerance change costs about a screenful of texels.
+        """
+        if self._fill_preview is None:
+            return
+        with instrumentation.timer('fill_preview'):
+            (left, top, right, bottom), mask = self._fill_preview.preview_region()
+            self._fill_overlay.clear()
+            self.canvas.ask_update()
+            visible = self.viewport.visible_region(self.layers.width, self.layers.height, self.width, self.height)
+            if visible is None:
+                return
+            step = 1 << self.viewport.level(self.tile_view.max_level)
+            # Start on the step grid so the sampled texels stay put while panning
+            x0 = max(left, int(visible[0]) // step * step)
+            y0 = max(top, int(visible[1]) // step * step)
+            x1 = min(right, int(math.ceil(visible[2])))
+            y1 = min(bottom, int(math.ceil(visible[3])))
+            if x1 <= x0 or y1 <= y0:
+                return
+            sampled = mask[y0 - top:y1 - top:step, x0 - left:x1 - left:step]
+            rows, cols = sampled.shape
+            texels = np.full((rows, cols, 2), 255, dtype=np.uint8)
+            np.multiply(sampled, 255, out=texels[:, :, 1], casting='unsafe')
+            texture = Texture.create(size=(cols, rows), colorfmt='luminance_alpha', bufferfmt='ubyte')
+            texture.mag_filter = 'nearest'
+            texture.flip_vertical()
+            texture.blit_buffer(texels.reshape(-1), colorfmt='luminance_alpha', bufferfmt='ubyte')
+            instrumentation.count('texture_upload_bytes', texels.nbytes)
+            self._fill_overlay.add(Color(0.2, 0.5, 1, 0.45))
+            self._fill_overlay.add(Rectangle(texture=texture, size=(cols * step, rows * step),
+                                             pos=(self.x + x0, self.y + self.layers.height - y0 - rows * step)))
+
+    def push_command(self, command, record=None):
+        """Add an executed command to the undo history, with the document record it produced"""
+        command.record = record
+        if record is not None:
+            record.layer = self.active_layer.id
+            self.document.add(record)
+        self.history.push(command)
+        if self.journal is not None:
+            if record is None or isinstance(record, ImageRecord):
+                self._journal_checkpoint()
+            else:
+                self.journal.append(record, self.document)
+
+    def _tool_record(self, tool):
+        """The finished tool operation as a document record in canvas coordinates"""
+        record = tool.to_record(self.document)
+        if record is not None:
+            record.translate(-self.x, -self.y)
+        return record
+
     def confirm_current_shape(self):
         """Confirm the current shape and clean up"""
         if isinstance(self.current_tool, ShapeTool) and self.current_tool.shape:
             try:
-                # Save the current shape to undo stack
-                command = DrawCommand([self.current_tool.shape])
-                self.undo_stack.append(command)
-                self.redo_stack.clear()
-                # Clean up
-                self.current_tool.active = False
-                if self.current_tool.handles in self.canvas.children:
-                    self.canvas.remove(self.current_tool.handles)
+                # Clean up the handles so only the shape itself is rasterized
+                tool = self.current_tool
+                tool.active = False
+                if tool.handles in self.canvas.children:
+                    self.canvas.remove(tool.handles)
                 self.current_tool = None
-            except Exception as e:
-                print(f"Error confirming shape: {e}")
+                # Flatten the shape into the tile store and save it to the undo stack
+                with instrumentation.timer('commit'):
+                    command = self.commit_live_instructions()
+                if command:
+                    self.push_command(command, self._tool_record(tool))
+            except Exception:
+                log.exception("Error confirming shape")
                 # Ensure cleanup even if there's an error
                 self.current_tool = None
 
+    def instruction_count(self):
+        """Top-level instructions on the widget's canvas, including before and after"""
+        return sum(len(group.children) for group in (self.canvas.before, self.canvas, self.canvas.after))
+
+    def start_recording(self):
+        """Record the touch events that reach the canvas, to replay them with input_recording.replay()"""
+        self.recorder = InputRecorder()
+
+    def stop_recording(self, path):
+        """Save the recorded events to `path` and stop recording"""
+        if self.recorder is None:
+            return
+        self.recorder.save(path, self)
+        log.info("Recorded %d touch events to %s", len(self.recorder.events), path)
+        self.recorder = None
+
+    def _view_touch_down(self, touch):
+        """Scroll to zoom about the pointer, drag with the middle button to pan"""
+        button = getattr(touch, 'button', None)
+        if button in ('scrollup', 'scrolldown'):
+            # Kivy reports wheel-up as 'scrolldown'
+            self.zoom(ZOOM_STEP if button == 'scrolldown' else 1 / ZOOM_STEP, *touch.pos)
+            return True
+        if button in ('scrollleft', 'scrollright'):
+            self.pan(PAN_STEP if button == 'scrollleft' else -PAN_STEP, 0)
+            return True
+        if button == 'middle':
+            self.confirm_current_shape()
+            touch.ud['pan'] = True
+            return True
+        return False
+
     def on_touch_down(self, touch):
+        if self.recorder is not None:
+            self.recorder.record(DOWN, touch, self)
         # If clicking in the menu bar area, confirm any active shape first
         if touch.y > self.height - 0:  # Only menu bar height
             self.confirm_current_shape()  # Always confirm shape when clicking menu
             return False
 
         if self.collide_point(*touch.pos):
+            if self._view_touch_down(touch):
+                return True
+            # Tools work in canvas coordinates, so map the touch through the viewport
+            x, y = self.to_canvas(*touch.pos)
             # First check if we have an active shape tool that's being edited
             if isinstance(self.current_tool, ShapeTool) and self.current_tool.shape:
                 # Click outside shape area finalizes it
-                if not self.current_tool.contains_point(touch.x, touch.y):
+                if not self.current_tool.contains_point(x, y):
                     self.confirm_current_shape()
                     return True
                 # Click inside continues editing
-                instructions = self.current_tool.on_touch_down(touch.x, touch.y)
+                instructions = self.current_tool.on_touch_down(x, y)
                 self.current_instructions = instructions
                 return True
 
+            # A click inside a previewed fill fills it; anywhere else drops the preview
+            if self._fill_preview is not None:
+                if self._fill_preview.preview_contains(x, y):
+                    self.commit_fill_preview()
+                    return True
+                self.cancel_fill_preview()
+
             # Create new tool instance if no active tool
             self.current_tool = self.tool_manager.create_tool(
                 self.canvas, 
@@ -161,94 +684,80 @@ class PaintWidget(Widget):
                 self.current_tool.activate()
 
             touch.ud['tool'] = self.current_tool
-            self.points = [touch.x, touch.y]  # Initialize points on touch down
-            instructions = self.current_tool.on_touch_down(touch.x, touch.y)
+            instructions = self.current_tool.on_touch_down(x, y)
             self.current_instructions = instructions
         else:
             # If clicking outside the widget entirely, confirm any active shape
             self.confirm_current_shape()
 
     def on_touch_move(self, touch):
+        if self.recorder is not None:
+            self.recorder.record(MOVE, touch, self)
         # Prevent drawing in the menu bar area only
         if touch.y > self.height - 0:  # Only menu bar height
             return False
 
+        if touch.ud.get('pan'):
+            self.pan(touch.dx, touch.dy)
+            return True
+
         if self.collide_point(*touch.pos):
+            x, y = self.to_canvas(*touch.pos)
             if 'tool' in touch.ud:
-                touch.ud['tool'].on_touch_move(touch.x, touch.y)
-                self.points.extend([touch.x, touch.y])  # Collect points during touch move
+                touch.ud['tool'].on_touch_move(x, y)
             elif isinstance(self.current_tool, ShapeTool):
-                self.current_tool.on_touch_move(touch.x, touch.y)
+                self.current_tool.on_touch_move(x, y)
 
     def on_touch_up(self, touch):
+        if self.recorder is not None:
+            self.recorder.record(UP, touch, self)
+        if touch.ud.get('pan'):
+            return True
         tool = touch.ud.get('tool') or self.current_tool
         if tool:
-            final_instructions = tool.on_touch_up(touch.x, touch.y)
-            if final_instructions:
-                command = DrawCommand(final_instructions)
-                self.undo_stack.append(command)
-                self.redo_stack.clear()
-                # Keep reference for shape tools that can be moved
-                if isinstance(tool, ShapeTool):
+            final_instructions = tool.on_touch_up(*self.to_canvas(*touch.pos))
+            if isinstance(tool, ShapeTool):
+                # Shapes stay live for moving/resizing until they are confirmed
+                if final_instructions:
                     self.current_tool = tool
-                else:
-                    self.current_tool = None
+            else:
+                with instrumentation.timer('commit'):
+                    command = self.commit_live_instructions()
+                if command:
+                    self.push_command(command, self._tool_record(tool))
+                self.current_tool = None
             self.current_instructions = None
-        
-        if len(self.points) < 4:
-            return self.points
-        
-        smooth_points = []
-        smooth_points.extend(self.points[:2])  # Add first point
-        
-        # Create smooth curve through points
-        for i in range(2, len(self.points) - 2, 2):
-            x0, y0 = self.points[i - 2], self.points[i - 1]  # Previous point
-            x1, y1 = self.points[i], self.points[i + 1]      # Current point
-            x2, y2 = self.points[i + 2], self.points[i + 3]  # Next point
-            
-            # Calculate control points for Bézier curve
-            cp1x = x0 + (x1 - x0) * 0.5
-            cp1y = y0 + (y1 - y0) * 0.5
-            cp2x = x1 + (x2 - x1) * 0.5
-            cp2y = y1 + (y2 - y1) * 0.5
-            
-            # Add points for smooth curve
-            smooth_points.extend([cp1x, cp1y, x1, y1, cp2x, cp2y])
-        
-        smooth_points.extend(self.points[-2:])  # Add last point
-        self.points = []  # Clear points after processing
-        return smooth_points
+        return bool(tool)
 
     def undo(self):
-        print("\nExecuting undo:")
-        print(f"- Undo stack size: {len(self.undo_stack)}")
-        print(f"- Redo stack size: {len(self.redo_stack)}")
-        
         self.confirm_current_shape()
-        if self.undo_stack:
+        if not self.undo_stack:
+            log.debug("Nothing to undo")
+            return
+        with instrumentation.timer('undo'):
             command = self.undo_stack.pop()
-            print(f"- Command type: {type(command).__name__}")
             command.undo(self.canvas)
+            if getattr(command, 'record', None) is not None:
+                self.document.remove(command.record)
             self.redo_stack.append(command)
-            print("Undo completed")
-        else:
-            print("No actions to undo")
+            self._journal_checkpoint()
+        log.debug("Undid %s (%d to undo, %d to redo)", type(command).__name__,
+                  len(self.undo_stack), len(self.redo_stack))
 
     def redo(self):
-        print("\nExecuting redo:")
-        print(f"- Undo stack size: {len(self.undo_stack)}")
-        print(f"- Redo stack size: {len(self.redo_stack)}")
-        
         self.confirm_current_shape()
-        if self.redo_stack:
+        if not self.redo_stack:
+            log.debug("Nothing to redo")
+            return
+        with instrumentation.timer('redo'):
             command = self.redo_stack.pop()
-            print(f"- Command type: {type(command).__name__}")
             command.redo(self.canvas)
+            if getattr(command, 'record', None) is not None:
+                self.document.add(command.record)
             self.undo_stack.append(command)
-            print("Redo completed")
-        else:
-            print("No actions to redo")
+            self._journal_checkpoint()
+        log.debug("Redid %s (%d to undo, %d to redo)", type(command).__name__,
+                  len(self.undo_stack), len(self.redo_stack))
 
     def has_unsaved_changes(self):
         """Check if there are any unsaved changes"""
@@ -256,23 +765,18 @@ class PaintWidget(Widget):
     
     def clear_canvas(self):
         """Clear the canvas and reset drawing history"""
-        # First store the background color and rectangle
-        with self.canvas:
-            bg_color = Color(1, 1, 1, 1)  # White background
-            bg_rect = Rectangle(pos=self.pos, size=self.size)
-        
-        # Clear everything
-        self.canvas.clear()
-        
-        # Restore the background
-        with self.canvas:
-            self.canvas.add(bg_color)
-            self.canvas.add(bg_rect)
+        # Back to a single white background layer, dropping live instructions
+        self.cancel_image_load()
+        self._bump_version(invalidate=True)
+        self._set_layers(LayerStack(*self.size))
+        self.canvas_follows_size = True
+        self.viewport.reset()
+        self._rebuild_canvas()
         
         # Reset all state
-        self.undo_stack.clear()
-        self.redo_stack.clear()
-        self.points = []
+        self.history.clear()
+        self.document.clear()
+        self.document.resize(self.layers.width, self.layers.height)
         self.current_instructions = None
         
         # Properly cleanup any active tool
@@ -283,81 +787,238 @@ class PaintWidget(Widget):
         # Reset to default state
         self.current_color = [0, 0, 0, 1]
         self.line_width = 2
+        self._journal_checkpoint()
 
     def export_as_image(self):
         """Capture the current canvas state as an image"""
         # Use the parent class method to get the image
         return super().export_as_image()
     
-    def clear_unsaved_changes(self):
-        """Clear the unsaved changes flag after successful save"""
-        self.undo_stack.clear()
-        self.redo_stack.clear()
+    def history_position(self):
+        """Identify the document state: it changes whenever a command is done, undone or redone"""
+        return len(self.undo_stack), self.undo_stack[-1] if self.undo_stack else None
+
+    def clear_unsaved_changes(self, position=None):
+        """Clear the unsaved changes flag after successful save
+
+        With a position from history_position(), only if the document is still in that state.
+        """
+        if position is not None and position != self.history_position():
+            log.debug("Document changed since it was saved, keeping its history")
+            return
+        self.history.clear()
 
     def load_image(self, filepath):
         """Load an image from a file and display it on the canvas."""
         try:
-            print(f"\nLoading image: {filepath}")
-            
-            # Store current canvas state
-            old_size = list(self.size)
-            old_instructions = self.canvas.children[:]
-            print(f"Current canvas state:")
-            print(f"- Size: {old_size}")
-            print(f"- Instructions count: {len(old_instructions)}")
-            
-            # Load and process image
-            with open(filepath, 'rb') as f:
-                data = f.read()
-            pil_image = Image.open(io.BytesIO(data)).convert('RGBA')
-            image_data = pil_image.tobytes()
-            
-            # Create texture
-            texture = Texture.create(size=pil_image.size, colorfmt='rgba', bufferfmt='ubyte')
-            texture.blit_buffer(image_data, colorfmt='rgba', bufferfmt='ubyte')
-            
-            print(f"Image processed:")
-            print(f"- Image size: {pil_image.size}")
-            print(f"- Texture created: {texture.size}")
-            
-            # Update widget size to match image
-            self.size = pil_image.size
-            
-            # Clear canvas and draw new image
-            self.canvas.clear()
-            with self.canvas:
-                # Draw white background
-                Color(1, 1, 1, 1)
-                Rectangle(pos=self.pos, size=self.size)
-                # Draw the image
-                Color(1, 1, 1, 1)  # Reset color to white
-                Rectangle(texture=texture, pos=self.pos, size=self.size)
-            
-            # Create and add command to undo stack
-            command = ImageLoadCommand(
-                self,
-                old_instructions,
-                self.canvas.children[:],  # Current instructions after loading
-                old_size,
-                pil_image.size,
-                texture
-            )
-            
-            print(f"Adding command to undo stack")
-            print(f"- Undo stack size before: {len(self.undo_stack)}")
-            self.undo_stack.append(command)
-            self.redo_stack.clear()
-            print(f"- Undo stack size after: {len(self.undo_stack)}")
-            
+            log.debug("Loading image %s", filepath)
+            with instrumentation.timer('load_image'):
+                self._apply_loaded_image(*load_tiles(filepath, self.raster.tile_size))
             return True
-            
-        except Exception as e:
-            print(f"Error in load_image: {str(e)}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            log.exception("Could not load %s", filepath)
             return False
 
+    def load_image_async(self, filepath, on_done=None):
+        """Load an image on a worker thread, showing a downscaled preview until it is decoded.
+
+        Opening another file first cancels a load still in progress. on_done(success)
+        is called on the UI thread once the image is on the canvas or has failed.
+        """
+        self.cancel_image_load()
+        log.debug("Loading image in the background: %s", filepath)
+
+        def on_preview(pixels, size):
+            Clock.schedule_once(lambda dt: self._show_preview(job, pixels, size))
+
+        def on_loaded(raster, pixels):
+            Clock.schedule_once(lambda dt: self._finish_image_load(job, raster, pixels, on_done))
+
+        def on_error(error):
+            Clock.schedule_once(lambda dt: self._fail_image_load(job, error, on_done))
+
+        job = self._image_job = ImageLoadJob(filepath, on_preview, on_loaded, on_error,
+                                             tile_size=self.raster.tile_size)
+        job.start()
+        return job
+
+    def cancel_image_load(self):
+        """Stop a background image load and drop its preview"""
+        if self._image_job is not None:
+            self._image_job.cancel()
+            self._image_job = None
+        self._preview_group.clear()
+        self.canvas.ask_update()
+
+    def _current_job(self, job):
+        # Results of a cancelled job may already be queued on the clock
+        return job is self._image_job and not job.cancelled
+
+    def _show_preview(self, job, pixels, size):
+        if not self._current_job(job):
+            return
+        height, width = pixels.shape[:2]
+        texture = Texture.create(size=(width, height), colorfmt='rgba', bufferfmt='ubyte')
+        texture.flip_vertical()
+        texture.blit_buffer(pixels.reshape(-1), colorfmt='rgba', bufferfmt='ubyte')
+        instrumentation.count('texture_upload_bytes', pixels.nbytes)
+        # Stretched to the full image size and fitted, as the loaded image will be
+        if not self._preview_group.children:
+            self.viewport.fit(size[0], size[1], self.width, self.height)
+        self._preview_group.clear()
+        self._preview_group.add(Color(1, 1, 1, 1))
+        self._preview_group.add(Rectangle(texture=texture, pos=self.pos, size=size))
+        self._update_view()
+
+    def _finish_image_load(self, job, raster, pixels, on_done):
+        if not self._current_job(job):
+            return
+        self._image_job = None
+        self._preview_group.clear()
+        try:
+            self._apply_loaded_image(raster, pixels)
+            success = True
+        except Exception:
+            log.exception("Could not show the loaded image")
+            success = False
+        if on_done is not None:
+            on_done(success)
+
+    def _fail_image_load(self, job, error, on_done):
+        if not self._current_job(job):
+            return
+        log.error("Could not load image: %s", error)
+        self.cancel_image_load()
+        if on_done is not None:
+            on_done(False)
+
+    def _apply_loaded_image(self, raster, new_pixels):
+        """Replace the active layer with a decoded image's tiles as one undoable step.
+
+        `new_pixels` holds the same image for undo and the document; image loads keep it
+        in a memory-mapped scratch file rather than in memory.
+        """
+        # Store the active layer's current state
+        self.confirm_current_shape()
+        old_pixels = self.raster.to_array()
+
+        # Take over the decoded tiles and fit the view to them
+        self.replace_pixels(raster)
+
+        # Create and add command to undo stack
+        command = ImageLoadCommand(self, old_pixels, new_pixels, self.active_layer)
+        self.push_command(command, ImageRecord(new_pixels))
+
+    def _set_layers(self, layers):
+        """Switch to a new LayerStack with fresh GPU caches"""
+        self.layers = layers
+        self.compositor = LayerCompositor(layers)
+        self.tile_view = TileView(layers)
+
+    def _layers_changed(self):
+        """Recomposite after a change to the stack itself; layer contents are not re-uploaded"""
+        self._bump_version(invalidate=True)
+        self._rebuild_canvas()
+        self._journal_checkpoint()
+
+    def add_layer(self, name=None):
+        self.confirm_current_shape()
+        layer = self.layers.add_layer(name)
+        self._layers_changed()
+        return layer
+
+    def remove_layer(self, index=None):
+        self.confirm_current_shape()
+        layer = self.layers.remove_layer(index)
+        if layer is not None:
+            self.compositor.drop(layer)
+            self._layers_changed()
+        return layer
+
+    def move_layer(self, index, new_index):
+        self.confirm_current_shape()
+        self.layers.move_layer(index, new_index)
+        self._layers_changed()
+
+    def set_active_layer(self, index):
+        self.confirm_current_shape()
+        self.layers.set_active(index)
+        self._layers_changed()
+
+    def set_layer_visible(self, index, visible):
+        self.confirm_current_shape()
+        self.layers.layers[index].visible = visible
+        self._layers_changed()
+
+    def set_layer_opacity(self, index, opacity):
+        self.confirm_current_shape()
+        self.layers.layers[index].opacity = max(0.0, min(float(opacity), 1.0))
+        self._layers_changed()
+
+    def save_project(self, filepath):
+        """Save the canvas and its document as a .paintproj, rewriting only changed chunks"""
+        self.confirm_current_shape()
+        if self.project is None or self.project.path != filepath:
+            self.project = ProjectFile(filepath)
+        stats = self.project.save(self.layers, self.document)
+        log.info("Saved project: %d chunks written, %d reused", stats['written'], stats['reused'])
+        return stats
+
+    def open_project(self, filepath):
+        """Open a .paintproj; its tiles are decoded from the mapped file as they are shown"""
+        project, layers, document = ProjectFile.open(filepath)
+        self.cancel_image_load()
+        self.confirm_current_shape()
+        self._bump_version(invalidate=True)
+        self._set_layers(layers)
+        self.document = document
+        self.project = project
+        self.history.clear()
+        self.canvas_follows_size = False
+        self.viewport.fit(layers.width, layers.height, self.width, self.height)
+        self._rebuild_canvas()
+        self._journal_checkpoint()
+
+    def start_journal(self, directory):
+        """Journal every change to the canvas in `directory`, so the session survives a crash"""
+        self.stop_journal(discard=False)
+        self.journal = journal.Journal(directory)
+        self.journal.start(self.layers, self.document)
+        self._journal_event = Clock.schedule_interval(self._journal_tick, 1)
+
+    def stop_journal(self, discard=True):
+        """Stop journaling, deleting the journaled session unless asked to keep it"""
+        if self.journal is None:
+            return
+        self._journal_event.cancel()
+        self._journal_checkpoint.cancel()
+        self.journal.close(discard)
+        self.journal = None
+
+    def _journal_tick(self, dt):
+        if self.journal.checkpoint_due:
+            self._checkpoint_journal()
+
+    def _checkpoint_journal(self, *args):
+        if self.journal is not None:
+            self.journal.checkpoint(self.layers, self.document)
+
+    def recover_session(self, directory):
+        """Restore a journaled session left behind by a crash; returns how many records were replayed"""
+        layers, document, replayed = journal.recover(directory)
+        self.cancel_image_load()
+        self.confirm_current_shape()
+        self._bump_version(invalidate=True)
+        self._set_layers(layers)
+        self.document = document
+        self.project = None
+        self.history.clear()
+        self.canvas_follows_size = False
+        self.viewport.fit(layers.width, layers.height, self.width, self.height)
+        self._rebuild_canvas()
+        self._journal_checkpoint()
+        return replayed
+
     def clear_undo_history(self):
         """Clear the undo and redo stacks."""
-        self.undo_stack.clear()
-        self.redo_stack.clear()
+        self.history.clear()
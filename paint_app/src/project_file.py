@@ -0,0 +1,375 @@
+# This file implements the native .paintproj project format.
+# A project holds the tiles of every layer and the document records in independently
+# zlib-compressed chunks, followed by an index. Opening a project memory-maps the file
+# and only decodes a tile when it is first read; saving appends just the chunks that
+# changed since the last save and then points the header at a new index. Record chunks
+# are compared by the checksums the document keeps, so only new ones are encoded, and
+# image records refer to their pixels by tile digest, so an opened image is written once
+# (sharing the layer's tile chunks where they still match) rather than on every save.
+#
+# Layout: header | chunk | chunk | ... | index
+#   header  MAGIC, format version, index offset and length (fixed size, at offset 0)
+#   chunk   zlib data of one tile, or of up to RECORDS_PER_CHUNK encoded records
+#   index   zlib-compressed JSON describing the canvas, layers, palettes and chunk locations
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from document import Document, RecordKind, Stroke, Shape, Fill, ImageRecord
+from layers import Layer, LayerStack
+from raster_store import TileStore, TILE_SIZE
+
+MAGIC = b'PAINTPRJ'
+FORMAT_VERSION = 3  # 2 added layers, 3 saves image records as tile references
+EXTENSION = '.paintproj'
+RECORDS_PER_CHUNK = 256
+COMPACT_RATIO = 0.5  # Rewrite the whole file once more than this share of it is stale chunks
+DIGEST_SIZE = 8      # Bytes of the BLAKE2 digest naming a tile of an image record
+
+_HEADER = struct.Struct('<8sIIQQ')        # magic, version, reserved, index offset, index length
+_RECORD = struct.Struct('<BBHHHIII')      # kind, square, color, width, layer, payload bytes, height, width
+_RECORD_V1 = struct.Struct('<BBHHIII')    # Version 1 records, all on the single layer
+_IMAGE = struct.Struct('<I')              # Tile size of an image record, followed by its tile digests
+
+
+class ProjectFormatError(Exception):
+    pass
+
+
+class MappedTileStore(TileStore):
+    """TileStore whose saved tiles stay compressed in a memory-mapped project file until read"""
+
+    def __init__(self, width, height, tile_size, background, mapping, chunks):
+        self._mapping = mapping
+        self._chunks = {}  # (row, col) -> (offset, length) of tiles not decoded yet
+        super().__init__(width, height, tile_size, background)
+        self._chunks = dict(chunks)
+
+    @property
+    def mapped_tiles(self):
+        """Number of tiles still waiting in the file"""
+        return len(self._chunks)
+
+    def raw_chunk(self, key):
+        """Compressed bytes of a tile that has not been decoded, or None"""
+        location = self._chunks.get(key)
+        if location is None:
+            return None
+        offset, length = location
+        return self._mapping[offset:offset + length]
+
+    def _tile(self, row, col, create=False):
+        location = self._chunks.pop((row, col), None)
+        if location is not None:
+            offset, length = location
+            data = zlib.decompress(self._mapping[offset:offset + length])
+            tile = np.frombuffer(data, dtype=np.uint8).reshape(self.tile_size, self.tile_size, 4).copy()
+            self.tiles[(row, col)] = tile
+        return super()._tile(row, col, create)
+
+    def tile_keys(self):
+        return set(self.tiles) | set(self._chunks)
+
+    def resize(self, width, height):
+        # Edge tiles may need blanking, so bring everything in first
+        for row, col in list(self._chunks):
+            self._tile(row, col)
+        super().resize(width, height)
+
+    def clear(self):
+        self._chunks.clear()
+        super().clear()
+
+
+def tile_digest(pixels):
+    return hashlib.blake2b(np.ascontiguousarray(pixels), digest_size=DIGEST_SIZE).digest()
+
+
+def image_tiles(record):
+    """(digest, pixels) of each TILE_SIZE tile of an image record, row by row.
+
+    An image record never changes once loaded, so its digests are kept on it.
+    """
+    pixels = record.pixels
+    height, width = pixels.shape[:2]
+    tiles = [pixels[y:y + TILE_SIZE, x:x + TILE_SIZE]
+             for y in range(0, height, TILE_SIZE) for x in range(0, width, TILE_SIZE)]
+    if record.digests is None:
+        record.digests = [tile_digest(tile) for tile in tiles]
+    return list(zip(record.digests, tiles))
+
+
+def _image_pixels(payload, height, width, read_tile):
+    """Reassemble an image record from the tile chunks its payload refers to: (pixels, digests)"""
+    tile_size, = _IMAGE.unpack_from(payload)
+    digests = [bytes(payload[i:i + DIGEST_SIZE]) for i in range(_IMAGE.size, len(payload), DIGEST_SIZE)]
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    positions = [(y, x) for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+    for (y, x), digest in zip(positions, digests):
+        h, w = min(tile_size, height - y), min(tile_size, width - x)
+        pixels[y:y + h, x:x + w] = np.frombuffer(read_tile(digest), dtype=np.uint8).reshape(h, w, 4)
+    return pixels, (digests if tile_size == TILE_SIZE else None)
+
+
+def encode_records(records):
+    """Pack document records into bytes: a fixed header per record, then its payload"""
+    parts = []
+    for record in records:
+        kind = record.kind
+        height = width = 0
+        if kind == RecordKind.IMAGE:
+            # The pixels are saved as tile chunks, named here by digest
+            payload = _IMAGE.pack(TILE_SIZE) + b''.join(digest for digest, _ in image_tiles(record))
+            height, width = record.pixels.shape[:2]
+            header = _RECORD.pack(kind, 0, 0, 0, record.layer, len(payload), height, width)
+        elif kind == RecordKind.FILL:
+            payload = np.array((record.x, record.y, record.tolerance), dtype=np.float32).tobytes()
+            header = _RECORD.pack(kind, 0, record.color, 0, record.layer, len(payload), 0, 0)
+        else:
+            values = record.points if isinstance(record, Stroke) else record.geometry
+            payload = np.ascontiguousarray(values, dtype=np.float32).tobytes()
+            square = int(getattr(record, 'square', False))
+            header = _RECORD.pack(kind, square, record.color, record.width, record.layer, len(payload), 0, 0)
+        parts.append(header)
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_records(data, version=FORMAT_VERSION, read_tile=None):
+    """Unpack encode_records() output; read_tile(digest) returns the bytes of an image record's tile"""
+    records = []
+    offset = 0
+    view = memoryview(data)
+    while offset < len(data):
+        if version == 1:
+            kind, square, color, width, size, height, image_width = _RECORD_V1.unpack_from(data, offset)
+            layer = 0
+            offset += _RECORD_V1.size
+        else:
+            kind, square, color, width, layer, size, height, image_width = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+        payload = view[offset:offset + size]
+        offset += size
+        kind = RecordKind(kind)
+        if kind == RecordKind.IMAGE and version < 3:
+            pixels = np.frombuffer(payload, dtype=np.uint8).reshape(height, image_width, 4).copy()
+            record = ImageRecord(pixels)
+        elif kind == RecordKind.IMAGE:
+            pixels, digests = _image_pixels(payload, height, image_width, read_tile)
+            record = ImageRecord(pixels)
+            record.digests = digests
+        else:
+            values = np.frombuffer(payload, dtype=np.float32)
+            if kind == RecordKind.FILL:
+                record = Fill(values[0], values[1], color, int(values[2]))
+            elif kind in (RecordKind.PENCIL, RecordKind.BRUSH, RecordKind.ERASER):
+                record = Stroke(kind, values, color, width, bool(square))
+            else:
+                record = Shape(kind, values, color, width)
+        record.layer = layer
+        records.append(record)
+    return records
+
+
+class ProjectFile:
+    """A .paintproj file and the chunks last saved to it"""
+
+    def __init__(self, path):
+        self.path = path
+        self._rasters = {}         # Layer id -> tile store the saved tile revisions belong to
+        self._tiles = {}           # (layer id, row, col) -> (offset, length, revision)
+        self._record_chunks = []   # [(offset, length, crc32 and length of the encoded records)]
+        self._images = {}          # Tile digest -> (offset, length) of a chunk holding an image record's tile
+        self._size = 0             # Bytes in the file
+        self._live = 0             # Bytes in the header, live chunks and index
+        self.meta = {}             # Extra JSON-serializable values kept in the index
+
+    @classmethod
+    def open(cls, path):
+        """Open a project, returning (project, layers, document).
+
+        The file stays memory-mapped; tiles are decoded the first time they are read.
+        """
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, index_offset, index_length = _HEADER.unpack_from(mapping, 0)
+        if magic != MAGIC:
+            raise ProjectFormatError(f"{path} is not a Paint project")
+        if version > FORMAT_VERSION:
+            raise ProjectFormatError(f"{path} needs a newer version of Paint (format {version})")
+        index = json.loads(zlib.decompress(mapping[index_offset:index_offset + index_length]))
+        if version == 1:
+            index['layers'] = [{'id': 0, 'name': 'Background', 'opacity': 1.0, 'visible': True,
+                                'background': index['background'], 'tiles': index['tiles']}]
+            index['active'] = 0
+
+        project = cls(path)
+        layers = []
+        for entry in index['layers']:
+            tiles = {(row, col): (offset, length) for row, col, offset, length in entry['tiles']}
+            raster = MappedTileStore(index['width'], index['height'], index['tile_size'],
+                                     tuple(entry['background']), mapping, tiles)
+            layers.append(Layer(entry['id'], entry['name'], raster, entry['opacity'], entry['visible']))
+            project._rasters[entry['id']] = raster
+            project._tiles.update({(entry['id'],) + key: (offset, length, 0)
+                                   for key, (offset, length) in tiles.items()})
+        stack = LayerStack(index['width'], index['height'], layers, index['active'])
+
+        project._images = {bytes.fromhex(digest): (offset, length)
+                           for digest, offset, length in index.get('images', [])}
+
+        def read_tile(digest):
+            offset, length = project._images[digest]
+            return zlib.decompress(mapping[offset:offset + length])
+
+        document = Document(index['width'], index['height'])
+        for color in index['colors']:
+            document.color_index(color)
+        for width in index['widths']:
+            document.width_index(width)
+        for offset, length, *_ in index['records']:
+            document.records.extend(decode_records(zlib.decompress(mapping[offset:offset + length]), version,
+                                                   read_tile))
+
+        project._record_chunks = [tuple(chunk) for chunk in index['records']]
+        project.meta = index.get('meta', {})
+        project._size = len(mapping)
+        project._count_live(index_length)
+        return project, stack, document
+
+    def save(self, layers, document):
+        """Write a LayerStack and its document, appending only changed chunks when the file allows it.
+
+        Returns a dict with the number of chunks written and reused and the bytes written.
+        """
+        stale = self._size - self._live
+        if (not self._rasters or not os.path.exists(self.path)
+                or stale > COMPACT_RATIO * self._size):
+            return self._write_full(layers, document)
+        with open(self.path, 'r+b') as f:
+            f.seek(self._size)
+            stats = self._write_chunks(f, layers, document, reuse=True)
+            self._commit(f, layers, document, stats)
+        return stats
+
+    def _write_full(self, layers, document):
+        # A fresh file next to the old one, swapped in once complete
+        temp_path = self.path + '.tmp'
+        self._tiles = {}
+        self._record_chunks = []
+        self._images = {}
+        with open(temp_path, 'w+b') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, 0, 0))
+            stats = self._write_chunks(f, layers, document, reuse=False)
+            self._commit(f, layers, document, stats)
+        os.replace(temp_path, self.path)
+        return stats
+
+    def _write_chunks(self, f, layers, document, reuse):
+        stats = {'written': 0, 'reused': 0, 'bytes': 0}
+
+        def append(data):
+            offset = f.tell()
+            f.write(data)
+            stats['written'] += 1
+            stats['bytes'] += len(data)
+            return offset, len(data)
+
+        # Tiles of image records that are already in the file are not written again
+        needed = {digest: pixels for record in document.records if record.kind == RecordKind.IMAGE
+                  for digest, pixels in image_tiles(record)}
+        images = {digest: self._images[digest] for digest in needed if reuse and digest in self._images}
+        stats['reused'] += len(images)
+
+        tiles = {}
+        for layer in layers.layers:
+            raster = layer.raster
+            # Saved revisions only describe the tile store they were taken from
+            same = reuse and self._rasters.get(layer.id) is raster
+            for key in sorted(raster.tile_keys()):
+                revision = raster.tile_revisions.get(key, 0)
+                saved = self._tiles.get((layer.id,) + key)
+                if same and saved is not None and saved[2] == revision:
+                    tiles[(layer.id,) + key] = saved
+                    stats['reused'] += 1
+                    continue
+                # Tiles still sitting compressed in a mapped file are copied without decoding
+                raw = raster.raw_chunk(key) if isinstance(raster, MappedTileStore) else None
+                digest = None
+                if raw is None:
+                    raw = zlib.compress(raster.tiles[key], 1)
+                    # A layer tile unchanged since an image was opened also serves the image record
+                    if len(images) < len(needed):
+                        digest = tile_digest(raster.tiles[key])
+                location = tiles[(layer.id,) + key] = append(raw) + (revision,)
+                if digest in needed and digest not in images:
+                    images[digest] = location[:2]
+        self._tiles = tiles
+        for digest, pixels in needed.items():
+            if digest not in images:
+                images[digest] = append(zlib.compress(np.ascontiguousarray(pixels), 1))
+        self._images = images
+
+        chunks = []
+        records = document.records
+        for number, (crc, size) in enumerate(document.record_chunks(RECORDS_PER_CHUNK)):
+            if reuse and number < len(self._record_chunks) and self._record_chunks[number][2:] == (crc, size):
+                chunks.append(self._record_chunks[number])
+                stats['reused'] += 1
+                continue
+            start = number * RECORDS_PER_CHUNK
+            encoded = encode_records(records[start:start + RECORDS_PER_CHUNK])
+            chunks.append(append(zlib.compress(encoded, 1)) + (crc, size))
+        self._record_chunks = chunks
+        return stats
+
+    def _commit(self, f, layers, document, stats):
+        """Write the index after the chunks, then point the header at it"""
+        index = {
+            'version': FORMAT_VERSION,
+            'width': layers.width,
+            'height': layers.height,
+            'tile_size': layers.layers[0].raster.tile_size,
+            'layers': [{
+                'id': layer.id,
+                'name': layer.name,
+                'opacity': layer.opacity,
+                'visible': layer.visible,
+                'background': [int(c) for c in layer.raster.background],
+                'tiles': [[row, col, offset, length]
+                          for (layer_id, row, col), (offset, length, _) in sorted(self._tiles.items())
+                          if layer_id == layer.id],
+            } for layer in layers.layers],
+            'active': layers.active_index,
+            'colors': document.colors,
+            'widths': document.widths,
+            'records': [list(chunk) for chunk in self._record_chunks],
+            'images': [[digest.hex(), offset, length] for digest, (offset, length) in sorted(self._images.items())],
+            'meta': self.meta,
+        }
+        data = zlib.compress(json.dumps(index).encode('utf-8'))
+        index_offset = f.tell()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        # The header is the commit point: until it changes, the previous index stays valid
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, index_offset, len(data)))
+        f.flush()
+        os.fsync(f.fileno())
+        stats['bytes'] += len(data)
+
+        self._rasters = {layer.id: layer.raster for layer in layers.layers}
+        self._size = index_offset + len(data)
+        self._count_live(len(data))
+
+    def _count_live(self, index_length):
+        # Image records can share chunks with layer tiles, so each chunk counts once
+        chunks = ({tile[:2] for tile in self._tiles.values()} | set(self._images.values())
+                  | {chunk[:2] for chunk in self._record_chunks})
+        self._live = _HEADER.size + index_length + sum(length for _, length in chunks)
@@ -0,0 +1,183 @@
+# This file implements the tiled raster backing store for the paint canvas.
+# Committed drawing is flattened into fixed-size RGBA tiles so the live Kivy canvas
+# only ever holds the strokes that are still being drawn.
+import zlib
+
+import numpy as np
+
+TILE_SIZE = 256
+BACKGROUND = (255, 255, 255, 255)
+
+
+class TileStore:
+    """Sparse grid of RGBA tiles addressed in image coordinates (row 0 is the top).
+
+    Tiles that were never written are not allocated and read back as the
+    background color, so a blank canvas costs almost nothing.
+    """
+
+    def __init__(self, width, height, tile_size=TILE_SIZE, background=BACKGROUND):
+        self.tile_size = tile_size
+        self.background = np.array(background, dtype=np.uint8)
+        self.width = 0
+        self.height = 0
+        self.tiles = {}
+        # Every write stamps the tiles it touches with a new revision, so savers can
+        # tell which tiles changed since they last looked
+        self.revision = 0
+        self.tile_revisions = {}
+        self.resize(width, height)
+
+    @property
+    def shape(self):
+        return (self.height, self.width, 4)
+
+    def resize(self, width, height):
+        """Change the canvas size, keeping existing content anchored to the top-left."""
+        width, height = max(int(width), 1), max(int(height), 1)
+        if (width, height) == (self.width, self.height):
+            return
+        rows = -(-height // self.tile_size)
+        cols = -(-width // self.tile_size)
+        self.tiles = {key: tile for key, tile in self.tiles.items() if key[0] < rows and key[1] < cols}
+        # Blank out anything past the new edges so growing again shows background
+        for (row, col), tile in self.tiles.items():
+            tile[:, max(width - col * self.tile_size, 0):] = self.background
+            tile[max(height - row * self.tile_size, 0):, :] = self.background
+            self._touch((row, col))
+        self.width, self.height = width, height
+
+    def clear(self):
+        """Drop all tiles, leaving a canvas filled with the background color."""
+        self.tiles.clear()
+        self.tile_revisions.clear()
+
+    def tile_keys(self):
+        """(row, col) keys of every tile that holds content"""
+        return set(self.tiles)
+
+    def _touch(self, key):
+        self.revision += 1
+        self.tile_revisions[key] = self.revision
+
+    def _tile(self, row, col, create=False):
+        tile = self.tiles.get((row, col))
+        if tile is None and create:
+            tile = np.empty((self.tile_size, self.tile_size, 4), dtype=np.uint8)
+            tile[:] = self.background
+            self.tiles[(row, col)] = tile
+        return tile
+
+    def _spans(self, x, y, w, h):
+        """Yield (row, col, tile_slice, region_slice) for every tile overlapping a region."""
+        ts = self.tile_size
+        for row in range(y // ts, (y + h - 1) // ts + 1):
+            ty0 = max(y, row * ts)
+            ty1 = min(y + h, (row + 1) * ts)
+            for col in range(x // ts, (x + w - 1) // ts + 1):
+                tx0 = max(x, col * ts)
+                tx1 = min(x + w, (col + 1) * ts)
+                tile_slice = (slice(ty0 - row * ts, ty1 - row * ts), slice(tx0 - col * ts, tx1 - col * ts))
+                region_slice = (slice(ty0 - y, ty1 - y), slice(tx0 - x, tx1 - x))
+                yield row, col, tile_slice, region_slice
+
+    def clip(self, x, y, w, h):
+        """Clip a region to the canvas, returning (x, y, w, h) or None if it is empty."""
+        x0, y0 = max(int(x), 0), max(int(y), 0)
+        x1, y1 = min(int(x + w), self.width), min(int(y + h), self.height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1 - x0, y1 - y0
+
+    def read_region(self, x, y, w, h, out=None):
+        """Return a (h, w, 4) copy of the pixels in a region that lies inside the canvas."""
+        if out is None:
+            out = np.empty((h, w, 4), dtype=np.uint8)
+        for row, col, tile_slice, region_slice in self._spans(x, y, w, h):
+            tile = self._tile(row, col)
+            if tile is None:
+                out[region_slice] = self.background
+            else:
+                out[region_slice] = tile[tile_slice]
+        return out
+
+    def write_region(self, x, y, data):
+        """Copy a (h, w, 4) array into the canvas with its top-left corner at (x, y)."""
+        h, w = data.shape[:2]
+        for row, col, tile_slice, region_slice in self._spans(x, y, w, h):
+            self._tile(row, col, create=True)[tile_slice] = data[region_slice]
+            self._touch((row, col))
+
+    def to_array(self):
+        """Assemble the whole canvas into a single (height, width, 4) array."""
+        return self.read_region(0, 0, self.width, self.height)
+
+    def load_array(self, data):
+        """Replace the canvas contents (and size) with an RGBA array."""
+        height, width = data.shape[:2]
+        self.clear()
+        self.width, self.height = 0, 0
+        self.resize(width, height)
+        self.write_region(0, 0, data)
+
+    def load_store(self, other):
+        """Replace the canvas contents (and size) with another store's tiles, taking them over without a copy."""
+        if other.tile_size != self.tile_size:
+            raise ValueError(f"Tile size {other.tile_size} does not match {self.tile_size}")
+        self.clear()
+        self.width, self.height = 0, 0
+        self.resize(other.width, other.height)
+        self.tiles = dict(other.tiles)
+        for key in self.tiles:
+            self._touch(key)
+
+
+class RegionDelta:
+    """Before and after pixels of one rectangular region, kept zlib-compressed.
+
+    Raster undo entries hold one of these instead of full-canvas copies, so
+    their memory scales with the area that changed (and compresses well for
+    the flat colors fills and strokes produce).
+    """
+
+    def __init__(self, region, old_pixels, new_pixels, level=1):
+        self.region = tuple(region)  # (x, y, width, height), row 0 at the top
+        self.shape = old_pixels.shape
+        self._old = zlib.compress(np.ascontiguousarray(old_pixels), level)
+        self._new = zlib.compress(np.ascontiguousarray(new_pixels), level)
+
+    @property
+    def nbytes(self):
+        """Bytes of compressed pixel data held in memory"""
+        return sum(len(data) for data in (self._old, self._new) if not isinstance(data, np.memmap))
+
+    @property
+    def spilled_nbytes(self):
+        """Bytes of compressed pixel data that live in a spill file"""
+        return sum(len(data) for data in (self._old, self._new) if isinstance(data, np.memmap))
+
+    def spill(self, store):
+        """Move the compressed pixel data into a history SpillStore"""
+        if not isinstance(self._old, np.memmap):
+            self._old = store.put(self._old)
+        if not isinstance(self._new, np.memmap):
+            self._new = store.put(self._new)
+
+    def _decode(self, data):
+        return np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(self.shape)
+
+    @property
+    def old_pixels(self):
+        return self._decode(self._old)
+
+    @property
+    def new_pixels(self):
+        return self._decode(self._new)
+
+    def revert(self, target, **kwargs):
+        """Write the old pixels back through target.write_pixels(x, y, data, **kwargs)"""
+        target.write_pixels(self.region[0], self.region[1], self.old_pixels, **kwargs)
+
+    def apply(self, target, **kwargs):
+        """Write the new pixels through target.write_pixels(x, y, data, **kwargs)"""
+        target.write_pixels(self.region[0], self.region[1], self.new_pixels, **kwargs)
@@ -0,0 +1,294 @@
+# This file implements a headless NumPy rasterizer for the drawing tools.
+# Pencil, brush, eraser, shape and fill operations are replayed straight into an RGBA
+# array, so export, tests and batch workers do not need Kivy or a GL context.
+#
+# Coordinates are canvas coordinates as the tools see them (origin at the bottom-left,
+# relative to the canvas widget); the pixel array is in image order (row 0 is the top).
+import numpy as np
+
+BACKGROUND = (255, 255, 255, 255)
+
+
+def new_canvas(width, height, background=BACKGROUND):
+    """Return a (height, width, 4) uint8 canvas filled with the background color"""
+    pixels = np.empty((int(height), int(width), 4), dtype=np.uint8)
+    pixels[:] = background
+    return pixels
+
+
+def line_radius(width):
+    """Half-thickness of a Kivy Line: widths up to 1 are hairlines, wider lines extend `width` each side"""
+    return width if width > 1 else 0.5
+
+
+def _box(pixels, x0, y0, x1, y1):
+    """Clip a canvas-space box to the array; returns (left, top, right, bottom) in pixels or None"""
+    height, width = pixels.shape[:2]
+    left, right = max(int(np.floor(x0)), 0), min(int(np.ceil(x1)), width)
+    top, bottom = max(int(np.floor(height - y1)), 0), min(int(np.ceil(height - y0)), height)
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right, bottom
+
+
+def _centers(pixels, box):
+    """Canvas-space x (1, w) and y (h, 1) coordinates of the pixel centres inside a box"""
+    height = pixels.shape[0]
+    left, top, right, bottom = box
+    xs = np.arange(left, right, dtype=np.float32)[None, :] + 0.5
+    ys = height - (np.arange(top, bottom, dtype=np.float32)[:, None] + 0.5)
+    return xs, ys
+
+
+def composite(pixels, box, alpha, color):
+    """Blend `color` (RGBA floats in 0..1) over a box of pixels with per-pixel coverage `alpha`"""
+    left, top, right, bottom = box
+    alpha = (alpha * color[3])[..., None]
+    region = pixels[top:bottom, left:right].astype(np.float32)
+    rgb = np.asarray(color[:3], dtype=np.float32) * 255
+    # Straight-alpha "over", so strokes on transparent layers keep their color
+    below = region[..., 3:] / 255 * (1 - alpha)
+    out_alpha = alpha + below
+    region[..., :3] = (rgb * alpha + region[..., :3] * below) / np.maximum(out_alpha, 1e-6)
+    region[..., 3:] = 255 * out_alpha
+    pixels[top:bottom, left:right] = np.rint(region).astype(np.uint8)
+
+
+def _segment_distance(xs, ys, a, b):
+    """Distance from pixel centres to the segment a-b"""
+    d = b - a
+    length = float(d @ d)
+    px, py = xs - a[0], ys - a[1]
+    if length == 0:
+        return np.hypot(px, py)
+    t = np.clip((px * d[0] + py * d[1]) / length, 0, 1)
+    return np.hypot(px - t * d[0], py - t * d[1])
+
+
+def _edge(inside):
+    # Kivy draws Lines as plain triangles, so a pixel is either covered or not
+    return (inside >= 0).astype(np.float32)
+
+
+def polyline_coverage(pixels, points, radius, closed=False):
+    """Coverage of a round-capped, round-jointed polyline.
+
+    Returns (box, coverage) or None if nothing lands on the canvas. Overlapping
+    segments take the maximum coverage, so a stroke never darkens where it
+    crosses itself.
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    if len(points) == 0:
+        return None
+    if closed:
+        points = np.concatenate([points, points[:1]])
+    pad = radius + 1
+    box = _box(pixels, points[:, 0].min() - pad, points[:, 1].min() - pad,
+               points[:, 0].max() + pad, points[:, 1].max() + pad)
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    coverage = np.zeros((bottom - top, right - left), dtype=np.float32)
+    segments = zip(points[:-1], points[1:]) if len(points) > 1 else [(points[0], points[0])]
+    for a, b in segments:
+        sub = _box(pixels, min(a[0], b[0]) - pad, min(a[1], b[1]) - pad,
+                   max(a[0], b[0]) + pad, max(a[1], b[1]) + pad)
+        if sub is None:
+            continue
+        xs, ys = _centers(pixels, sub)
+        cov = _edge(radius - _segment_distance(xs, ys, a, b))
+        view = coverage[sub[1] - top:sub[3] - top, sub[0] - left:sub[2] - left]
+        np.maximum(view, cov, out=view)
+    return box, coverage
+
+
+def draw_polyline(pixels, points, color, width, closed=False):
+    """Draw a Kivy-style Line through flat or (n, 2) points"""
+    result = polyline_coverage(pixels, points, line_radius(width), closed)
+    if result is not None:
+        composite(pixels, result[0], result[1], color)
+
+
+def draw_pencil(pixels, points, color, line_width):
+    draw_polyline(pixels, points, color, line_width)
+
+
+def erase(pixels, box, alpha):
+    """Take per-pixel coverage `alpha` away from the opacity of a box of pixels, keeping their color"""
+    left, top, right, bottom = box
+    region = pixels[top:bottom, left:right, 3]
+    region[:] = np.rint(region * (1 - alpha))
+
+
+def draw_eraser(pixels, points, line_width, transparent=False):
+    # The eraser draws a line twice as wide as the current width. It paints white on the
+    # opaque background layer and clears layers over it to transparent
+    result = polyline_coverage(pixels, points, line_radius(line_width * 2))
+    if result is None:
+        return
+    if transparent:
+        erase(pixels, *result)
+    else:
+        composite(pixels, result[0], result[1], (1, 1, 1, 1))
+
+
+def draw_line(pixels, points, color, line_width):
+    """Straight line shape from its (x1, y1, x2, y2) points"""
+    draw_polyline(pixels, points, color, line_width)
+
+
+def draw_rectangle(pixels, rectangle, color, line_width):
+    """Rectangle outline from Line(rectangle=(x, y, w, h))"""
+    x, y, w, h = rectangle
+    draw_polyline(pixels, [x, y, x + w, y, x + w, y + h, x, y + h], color, line_width, closed=True)
+
+
+def draw_circle(pixels, circle, color, line_width):
+    """Circle outline from Line(circle=(cx, cy, r))"""
+    cx, cy, r = circle[:3]
+    radius = line_radius(line_width)
+    pad = r + radius + 1
+    box = _box(pixels, cx - pad, cy - pad, cx + pad, cy + pad)
+    if box is None:
+        return
+    xs, ys = _centers(pixels, box)
+    distance = np.abs(np.hypot(xs - cx, ys - cy) - r)
+    composite(pixels, box, _edge(radius - distance), color)
+
+
+def draw_brush(pixels, dabs, color, line_width, square=False):
+    """Brush stroke from its dab centres; each dab is a disc (or square) of half-size line_width.
+
+    Dabs blend over each other like the textured quads of the brush Mesh, so the
+    stroke's alpha builds up where dabs overlap.
+    """
+    dabs = np.asarray(dabs, dtype=np.float32).reshape(-1, 2)
+    if len(dabs) == 0:
+        return
+    half = line_width
+    box = _box(pixels, dabs[:, 0].min() - half - 1, dabs[:, 1].min() - half - 1,
+               dabs[:, 0].max() + half + 1, dabs[:, 1].max() + half + 1)
+    if box is None:
+        return
+    left, top, right, bottom = box
+    # Accumulate 1 - alpha, since same-colored dabs composited in turn give 1 - prod(1 - a_i)
+    transparency = np.ones((bottom - top, right - left), dtype=np.float32)
+    for x, y in dabs:
+        sub = _box(pixels, x - half - 1, y - half - 1, x + half + 1, y + half + 1)
+        if sub is None:
+            continue
+        xs, ys = _centers(pixels, sub)
+        if square:
+            inside = (np.abs(xs - x) <= half) & (np.abs(ys - y) <= half)
+            cov = inside.astype(np.float32) * color[3]
+        else:
+            cov = np.clip(half + 0.5 - np.hypot(xs - x, ys - y), 0, 1) * color[3]
+        transparency[sub[1] - top:sub[3] - top, sub[0] - left:sub[2] - left] *= 1 - cov
+    composite(pixels, box, 1 - transparency, tuple(color[:3]) + (1,))
+
+
+def fill(pixels, x, y, color, tolerance=0):
+    """Bucket fill at canvas point (x, y) the way FillTool does; returns the filled spans"""
+    height, width = pixels.shape[:2]
+    col, row = int(x), height - int(y) - 1
+    if col < 0 or col >= width or row < 0 or row >= height:
+        return []
+    target_color = pixels[row, col][:3]
+    fill_color = np.array([int(c * 255) for c in color[:3]], dtype=np.uint8)
+    if np.array_equal(target_color, fill_color):
+        return []
+    spans = find_fill_spans(pixels, col, row, target_color, tolerance)
+    paint_spans(pixels, spans, fill_color)
+    return spans
+
+
+def paint_spans(pixel_data, spans, fill_color):
+    """Set the RGB channels of every (row, start, end) span to the fill color"""
+    for row, start, end in spans:
+        pixel_data[row, start:end, :3] = fill_color
+
+
+def spans_bounds(spans):
+    """Return the (left, top, right, bottom) half-open bounding box of a list of spans"""
+    rows = [span[0] for span in spans]
+    return (min(span[1] for span in spans), min(rows),
+            max(span[2] for span in spans), max(rows) + 1)
+
+
+def color_distance(pixels, color):
+    """Return each pixel's largest RGB channel difference from `color`, as a uint8 array.
+
+    This is what fill tolerances are compared against. It is worked out one channel
+    at a time in uint8, instead of widening the whole image to int.
+    """
+    distance = np.empty(pixels.shape[:2], dtype=np.uint8)
+    high = np.empty_like(distance)
+    low = np.empty_like(distance)
+    for channel in range(3):
+        plane = pixels[:, :, channel]
+        value = np.uint8(color[channel])
+        np.maximum(plane, value, out=high)
+        np.minimum(plane, value, out=low)
+        np.subtract(high, low, out=low if channel else distance)
+        if channel:
+            np.maximum(distance, low, out=distance)
+    return distance
+
+
+def _row_runs(row_pixels, target_color, tolerance):
+    """Run-length encode the pixels of one row that match the target color.
+
+    Returns (starts, ends) arrays of half-open [start, end) runs, sorted by start.
+    """
+    diff = np.abs(row_pixels[:, :3].astype(np.int16) - target_color)
+    match = np.all(diff <= tolerance, axis=1)
+    edges = np.diff(match.astype(np.int8), prepend=np.int8(0), append=np.int8(0))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def find_fill_spans(pixel_data, x, y, target_color, tolerance=0):
+    """Scanline seed fill over run-length encoded rows.
+
+    Each row touched by the fill is encoded once into runs of pixels within
+    `tolerance` of `target_color` (per RGB channel). Runs are then visited
+    depth-first, from a stack, through 4-connected overlaps with the rows above
+    and below, so the cost grows with the filled region rather than the whole image.
+
+    Returns a list of (row, start, end) spans making up the filled region.
+    """
+    height, width = pixel_data.shape[:2]
+    target_color = np.asarray(target_color[:3], dtype=np.int16)
+    runs = {}      # row -> (starts, ends)
+    visited = {}   # row -> boolean array, one flag per run
+
+    def row_runs(row):
+        if row not in runs:
+            runs[row] = _row_runs(pixel_data[row], target_color, tolerance)
+            visited[row] = np.zeros(len(runs[row][0]), dtype=bool)
+        return runs[row]
+
+    starts, ends = row_runs(y)
+    index = np.searchsorted(ends, x, side='right')
+    if index >= len(starts) or starts[index] > x:
+        return []  # The starting point does not match the target color
+
+    spans = []
+    visited[y][index] = True
+    stack = [(y, index)]
+    while stack:
+        row, index = stack.pop()
+        start, end = int(runs[row][0][index]), int(runs[row][1][index])
+        spans.append((row, start, end))
+        for adjacent in (row - 1, row + 1):
+            if adjacent < 0 or adjacent >= height:
+                continue
+            adj_starts, adj_ends = row_runs(adjacent)
+            # Runs overlapping [start, end) in the adjacent row
+            first = np.searchsorted(adj_ends, start, side='right')
+            last = np.searchsorted(adj_starts, end, side='left')
+            adj_visited = visited[adjacent]
+            for adj_index in range(first, last):
+                if not adj_visited[adj_index]:
+                    adj_visited[adj_index] = True
+                    stack.append((adjacent, adj_index))
+    return spans
@@ -0,0 +1,180 @@
+# This file estimates how large an export will be without encoding the whole canvas.
+# A few full-width strips of rows spread evenly down the image are flattened and
+# encoded the way the export would encode them, and their bytes per pixel are scaled
+# up to the whole canvas. Whole rows keep the horizontal runs that PNG filters and
+# deflate feed on, which small square tiles lose. BMP and TIFF are uncompressed, so
+# their size follows from the dimensions alone. The samples and every estimate are
+# cached for the current canvas version, so dragging the quality slider only encodes
+# the samples once per value, and estimate_later() does that encoding on a worker
+# thread so the export panel only ever reads cached values. Nothing here imports Kivy.
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from image_writer import flatten_on_white
+
+SAMPLE_ROWS = 16             # Rows per sampled strip, one JPEG MCU row
+SAMPLE_PIXELS = 1 << 19      # Pixels sampled in total, spread over the strips
+PNG_SAMPLE_ROWS = 8          # Rows of each strip deflated for PNG and PDF, which are slower to encode
+MIN_STRIPS, MAX_STRIPS = 4, 32
+PNG_LEVEL = 6                # Deflate level used to estimate PNG streams
+PNG_OVERHEAD = 8 + 25 + 21 + 12  # Signature, IHDR, pHYs and IEND chunks
+PDF_OVERHEAD = 1200          # Page objects, stream dictionaries and xref around the JPEG page image
+TIFF_OVERHEAD = 8 + 2 + 16 * 12 + 4 + 16  # Header, directory entries and the two rationals
+TIFF_STRIP_BYTES = 65536     # Pillow's default strip size, each strip adding an offset and a count
+
+
+def sample_rows(width, height, rows=SAMPLE_ROWS, budget=SAMPLE_PIXELS):
+    """Top rows of the strips to sample, evenly spread down the canvas.
+
+    Strips start on multiples of `rows`, so JPEG samples cover the same 8x8 blocks the
+    export does. A canvas no bigger than the budget is sampled whole, as a single strip
+    at row 0.
+    """
+    if width * height <= budget:
+        return [0]
+    strips = max(MIN_STRIPS, min(MAX_STRIPS, budget // (rows * width), height // rows))
+    return [(2 * strip + 1) * (height // rows - 1) // (2 * strips) * rows for strip in range(strips)]
+
+
+def _jpeg_size(pixels, quality):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels[..., :3]).save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.tell()
+
+
+def _png_size(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(pixels)).save(buffer, 'PNG', compress_level=PNG_LEVEL)
+    return buffer.tell()
+
+
+class SizeEstimator:
+    """Export size estimates for one canvas, cached by canvas version"""
+
+    def __init__(self, rows=SAMPLE_ROWS, budget=SAMPLE_PIXELS):
+        self.rows = rows
+        self.budget = budget
+        self._version = None
+        self._samples = None   # RGBA strips for _version
+        self._flat = None      # (samples, the same flattened on white)
+        self._estimates = {}   # (format, quality, transparency) -> bytes, for _version
+        self._lock = threading.Lock()
+        self._request = None   # Latest estimate waiting for the worker thread
+        self._worker = None
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, version, width, height, read_region):
+        if version == self._version and self._samples is not None:
+            return
+        # Replaced rather than cleared, as the worker may still be encoding the old samples
+        rows = min(self.rows, height) if width * height > self.budget else height
+        self._samples = [read_region(0, y, width, rows) for y in sample_rows(width, height, self.rows, self.budget)]
+        self._estimates = {}
+        self._version = version
+
+    def _flattened(self, samples):
+        flat = self._flat
+        if flat is None or flat[0] is not samples:
+            flat = self._flat = (samples, [flatten_on_white(rows.copy()) for rows in samples])
+        return flat[1]
+
+    def _png_data(self, samples, channels, width, height):
+        """Image data bytes of the canvas, scaled up from the top rows of every strip"""
+        # The strips are stacked into one PNG, so one deflate stream runs through them as
+        # it would through the file
+        if len(samples) > 1:
+            samples = [rows[:PNG_SAMPLE_ROWS] for rows in samples]
+        stacked = np.concatenate(samples)[..., :channels]
+        overhead = _png_size(np.zeros((1, 1, channels), dtype=np.uint8))
+        return (_png_size(stacked) - overhead) * height / stacked.shape[0]
+
+    @staticmethod
+    def _key(format, quality, transparency):
+        format = format.upper()
+        if format == 'JPG':
+            format = 'JPEG'
+        return format, quality if format in ('JPEG', 'PDF') else None, transparency if format == 'PNG' else None
+
+    def estimate(self, version, width, height, read_region, format='PNG', quality=90, transparency=True):
+        """Estimated size in bytes of exporting the canvas in a format.
+
+        `version` identifies the canvas contents: samples are read again with
+        read_region(x, y, w, h) only when it changes.
+        """
+        key = self._key(format, quality, transparency)
+        self._load(version, width, height, read_region)
+        size = self._estimates.get(key)
+        if size is not None:
+            self.hits += 1
+            return size
+        self.misses += 1
+        return self._compute(key, width, height, self._samples, self._estimates)
+
+    def estimate_later(self, version, width, height, read_region, on_ready, format='PNG', quality=90,
+                       transparency=True):
+        """The cached estimate, or None after handing it to a worker thread that calls on_ready(size).
+
+        Only reading the samples, once per canvas version, happens on the calling thread.
+        The worker keeps just the latest request, so a dragged slider doesn't queue up encodes.
+        """
+        key = self._key(format, quality, transparency)
+        self._load(version, width, height, read_region)
+        size = self._estimates.get(key)
+        if size is not None:
+            self.hits += 1
+            return size
+        with self._lock:
+            self._request = (key, width, height, self._samples, self._estimates, on_ready)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='size-estimate', daemon=True)
+                self._worker.start()
+        return None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                request, self._request = self._request, None
+                if request is None:
+                    self._worker = None
+                    return
+            key, width, height, samples, estimates, on_ready = request
+            size = estimates.get(key)
+            if size is None:
+                self.misses += 1
+                size = self._compute(key, width, height, samples, estimates)
+            on_ready(size)
+
+    def _compute(self, key, width, height, samples, estimates):
+        """Encode the samples for one estimate and cache it in `estimates`"""
+        format, quality, transparency = key
+        if format == 'BMP':
+            size = 54 + ((width * 3 + 3) & ~3) * height
+        elif format == 'TIFF':
+            strip_rows = max(TIFF_STRIP_BYTES // (width * 4), 1)
+            size = TIFF_OVERHEAD + 8 * -(-height // strip_rows) + width * height * 4
+        elif format == 'JPEG':
+            # The strips are stacked into one image, each on whole MCU rows, so the tables
+            # and markers are only counted once
+            stacked = np.concatenate(self._flattened(samples))
+            overhead = _jpeg_size(np.full((8, 8, 4), 255, dtype=np.uint8), quality)
+            size = overhead + (_jpeg_size(stacked, quality) - overhead) * height / stacked.shape[0]
+        elif format == 'PNG':
+            flat = samples if transparency else self._flattened(samples)
+            size = PNG_OVERHEAD + self._png_data(flat, 4 if transparency else 3, width, height)
+        elif format == 'PDF':
+            jpeg = estimates.get(('JPEG', quality, None))
+            if jpeg is None:
+                jpeg = self._compute(('JPEG', quality, None), width, height, samples, estimates)
+            size = PDF_OVERHEAD + jpeg
+        else:
+            raise ValueError(f"Unsupported format: {format}")
+        size = int(size)
+        estimates[key] = size
+        return size
+
+    def stats(self):
+        return {'version': self._version, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,128 @@
+# This file draws the layer stack from mip tiles when the view is zoomed out.
+# Each visible tile is composited from the layers' mip pyramids and uploaded as its own
+# small texture. Textures stay cached after they scroll out of view, so panning only
+# uploads tiles that were never shown, and a write only re-uploads the tiles above it.
+from collections import OrderedDict
+
+import numpy as np
+from kivy.graphics import Color, InstructionGroup, Rectangle
+from kivy.graphics.texture import Texture
+
+import instrumentation
+from layers import flatten_arrays
+from mipmap import MipPyramid
+
+TEXTURE_CACHE = 256  # Tile textures kept, including ones out of view
+
+
+class TileView:
+    """Mip-level tile textures for a LayerStack, drawn in canvas coordinates"""
+
+    def __init__(self, stack):
+        self.stack = stack
+        self.group = InstructionGroup()
+        self.pos = (0, 0)
+        self.pyramids = {}               # Layer id -> MipPyramid
+        self._textures = OrderedDict()   # (level, row, col) -> Texture, least recently shown first
+        self._shown = {}                 # (level, row, col) -> Rectangle in group
+        self.uploads = 0  # Tile textures uploaded, for tests and benchmarks
+        self.group.add(Color(1, 1, 1, 1))
+
+    @property
+    def max_level(self):
+        return self.pyramid(self.stack.layers[0]).max_level
+
+    def pyramid(self, layer):
+        pyramid = self.pyramids.get(layer.id)
+        if pyramid is None or pyramid.raster is not layer.raster:
+            pyramid = self.pyramids[layer.id] = MipPyramid(layer.raster)
+        return pyramid
+
+    def _render(self, level, row, col):
+        layers = [layer for layer in self.stack.layers if layer.visible]
+        if not layers:
+            tile = self.pyramid(self.stack.layers[0]).tile(level, row, col)
+            return np.zeros_like(tile)
+        tiles = [(self.pyramid(layer).tile(level, row, col), layer.opacity) for layer in layers]
+        if len(tiles) == 1 and tiles[0][1] == 1:
+            return tiles[0][0]
+        height, width = tiles[0][0].shape[:2]
+        readers = [(lambda y, h, tile=tile: tile[y:y + h], opacity) for tile, opacity in tiles]
+        return flatten_arrays(readers, height, width)
+
+    def _upload(self, key):
+        pixels = np.ascontiguousarray(self._render(*key))
+        height, width = pixels.shape[:2]
+        texture = Texture.create(size=(width, height), colorfmt='rgba', bufferfmt='ubyte')
+        texture.flip_vertical()  # Tile rows run top-down like the tile store
+        buffer = pixels.reshape(-1)
+        if not buffer.flags.writeable:
+            buffer = buffer.copy()  # blit_buffer only accepts writable buffers
+        texture.blit_buffer(buffer, colorfmt='rgba', bufferfmt='ubyte')
+        instrumentation.count('texture_upload_bytes', buffer.nbytes)
+        self._textures[key] = texture
+        self.uploads += 1
+        return texture
+
+    def _rect(self, key, texture):
+        """Canvas-space rectangle covered by a tile"""
+        level, row, col = key
+        span = self.stack.layers[0].raster.tile_size << level
+        image_width, image_height = self.stack.width, self.stack.height
+        x, top = col * span, row * span
+        width, height = min(span, image_width - x), min(span, image_height - top)
+        return Rectangle(texture=texture, pos=(self.pos[0] + x, self.pos[1] + image_height - top - height),
+                         size=(width, height))
+
+    def show(self, level, tiles):
+        """Draw exactly the given (row, col) tiles of a level, uploading only ones not cached"""
+        keys = {(level, row, col) for row, col in tiles}
+        for key in list(self._shown):
+            if key not in keys:
+                self.group.remove(self._shown.pop(key))
+        for key in keys:
+            if key in self._shown:
+                continue
+            texture = self._textures.get(key)
+            if texture is None:
+                texture = self._upload(key)
+            self._textures.move_to_end(key)
+            rect = self._shown[key] = self._rect(key, texture)
+            self.group.add(rect)
+        # Evict the least recently shown textures that are out of view
+        for key in list(self._textures):
+            if len(self._textures) <= max(TEXTURE_CACHE, len(self._shown)):
+                break
+            if key not in self._shown:
+                del self._textures[key]
+
+    def invalidate(self, layer, x, y, width, height):
+        """Pixels of a layer changed in an image region: rebuild the mip tiles above it"""
+        for key in self.pyramid(layer).invalidate(x, y, width, height):
+            self._textures.pop(key, None)
+            rect = self._shown.get(key)
+            if rect is not None:
+                rect.texture = self._upload(key)
+
+    def reset(self, pyramids=False):
+        """Drop the composited tiles after a change to the stack; with `pyramids`, the mip levels too"""
+        for rect in self._shown.values():
+            self.group.remove(rect)
+        self._shown.clear()
+        self._textures.clear()
+        if pyramids:
+            self.pyramids.clear()
+        else:
+            ids = {layer.id for layer in self.stack.layers}
+            for layer_id in list(self.pyramids):
+                if layer_id not in ids:
+                    del self.pyramids[layer_id]
+
+    def set_pos(self, pos):
+        if tuple(pos) == self.pos:
+            return
+        self.pos = tuple(pos)
+        for key, rect in self._shown.items():
+            self.group.remove(rect)
+            rect = self._shown[key] = self._rect(key, rect.texture)
+            self.group.add(rect)
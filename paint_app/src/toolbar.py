@@ -85,6 +85,7 @@ class MenuBar(BoxLayout):
         self.add_file_menu()
         self.add_edit_menu()
         self.add_tools_menu()
+        self.add_layers_menu()
         self.add_view_menu()
 
     def add_file_menu(self):
@@ -153,15 +154,41 @@ class MenuBar(BoxLayout):
         tools_button.bind(on_release=self.tools_dropdown.open)
         self.add_widget(tools_button)
 
+    def add_layers_menu(self):
+        layers_button = MenuButton(text='Layers')
+        self.layers_dropdown = self.create_styled_dropdown()
+        layers_button.dropdown = self.layers_dropdown
+
+        def paint_widget():
+            return self.app.root.ids.paint_widget
+
+        def active():
+            return paint_widget().layers.active_index
+
+        layers_items = [
+            ('New Layer', lambda x: paint_widget().add_layer()),
+            ('Delete Layer', lambda x: paint_widget().remove_layer()),
+            ('Move Layer Up', lambda x: paint_widget().move_layer(active(), active() + 1)),
+            ('Move Layer Down', lambda x: paint_widget().move_layer(active(), active() - 1)),
+            ('Select Layer Above', lambda x: paint_widget().set_active_layer(active() + 1)),
+            ('Select Layer Below', lambda x: paint_widget().set_active_layer(active() - 1)),
+            ('Show/Hide Layer', lambda x: paint_widget().set_layer_visible(
+                active(), not paint_widget().active_layer.visible)),
+        ]
+        self.create_dropdown_items(self.layers_dropdown, layers_items)
+        layers_button.bind(on_release=self.layers_dropdown.open)
+        self.add_widget(layers_button)
+
     def add_view_menu(self):
         view_button = MenuButton(text='View')
         self.view_dropdown = self.create_styled_dropdown()
         view_button.dropdown = self.view_dropdown  # Store dropdown reference
         view_items = [
             ('Show Grid', 'meta+G', lambda x: print('Show Grid - Not implemented')),
-            ('Zoom In', 'meta+plus', lambda x: print('Zoom In - Not implemented')),
-            ('Zoom Out', 'meta+minus', lambda x: print('Zoom Out - Not implemented')),
-            ('Actual Size', 'meta+0', lambda x: print('Actual Size - Not implemented')),
+            ('Zoom In', 'meta+plus', lambda x: self.app.root.ids.paint_widget.zoom_in()),
+            ('Zoom Out', 'meta+minus', lambda x: self.app.root.ids.paint_widget.zoom_out()),
+            ('Actual Size', 'meta+0', lambda x: self.app.root.ids.paint_widget.actual_size()),
+            ('Fit to Window', lambda x: self.app.root.ids.paint_widget.fit_to_window()),
             ('Color Picker', 'meta+K', self.app.show_color_picker),
         ]
         self.create_dropdown_items(self.view_dropdown, view_items)
@@ -10,11 +10,14 @@ from modules.erasertool import EraserTool
 from modules.circletool import CircleTool
 from modules.rectangletool import RectangleTool
 from modules.linetool import LineTool
+from fill_region import MAX_TOLERANCE
 
 class ToolManager:
     def __init__(self):
         self.current_tool = Tool.PENCIL
         self.brush_style = BrushStyle.ROUND
+        self.fill_tolerance = 0
+        self.fill_preview = False  # Fill clicks show the region for the tolerance slider before filling
         
     def set_tool(self, tool):
         if isinstance(tool, Tool):
@@ -29,9 +32,11 @@ class ToolManager:
         if self.current_tool == Tool.PENCIL:
             return PencilTool(canvas, color, line_width)
         elif self.current_tool == Tool.BRUSH:
-            return BrushTool(canvas, color, line_width)
+            return BrushTool(canvas, color, line_width, style=self.brush_style)
         elif self.current_tool == Tool.ERASER:
-            return EraserTool(canvas, color, line_width)
+            # Layers over the background are erased to transparent rather than painted white
+            transparent = canvas_widget is not None and canvas_widget.active_layer.raster.background[3] < 255
+            return EraserTool(canvas, color, line_width, transparent=transparent)
         elif self.current_tool == Tool.LINE:
             return LineTool(canvas, color, line_width)
         elif self.current_tool == Tool.RECTANGLE:
@@ -39,7 +44,8 @@ class ToolManager:
         elif self.current_tool == Tool.CIRCLE:
             return CircleTool(canvas, color, line_width)
         elif self.current_tool == Tool.FILL:
-            tool = FillTool(canvas, color, line_width, canvas_widget=canvas_widget)
+            tool = FillTool(canvas, color, line_width, tolerance=self.fill_tolerance,
+                            canvas_widget=canvas_widget, preview=self.fill_preview)
             tool.activate()  # Activate FillTool upon creation
             return tool
         else:
@@ -47,4 +53,10 @@ class ToolManager:
 
     def set_brush_style(self, style):
         if isinstance(style, BrushStyle):
-            self.brush_style = style
\ No newline at end of file
+            self.brush_style = style
+
+    def set_fill_tolerance(self, tolerance):
+        self.fill_tolerance = min(max(int(tolerance), 0), MAX_TOLERANCE)
+
+    def set_fill_preview(self, preview):
+        self.fill_preview = bool(preview)
@@ -0,0 +1,80 @@
+# This file defines the zoom and pan transform between the canvas widget and the image.
+# The viewport maps image coordinates (origin at the bottom-left, one unit per pixel) to
+# widget-local coordinates, picks the mip level to draw at and works out which tiles the
+# view covers, so only those are uploaded and drawn. Nothing here imports Kivy.
+import math
+
+MIN_SCALE = 1 / 64
+MAX_SCALE = 32
+ZOOM_STEP = 1.25  # Scale change per zoom in/out step or scroll wheel notch
+PAN_STEP = 40     # Widget pixels panned per sideways scroll notch
+
+
+class Viewport:
+    """Scale and offset of the image inside the canvas widget"""
+
+    def __init__(self, scale=1.0, offset=(0.0, 0.0)):
+        self.scale = scale
+        self.offset = tuple(offset)  # Widget-local position of the image's bottom-left corner
+
+    @property
+    def is_identity(self):
+        return self.scale == 1 and self.offset == (0, 0)
+
+    def reset(self):
+        self.scale = 1.0
+        self.offset = (0.0, 0.0)
+
+    def to_image(self, x, y):
+        """Widget-local point to image coordinates"""
+        return (x - self.offset[0]) / self.scale, (y - self.offset[1]) / self.scale
+
+    def to_widget(self, x, y):
+        """Image coordinates to a widget-local point"""
+        return x * self.scale + self.offset[0], y * self.scale + self.offset[1]
+
+    def zoom_about(self, factor, x, y):
+        """Multiply the scale by `factor`, keeping the image point under widget-local (x, y) still"""
+        scale = min(max(self.scale * factor, MIN_SCALE), MAX_SCALE)
+        ratio = scale / self.scale
+        self.offset = (x - (x - self.offset[0]) * ratio, y - (y - self.offset[1]) * ratio)
+        self.scale = scale
+
+    def pan(self, dx, dy):
+        self.offset = (self.offset[0] + dx, self.offset[1] + dy)
+
+    def fit(self, image_width, image_height, view_width, view_height):
+        """Show the whole image centred in the view, never enlarging it past actual size"""
+        self.scale = max(min(1.0, view_width / image_width, view_height / image_height), MIN_SCALE)
+        self.offset = ((view_width - image_width * self.scale) / 2,
+                       (view_height - image_height * self.scale) / 2)
+
+    def level(self, max_level):
+        """Mip level to draw at: the smallest image whose pixels are still no smaller than screen pixels"""
+        if self.scale >= 1:
+            return 0
+        return min(int(math.floor(-math.log2(self.scale) + 1e-9)), max_level)
+
+    def visible_region(self, image_width, image_height, view_width, view_height):
+        """(left, top, right, bottom) of the image pixels in view, rows from the image top, or None"""
+        x0, y0 = self.to_image(0, 0)
+        x1, y1 = self.to_image(view_width, view_height)
+        left, right = max(x0, 0), min(x1, image_width)
+        top, bottom = max(image_height - y1, 0), min(image_height - y0, image_height)
+        if right <= left or bottom <= top:
+            return None
+        return left, top, right, bottom
+
+    def visible_tiles(self, image_width, image_height, view_width, view_height, tile_size, level=0):
+        """(row, col) of the level's tiles that intersect the view; rows count from the image top.
+
+        A tile at `level` covers tile_size * 2**level image pixels each way.
+        """
+        span = tile_size << level
+        region = self.visible_region(image_width, image_height, view_width, view_height)
+        if region is None:
+            return []
+        left, top, right, bottom = region
+        cols = range(int(left // span), int(math.ceil(right / span)))
+        rows = range(int(top // span), int(math.ceil(bottom / span)))
+        return [(row, col) for row in rows for col in cols]
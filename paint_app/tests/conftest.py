@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The application modules import each other relative to src/, as when running src/main.py
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+from PIL import Image
+
+import batch
+from document import Document
+from file_utils import ExportSettings
+from layers import LayerStack
+from project_file import ProjectFile
+
+
+def _image(path, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (30, 40, 4), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+
+def test_find_inputs_expands_directories_and_globs(tmp_path):
+    for name in ('a.png', 'b.jpg', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'c.tif').write_bytes(b'')
+    found = batch.find_inputs([str(tmp_path), str(tmp_path / '**' / '*.tif'), str(tmp_path / 'a.png')])
+    assert [os.path.relpath(path, tmp_path) for path in found] == ['a.png', 'b.jpg', os.path.join('sub', 'c.tif')]
+
+
+def test_run_converts_files_and_reports_failures(tmp_path):
+    _image(tmp_path / 'one.png')
+    flattened = batch.read_pixels(str(tmp_path / 'one.png'))  # Opened on white, as the canvas shows it
+    stack = LayerStack(40, 30)
+    stack.layers[0].raster.write_region(0, 0, flattened)
+    ProjectFile(str(tmp_path / 'two.paintproj')).save(stack, Document(40, 30))
+    (tmp_path / 'broken.png').write_bytes(b'not an image')
+
+    out = tmp_path / 'out'
+    out.mkdir()
+    settings = ExportSettings(format='TIFF', dpi=150)
+    paths = batch.find_inputs([str(tmp_path / '*')])
+    results = {os.path.basename(r['input']): r for r in batch.run(paths, settings, str(out), jobs=1)}
+    assert results['broken.png']['error'].startswith('UnidentifiedImageError')
+    for name in ('one', 'two'):
+        assert results[name + ('.png' if name == 'one' else '.paintproj')]['pixels'] == 1200
+        with Image.open(out / (name + '.tiff')) as saved:
+            assert np.array_equal(np.asarray(saved), flattened)
+            assert saved.info['dpi'] == (150, 150)
+
+    # Existing outputs are left alone unless asked to overwrite them
+    again = list(batch.run([str(tmp_path / 'one.png')], settings, str(out), jobs=1))
+    assert again[0]['skipped']
+    assert not list(batch.run([str(tmp_path / 'one.png')], settings, str(out), jobs=1, overwrite=True))[0]['skipped']
+
+
+def test_batch_runs_without_kivy_or_appkit():
+    src = os.path.dirname(batch.__file__)
+    code = ("import sys, batch; "
+            "print(sorted({m.split('.')[0] for m in sys.modules} & {'kivy', 'AppKit', 'Foundation', 'objc'}))")
+    output = subprocess.run([sys.executable, '-c', code], cwd=src, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == '[]'
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+import scipy.ndimage
+
+from modules.bucketfill import FillTool, find_fill_spans
+from document import Document, RecordKind
+from history import UndoHistory
+from raster_store import TileStore
+
+
+def label_region(pixel_data, x, y, tolerance):
+    """Reference fill region using 4-connected labelling of the tolerance mask"""
+    target = pixel_data[y, x, :3].astype(int)
+    mask = np.all(np.abs(pixel_data[:, :, :3].astype(int) - target) <= tolerance, axis=2)
+    labeled, _ = scipy.ndimage.label(mask, structure=[[0, 1, 0], [1, 1, 1], [0, 1, 0]])
+    return labeled == labeled[y, x]
+
+
+def spans_to_mask(spans, shape):
+    mask = np.zeros(shape[:2], dtype=bool)
+    for row, start, end in spans:
+        mask[row, start:end] = True
+    return mask
+
+
+@pytest.mark.parametrize('tolerance', [0, 40])
+def test_matches_label_based_fill(tolerance):
+    rng = np.random.default_rng(1)
+    pixel_data = rng.choice([0, 30, 200, 255], size=(120, 90, 4)).astype(np.uint8)
+    for y, x in [(0, 0), (60, 45), (119, 89)]:
+        spans = find_fill_spans(pixel_data, x, y, pixel_data[y, x, :3], tolerance)
+        expected = label_region(pixel_data, x, y, tolerance)
+        assert np.array_equal(spans_to_mask(spans, pixel_data.shape), expected)
+
+
+def test_fill_stays_inside_outline():
+    pixel_data = np.full((50, 50, 4), 255, dtype=np.uint8)
+    pixel_data[10, 10:21, :3] = 0
+    pixel_data[20, 10:21, :3] = 0
+    pixel_data[10:21, 10, :3] = 0
+    pixel_data[10:21, 20, :3] = 0
+    spans = find_fill_spans(pixel_data, 15, 15, pixel_data[15, 15, :3])
+    assert spans_to_mask(spans, pixel_data.shape).sum() == 81
+    assert all(11 <= row <= 19 and start == 11 and end == 20 for row, start, end in spans)
+
+
+class CanvasStub:
+    """Just enough of PaintWidget for FillTool to run against a tile store"""
+
+    def __init__(self, pixels):
+        self.raster = TileStore(pixels.shape[1], pixels.shape[0])
+        self.raster.load_array(pixels)
+        self.history = UndoHistory()
+        self.undo_stack = self.history.undo_stack
+        self.document = Document(pixels.shape[1], pixels.shape[0])
+        self.active_layer = None
+
+    def push_command(self, command, record=None):
+        if record is not None:
+            self.document.add(record)
+        self.history.push(command)
+
+    def get_pixel_snapshot(self):
+        return self.raster.to_array()
+
+    def write_pixels(self, x, y, data, layer=None):
+        self.raster.write_region(x, y, data)
+
+
+def test_small_fill_undo_record_is_small():
+    # A 20x20 hole on a 4K canvas, where a full-image copy would be 33 MB per state
+    pixels = np.full((2160, 3840, 4), 255, dtype=np.uint8)
+    pixels[1000, 1000:1022, :3] = 0
+    pixels[1021, 1000:1022, :3] = 0
+    pixels[1000:1022, 1000, :3] = 0
+    pixels[1000:1022, 1021, :3] = 0
+    canvas = CanvasStub(pixels)
+    tool = FillTool(None, [1, 0, 0, 1], 2, canvas_widget=canvas)
+    tool.activate()
+    tool.fill(1010, 1010)
+
+    command, = canvas.undo_stack
+    record, = canvas.document.records
+    assert record.kind == RecordKind.FILL and (record.x, record.y) == (1010, 1149)
+    assert command.delta.region == (1001, 1001, 20, 20)
+    assert command.nbytes < 512
+    assert (canvas.raster.read_region(1001, 1001, 20, 20)[..., :3] == [255, 0, 0]).all()
+    command.undo(None)
+    assert np.array_equal(canvas.raster.to_array(), pixels)
+    command.redo(None)
+    assert (canvas.raster.read_region(1001, 1001, 20, 20)[..., :3] == [255, 0, 0]).all()
+
+
+def test_preview_follows_tolerance_then_fills_it():
+    # A gray ramp: each column is 10 levels darker than the one to its left
+    pixels = np.full((20, 30, 4), 255, dtype=np.uint8)
+    pixels[:, :, :3] = (255 - 10 * (np.arange(30) // 3))[None, :, None]
+    canvas = CanvasStub(pixels)
+    previews = []
+    canvas.show_fill_preview = previews.append
+    tool = FillTool(None, [1, 0, 0, 1], 2, canvas_widget=canvas, preview=True)
+    tool.activate()
+    tool.start_preview(0, 5)
+    assert previews == [tool] and not canvas.undo_stack
+
+    for tolerance, columns in [(0, 3), (25, 9), (10, 6), (25, 9)]:
+        tool.set_tolerance(tolerance)
+        (left, top, right, bottom), mask = tool.preview_region()
+        assert (left, top, right, bottom) == (0, 0, columns, 20) and mask.all()
+
+    tool.commit_preview()
+    command, = canvas.undo_stack
+    record, = canvas.document.records
+    assert record.tolerance == 25 and command.delta.region == (0, 0, 9, 20)
+    assert (canvas.raster.read_region(0, 0, 9, 20)[..., :3] == [255, 0, 0]).all()
+    assert np.array_equal(canvas.raster.read_region(9, 0, 21, 20), pixels[:, 9:])
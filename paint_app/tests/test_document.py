@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+
+import zlib
+
+import numpy as np
+
+from document import Document, RecordKind
+from project_file import encode_records
+
+
+def test_palette_interns_colors_and_widths():
+    document = Document(100, 100)
+    first = document.stroke(RecordKind.PENCIL, [(0, 0), (10, 10)], (1, 0, 0, 1), 2)
+    second = document.stroke(RecordKind.PENCIL, [(5, 5), (20, 20)], [1, 0, 0, 1], 2)
+    assert (first.color, first.width) == (second.color, second.width) == (0, 0)
+    assert first.points.dtype == np.float32 and first.points.shape == (2, 2)
+    assert document.colors == [(1.0, 0.0, 0.0, 1.0)]
+
+
+def test_records_use_slots_and_packed_points():
+    document = Document(100, 100)
+    stroke = document.stroke(RecordKind.PENCIL, np.zeros((400, 2)), (0, 0, 0, 1), 2)
+    assert not hasattr(stroke, '__dict__')
+    assert stroke.nbytes == 400 * 2 * 4
+
+
+def test_render_replays_records_in_order():
+    document = Document(100, 100)
+    document.add(document.shape(RecordKind.RECTANGLE, (10, 10, 80, 80), (0, 0, 0, 1), 2))
+    document.add(document.fill(50, 50, (0, 0, 1, 1)))
+    fill = document.records[-1]
+    pixels = document.render()
+    assert tuple(pixels[50, 50]) == (0, 0, 255, 255)
+
+    document.remove(fill)
+    assert tuple(document.render()[50, 50]) == (255, 255, 255, 255)
+
+
+def test_resize_keeps_records_anchored_to_top_left():
+    document = Document(100, 100)
+    document.add(document.stroke(RecordKind.PENCIL, [(10, 90), (50, 90)], (0, 0, 0, 1), 2))
+    before = document.render()
+    document.resize(100, 150)
+    after = document.render()
+    assert np.array_equal(after[:100], before)
+
+
+def test_record_chunks_follow_appends_undo_and_resize():
+    document = Document(100, 100)
+
+    def expected():
+        runs = [encode_records(document.records[start:start + 4]) for start in range(0, len(document.records), 4)]
+        return [(zlib.crc32(run), len(run)) for run in runs]
+
+    for i in range(6):
+        document.add(document.stroke(RecordKind.PENCIL, [(i, i), (i + 5, 9)], (0, 0, 0, 1), 2))
+    assert document.record_chunks(4) == expected()
+    for i in range(3):
+        document.add(document.shape(RecordKind.LINE, (0, i, 10, 10), (1, 0, 0, 1), 3))
+        assert document.record_chunks(4) == expected()
+    document.remove(document.records[2])
+    assert document.record_chunks(4) == expected()
+    document.remove(document.records[-1])
+    document.resize(100, 120)
+    copy = document.copy()
+    assert copy.record_chunks(4) == document.record_chunks(4) == expected()
+
+
+def test_copy_keeps_its_records_when_the_original_changes():
+    document = Document(100, 100)
+    document.add(document.stroke(RecordKind.PENCIL, [(1, 2), (3, 4)], (0, 0, 0, 1), 2))
+    document.add(document.shape(RecordKind.RECTANGLE, (10, 10, 5, 5), (1, 0, 0, 1), 3))
+    document.add(document.fill(50, 50, (0, 1, 0, 1)))
+    copy = document.copy()
+    document.resize(100, 150)
+    assert copy.records[0].points.tolist() == [[1, 2], [3, 4]]
+    assert copy.records[1].geometry.tolist() == [10, 10, 5, 5]
+    assert (copy.records[2].x, copy.records[2].y) == (50, 50)
+
+
+def test_document_does_not_import_kivy():
+    src = os.path.join(os.path.dirname(__file__), '..', 'src')
+    code = ("import sys, document; d = document.Document(10, 10); d.render(); "
+            "print('kivy' in sys.modules)")
+    out = subprocess.run([sys.executable, '-c', code], cwd=src, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == 'False'
@@ -0,0 +1,63 @@
+import numpy as np
+from PIL import Image
+
+from file_utils import ExportSettings, FileManager, flatten_on_white, wrap_pixels
+
+
+class Canvas:
+    """Stands in for the paint widget: export only needs its flattened pixels"""
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+
+    def get_pixels(self):
+        return self.pixels.copy()
+
+
+def _pixels():
+    pixels = np.zeros((40, 60, 4), dtype=np.uint8)
+    pixels[..., 0] = 200
+    pixels[..., 3] = 255
+    pixels[:10, :, 3] = 0       # Transparent band
+    pixels[10:20, :, 3] = 128   # Half transparent band
+    return pixels
+
+
+def test_flatten_on_white_matches_paste():
+    pixels = _pixels()
+    image = Image.fromarray(pixels)
+    expected = Image.new('RGB', image.size, (255, 255, 255))
+    expected.paste(image, mask=image.split()[3])
+    flat = flatten_on_white(pixels.copy())
+    assert (flat[..., 3] == 255).all()
+    assert np.abs(flat[..., :3].astype(int) - np.asarray(expected)).max() <= 1
+
+
+def test_wrap_pixels_shares_memory():
+    pixels = _pixels()
+    image = wrap_pixels(pixels)
+    pixels[0, 0] = (1, 2, 3, 4)
+    assert image.getpixel((0, 0)) == (1, 2, 3, 4)
+    assert wrap_pixels(pixels, 'RGBX').getpixel((0, 0))[:3] == (1, 2, 3)
+
+
+def test_export_formats(tmp_path):
+    canvas = Canvas(_pixels())
+    for format, mode in (('PNG', 'RGBA'), ('JPEG', 'RGB'), ('BMP', 'RGB'), ('TIFF', 'RGBA'), ('PDF', None)):
+        settings = ExportSettings(format=format)
+        assert FileManager.export_canvas(canvas, str(tmp_path / 'out'), settings)
+        if mode is None:
+            continue
+        with Image.open(tmp_path / ('out' + {'JPEG': '.jpg', 'TIFF': '.tiff'}.get(format, '.' + format.lower()))) as saved:
+            assert saved.mode == mode and saved.size == (60, 40)
+            if format in ('PNG', 'BMP', 'TIFF'):
+                expected = canvas.pixels if mode == 'RGBA' else flatten_on_white(canvas.pixels.copy())[..., :3]
+                assert np.array_equal(np.asarray(saved), expected)
+
+
+def test_save_canvas_flattens_jpeg(tmp_path):
+    canvas = Canvas(_pixels())
+    assert FileManager.save_canvas_as_image(canvas, str(tmp_path / 'out.jpg'), 'JPEG')
+    with Image.open(tmp_path / 'out.jpg') as saved:
+        top = np.asarray(saved)[:4].astype(int)
+    assert np.abs(top - 255).max() <= 8  # The transparent band comes out white
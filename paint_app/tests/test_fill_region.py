@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+import scipy.ndimage
+
+from fill_region import FillRegion, level_map
+from rasterizer import color_distance
+
+
+def label_region(pixel_data, x, y, tolerance):
+    """Reference fill region using 4-connected labelling of the tolerance mask"""
+    target = pixel_data[y, x, :3].astype(int)
+    mask = np.all(np.abs(pixel_data[:, :, :3].astype(int) - target) <= tolerance, axis=2)
+    labeled, _ = scipy.ndimage.label(mask)
+    return labeled == labeled[y, x]
+
+
+def region_mask(found, shape):
+    (left, top, right, bottom), mask = found
+    full = np.zeros(shape[:2], dtype=bool)
+    full[top:bottom, left:right] = mask
+    return full
+
+
+def drawing(rng):
+    """Flat boxes of a few colors, as strokes and fills leave a canvas"""
+    pixels = np.full((90, 120, 4), 255, dtype=np.uint8)
+    for _ in range(25):
+        x, y = rng.integers(0, 120), rng.integers(0, 90)
+        pixels[y:y + rng.integers(3, 30), x:x + rng.integers(3, 40), :3] = rng.choice([0, 60, 120, 200], 3)
+    return pixels
+
+
+def test_color_distance_is_the_largest_channel_difference():
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(40, 30, 4), dtype=np.uint8)
+    distance = color_distance(pixels, (10, 250, 128))
+    expected = np.abs(pixels[..., :3].astype(int) - [10, 250, 128]).max(axis=2)
+    assert distance.dtype == np.uint8
+    assert np.array_equal(distance, expected)
+
+
+@pytest.mark.parametrize('max_runs', [1 << 17, 0])  # The level map, and labelling when it has too many runs
+@pytest.mark.parametrize('order', ['up', 'down', 'shuffled'])
+def test_matches_label_based_fill_for_any_slider_order(max_runs, order, monkeypatch):
+    monkeypatch.setattr('fill_region.MAX_RUNS', max_runs)
+    rng = np.random.default_rng(2)
+    pixels = drawing(rng)
+    tolerances = [0, 10, 60, 61, 100, 140, 255]
+    if order == 'down':
+        tolerances.reverse()
+    elif order == 'shuffled':
+        rng.shuffle(tolerances)
+    region = FillRegion(pixels, 50, 40)
+    for tolerance in tolerances + tolerances:
+        found = region.region(tolerance)
+        assert not found[1].flags.writeable
+        assert np.array_equal(region_mask(found, pixels.shape), label_region(pixels, 50, 40, tolerance))
+    assert (region.levels is not None) == bool(max_runs)
+
+
+def test_photo_regions_reuse_neighbouring_tolerances(monkeypatch):
+    monkeypatch.setattr('fill_region.MAX_RUNS', 0)  # Too many runs, as on a full-size photo
+    rng = np.random.default_rng(3)
+    pixels = rng.integers(100, 140, size=(60, 80, 4), dtype=np.uint8)
+    region = FillRegion(pixels, 40, 30)
+    region.region(0)
+    for tolerance in range(30, 50):
+        assert np.array_equal(region_mask(region.region(tolerance), pixels.shape),
+                              label_region(pixels, 40, 30, tolerance))
+    # Every pixel is within 39 of the seed, so the region stops growing and is reused
+    assert region.labelled < 12
+
+
+def test_level_map_gives_the_lowest_reaching_tolerance():
+    distance = np.array([[0, 5, 9],
+                         [200, 200, 3],
+                         [7, 1, 2]], dtype=np.uint8)
+    levels, boxes = level_map(distance, 0, 0)
+    assert levels.tolist() == [[0, 5, 9],
+                               [200, 200, 9],
+                               [9, 9, 9]]
+    assert boxes[0].tolist() == [0, 0, 1, 1]
+    assert boxes[9].tolist() == [0, 0, 3, 3]
+    assert level_map(distance, 0, 0, max_runs=4) == (None, None)
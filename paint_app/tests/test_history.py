@@ -0,0 +1,96 @@
+import numpy as np
+
+from history import UndoHistory
+from raster_store import RegionDelta, TileStore
+
+
+class DeltaCommand:
+    """Minimal raster command in the style of FillCommand"""
+
+    def __init__(self, delta):
+        self.delta = delta
+
+    @property
+    def nbytes(self):
+        return self.delta.nbytes
+
+    @property
+    def spilled_nbytes(self):
+        return self.delta.spilled_nbytes
+
+    def spill(self, store):
+        self.delta.spill(store)
+
+
+class LightCommand:
+    nbytes = 100
+
+
+def noisy_delta(seed, size=256):
+    # Random pixels do not compress, so each delta holds about 2 * size * size * 4 bytes
+    rng = np.random.default_rng(seed)
+    old = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    new = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    return RegionDelta((0, 0, size, size), old, new)
+
+
+def test_heavy_commands_spill_to_disk_and_read_back():
+    history = UndoHistory(memory_budget=1024 * 1024, spill_threshold=64 * 1024)
+    deltas = [noisy_delta(seed) for seed in range(4)]
+    expected = [delta.old_pixels.copy() for delta in deltas]
+    for delta in deltas:
+        history.push(DeltaCommand(delta))
+
+    assert len(history.undo_stack) == 4
+    assert history.memory_bytes <= history.memory_budget
+    assert history.spilled_bytes > 0
+    assert history.undo_stack[-1].spilled_nbytes == 0
+
+    store = TileStore(256, 256)
+
+    class Target:
+        def write_pixels(self, x, y, data):
+            store.write_region(x, y, data)
+
+    for command, pixels in zip(history.undo_stack, expected):
+        command.delta.revert(Target())
+        assert np.array_equal(store.to_array(), pixels)
+
+
+def test_light_commands_keep_deep_history():
+    history = UndoHistory(memory_budget=10_000, max_commands=500)
+    for _ in range(90):
+        history.push(LightCommand())
+    assert len(history.undo_stack) == 90
+    for _ in range(50):
+        history.push(LightCommand())
+    assert history.memory_bytes <= history.memory_budget
+    assert len(history.undo_stack) == 100
+
+
+def test_push_clears_redo():
+    history = UndoHistory()
+    history.push(LightCommand())
+    history.redo_stack.append(history.undo_stack.pop())
+    history.push(LightCommand())
+    assert not history.redo_stack
+    assert history.stats()['commands'] == 1
+
+
+def test_spill_file_stays_bounded_as_commands_are_dropped():
+    history = UndoHistory(memory_budget=1024 * 1024, spill_threshold=64 * 1024, max_commands=6)
+    sizes = []
+    for seed in range(60):
+        history.push(DeltaCommand(noisy_delta(seed)))
+        if seed % 5 == 4:
+            # Undo a couple of commands so the next push drops them with the redo history
+            history.redo_stack.extend([history.undo_stack.pop(), history.undo_stack.pop()])
+        sizes.append((history.spilled_bytes, history.spill_store.size))
+
+    peak = max(spilled for spilled, _ in sizes)
+    assert peak < 8 * noisy_delta(0).nbytes  # At most max_commands deltas, less the resident one
+    assert max(size for _, size in sizes) <= 2 * peak
+    # Dropping every command frees the whole file
+    history.undo_stack.clear()
+    history.redo_stack.clear()
+    assert history.spilled_bytes == history.spill_store.size == 0
@@ -0,0 +1,122 @@
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_loader import ImageLoadJob, decode_image, decode_preview, decode_tiles, load_tiles
+
+
+def _save(tmp_path, name, width, height, mode='RGB', **params):
+    path = tmp_path / name
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (height, width, len(mode)), dtype=np.uint8)
+    Image.fromarray(pixels, mode).save(path, **params)
+    return path
+
+
+def test_decode_flattens_alpha_on_white(tmp_path):
+    path = tmp_path / 'clear.png'
+    Image.new('RGBA', (4, 3), (255, 0, 0, 0)).save(path)
+    pixels = decode_image(path)
+    assert pixels.shape == (3, 4, 4)
+    assert (pixels == 255).all()
+
+
+def test_preview_is_reduced(tmp_path):
+    for name in ('big.jpg', 'big.png'):
+        path = _save(tmp_path, name, 3000, 1000)
+        preview, size = decode_preview(path, max_size=500)
+        assert size == (3000, 1000)
+        assert max(preview.shape[:2]) <= 750
+        assert max(preview.shape[:2]) >= 375
+
+
+def test_strip_decode_matches_whole_decode(tmp_path):
+    rng = np.random.default_rng(1)
+    # Coarse values so PNG rows use a mix of filter types
+    pixels = rng.integers(0, 4, (100, 70, 4), dtype=np.uint8) * 85
+    image = Image.fromarray(pixels, 'RGBA')
+    cases = [('a.png', image, {}), ('p.png', image.convert('RGB').convert('P'), {'transparency': 0}),
+             ('raw.tif', image, {}), ('lzw.tif', image.convert('RGB'), {'compression': 'tiff_lzw'}),
+             ('deflate.tif', image.convert('L'), {'compression': 'tiff_deflate', 'tiffinfo': {278: 7}}),
+             ('a.gif', image.convert('P'), {})]
+    for name, source, params in cases:
+        path = tmp_path / name
+        source.save(path, **params)
+        raster = decode_tiles(path, tile_size=16)
+        assert np.array_equal(raster.to_array(), decode_image(path)), name
+
+
+def test_load_tiles_keeps_pixels_in_a_scratch_file(tmp_path):
+    path = _save(tmp_path, 'big.png', 300, 200)
+    strips = []
+    raster, pixels = load_tiles(path, tile_size=64, on_strip=lambda y, strip: strips.append((y, len(strip))))
+    assert strips == [(0, 64), (64, 64), (128, 64), (192, 8)]
+    assert isinstance(pixels, np.memmap)
+    assert np.array_equal(pixels, raster.to_array())
+
+
+def _run(job):
+    job.start()
+    job.thread.join(10)
+    assert not job.thread.is_alive()
+
+
+def test_job_delivers_preview_then_full_image(tmp_path):
+    path = _save(tmp_path, 'big.png', 1200, 800)
+    events = []
+    job = ImageLoadJob(path, on_preview=lambda pixels, size: events.append(('preview', pixels.shape, size)),
+                       on_done=lambda raster, pixels: events.append(('done', raster.shape, pixels.shape)),
+                       preview_size=300)
+    _run(job)
+    # The preview is built up from the strips as they are decoded
+    assert events[0] == ('preview', (200, 300, 4), (1200, 800))
+    assert events[-1] == ('done', (800, 1200, 4), (800, 1200, 4))
+
+
+def test_small_image_skips_preview(tmp_path):
+    path = _save(tmp_path, 'small.png', 100, 50)
+    events = []
+    job = ImageLoadJob(path, on_preview=lambda *args: events.append('preview'),
+                       on_done=lambda raster, pixels: events.append(raster.shape))
+    _run(job)
+    assert events == [(50, 100, 4)]
+
+
+def test_cancelled_job_makes_no_callbacks(tmp_path):
+    path = _save(tmp_path, 'big.png', 1200, 800)
+    events = []
+    gate = threading.Event()
+
+    def on_preview(pixels, size):
+        events.append('preview')
+        gate.wait(5)
+
+    job = ImageLoadJob(path, on_preview=on_preview, on_done=lambda *result: events.append('done'),
+                       on_error=lambda e: events.append('error'), preview_size=300)
+    job.start()
+    job.cancel()
+    gate.set()
+    job.thread.join(10)
+    assert 'done' not in events and 'error' not in events
+
+
+def test_errors_are_reported(tmp_path):
+    path = tmp_path / 'broken.png'
+    path.write_bytes(b'not an image')
+    errors = []
+    job = ImageLoadJob(path, on_preview=lambda *args: None, on_done=lambda *result: None,
+                       on_error=errors.append)
+    _run(job)
+    assert len(errors) == 1
+
+
+def test_pixel_limit_does_not_touch_pillows(tmp_path, monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 100)
+    monkeypatch.setattr('image_loader.MAX_IMAGE_PIXELS', 1000)
+    # Over twice Pillow's limit, which Image.open() alone would reject
+    assert decode_image(_save(tmp_path, 'fits.png', 20, 20)).shape == (20, 20, 4)
+    with pytest.raises(Image.DecompressionBombError):
+        decode_tiles(_save(tmp_path, 'bomb.png', 40, 40))
+    assert Image.MAX_IMAGE_PIXELS == 100
@@ -0,0 +1,99 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from image_writer import ExportJob, ProgressFile, replace_file
+
+
+def _pixels(height=150, width=70):
+    rng = np.random.default_rng(0)
+    # Coarse values so rows pick a mix of filter types
+    pixels = rng.integers(0, 4, (height, width, 4), dtype=np.uint8) * 85
+    pixels[:20, :, 3] = 0
+    return pixels
+
+
+def _save_png(fp, progress, expected):
+    """Write _pixels() through a ProgressFile with Pillow, as file_utils does"""
+    fp = ProgressFile(fp, expected, progress)
+    Image.fromarray(_pixels(600, 400)).save(fp, 'PNG')
+    fp.finish()
+
+
+def test_progress_follows_the_encoded_blocks(tmp_path):
+    size = len(_encoded())
+    fractions = []
+    with open(tmp_path / 'a.png', 'wb') as fp:
+        _save_png(fp, fractions.append, size)
+    # Pillow writes the image data a block at a time, through write() rather than the descriptor
+    assert len(fractions) > 3 and fractions == sorted(fractions) and fractions[-1] == 1.0
+    with Image.open(tmp_path / 'a.png') as saved:
+        assert np.array_equal(np.asarray(saved), _pixels(600, 400))
+
+
+def _encoded():
+    buffer = io.BytesIO()
+    Image.fromarray(_pixels(600, 400)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_progress_stops_short_until_finished():
+    fractions = []
+    fp = ProgressFile(io.BytesIO(), 1000, fractions.append)
+    for _ in range(30):
+        fp.write(b'x' * 100)
+    assert fractions == sorted(fractions) and fractions[-1] == 0.99
+    assert len(fractions) == len(set(fractions))
+    fp.finish()
+    assert fractions[-1] == 1.0
+    assert fp.tell() == 3000
+
+
+def _write(path):
+    def export(progress):
+        with open(path, 'wb') as fp:
+            _save_png(fp, progress, 20000)
+        return path
+    return export
+
+
+def test_export_job_reports_progress_and_result(tmp_path):
+    done = threading.Event()
+    fractions, results = [], []
+    job = ExportJob(_write(tmp_path / 'out.png'), on_progress=fractions.append,
+                    on_done=lambda result: (results.append(result), done.set()))
+    job.start()
+    assert done.wait(10)
+    assert fractions[-1] == 1.0 and results == [tmp_path / 'out.png']
+
+
+def test_export_job_cancel_leaves_no_file(tmp_path):
+    finished = threading.Event()
+    calls = []
+
+    def export(progress):
+        try:
+            with replace_file(str(tmp_path / 'out.png')) as fp:
+                _save_png(fp, progress, 20000)
+        finally:
+            finished.set()
+
+    job = ExportJob(export, on_progress=lambda fraction: job.cancel(),
+                    on_done=calls.append, on_error=calls.append)
+    job.start()
+    assert finished.wait(10)
+    job.thread.join(10)
+    assert calls == []
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_export_job_reports_errors(tmp_path):
+    done = threading.Event()
+    errors = []
+    job = ExportJob(_write(tmp_path / 'missing' / 'out.png'),
+                    on_error=lambda error: (errors.append(error), done.set()))
+    job.start()
+    assert done.wait(10)
+    assert isinstance(errors[0], OSError)
@@ -0,0 +1,108 @@
+from enum import Enum
+
+from input_recording import DOWN, MOVE, UP, InputRecorder, ReplayTouch, load_session, replay
+
+
+class Tool(Enum):
+    PENCIL = 1
+    FILL = 2
+
+
+class Style(Enum):
+    ROUND = 1
+
+
+class ToolManager:
+    def __init__(self):
+        self.current_tool = Tool.PENCIL
+        self.brush_style = Style.ROUND
+
+    def set_brush_style(self, style):
+        self.brush_style = style
+
+
+class WidgetStub:
+    """Just enough of PaintWidget to record and replay touches"""
+
+    def __init__(self, pos=(0, 0)):
+        self.x, self.y = pos
+        self.width, self.height = 400, 300
+        self.tool_manager = ToolManager()
+        self.current_color = [0, 0, 0, 1]
+        self.line_width = 2
+        self.calls = []
+        self.instructions = 5
+
+    @property
+    def layers(self):
+        return self
+
+    def set_tool(self, tool):
+        self.calls.append(('tool', tool))
+        self.tool_manager.current_tool = tool
+
+    def set_color(self, color):
+        self.current_color = color
+
+    def set_line_width(self, width):
+        self.line_width = width
+
+    def instruction_count(self):
+        return self.instructions
+
+    def on_touch_down(self, touch):
+        self.calls.append((DOWN, touch.pos, self.tool_manager.current_tool, tuple(self.current_color)))
+        self.instructions += 2
+
+    def on_touch_move(self, touch):
+        self.calls.append((MOVE, touch.pos, (touch.dx, touch.dy)))
+
+    def on_touch_up(self, touch):
+        self.calls.append((UP, touch.pos))
+        self.instructions -= 1
+
+
+def test_recorded_session_replays_the_same_touches(tmp_path):
+    recorder = InputRecorder()
+    source = WidgetStub(pos=(100, 50))
+    touch = ReplayTouch(7, 110, 60)
+    recorder.record(DOWN, touch, source)
+    touch.move(130, 90)
+    recorder.record(MOVE, touch, source)
+    recorder.record(UP, touch, source)
+    source.tool_manager.current_tool = Tool.FILL
+    source.current_color = [1, 0, 0, 1]
+    recorder.record(DOWN, ReplayTouch(8, 300, 200), source)
+    recorder.record(UP, ReplayTouch(8, 300, 200), source)
+    path = str(tmp_path / 'session.jsonl')
+    recorder.save(path, source)
+
+    header, events = load_session(path)
+    assert header['events'] == 5 and header['size'] == [400, 300]
+    target = WidgetStub()
+    report = replay(target, events)
+    assert target.calls == [
+        (DOWN, (10, 10), Tool.PENCIL, (0, 0, 0, 1)),
+        (MOVE, (30, 40), (20, 30)),
+        (UP, (30, 40)),
+        ('tool', Tool.FILL),
+        (DOWN, (200, 150), Tool.FILL, (1, 0, 0, 1)),
+        (UP, (200, 150)),
+    ]
+    assert report['events'] == 5
+    assert report['latency_ms'][DOWN]['count'] == 2 and report['latency_ms'][MOVE]['count'] == 1
+    assert report['instructions'] == {'start': 5, 'end': 7, 'peak': 8, 'growth': 2}
+
+
+def test_replay_draws_frames_between_events():
+    source = WidgetStub()
+    recorder = InputRecorder()
+    touch = ReplayTouch(0, 10, 10)
+    recorder.record(DOWN, touch, source)
+    for x in range(11, 20):
+        touch.move(x, 10)
+        recorder.record(MOVE, touch, source)
+    recorder.record(UP, touch, source)
+    frames = []
+    report = replay(WidgetStub(), recorder.events, tick=lambda: frames.append(1), frame_every=4)
+    assert len(frames) == 2 and report['latency_ms']['frame']['count'] == 2
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+import instrumentation
+
+
+@pytest.fixture
+def stats():
+    instrumentation.reset()
+    instrumentation.enable()
+    yield instrumentation
+    instrumentation.disable()
+    instrumentation.reset()
+    instrumentation._probes.pop('test.probe', None)
+
+
+def test_disabled_calls_record_nothing():
+    assert not instrumentation.enabled
+    instrumentation.count('texture_upload_bytes', 100)
+    instrumentation.gauge('canvas.size', 5)
+    with instrumentation.timer('fill') as timer:
+        pass
+    assert timer is instrumentation.timer('export')  # One shared do-nothing context
+    snapshot = instrumentation.snapshot()
+    assert snapshot['counters'] == {} and snapshot['timers'] == {}
+
+
+def test_report_holds_counters_timers_and_probes(stats, tmp_path):
+    stats.count('texture_upload_bytes', 4096)
+    stats.count('texture_upload_bytes', 4096)
+    for seconds in (0.25, 0.75):
+        stats.record_time('export.PNG', seconds)
+    with stats.timer('fill'):
+        pass
+    stats.probe('test.probe', lambda: 42)
+
+    path = tmp_path / 'stats.json'
+    stats.write_report(str(path))
+    report = json.loads(path.read_text())
+    assert report['counters'] == {'texture_upload_bytes': 8192}
+    assert report['timers']['export.PNG'] == {'calls': 2, 'total': 1.0, 'mean': 0.5, 'max': 0.75}
+    assert report['timers']['fill']['calls'] == 1
+    assert report['gauges']['test.probe'] == 42
+    assert 'export.PNG: 2x, mean 500.0 ms, max 750.0 ms' in stats.summary_lines()
@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+
+import journal
+from document import Document, RecordKind
+from layers import LayerStack
+
+
+def _session(width=300, height=200):
+    layers = LayerStack(width, height)
+    return layers, Document(width, height)
+
+
+def _draw(layers, document, record, session):
+    """Commit a record the way the canvas does, then journal it"""
+    record.layer = layers.active.id
+    raster = layers.active.raster
+    pixels = raster.to_array()
+    document.render_record(pixels, record)
+    raster.write_region(0, 0, pixels)
+    document.add(record)
+    session.append(record, document)
+
+
+def _strokes(document, count, seed=0):
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(count):
+        points = rng.uniform((0, 0), (300, 200), (6, 2))
+        records.append(document.stroke(RecordKind.PENCIL, points, tuple(rng.uniform(0, 1, 3)) + (1.0,), 2 + i % 5))
+    return records
+
+
+def test_recover_replays_journaled_records(tmp_path):
+    layers, document = _session()
+    session = journal.Journal(str(tmp_path))
+    session.start(layers, document)
+    for record in _strokes(document, 5) + [document.fill(150, 100, (0, 0.5, 1, 1), 8)]:
+        _draw(layers, document, record, session)
+    session.close(discard_session=False)  # As a crash would leave it, minus the lost tail
+    assert session.error is None and journal.has_session(str(tmp_path))
+
+    recovered, recovered_document, replayed = journal.recover(str(tmp_path))
+    assert replayed == 6
+    assert np.array_equal(recovered.active.raster.to_array(), layers.active.raster.to_array())
+    assert [r.kind for r in recovered_document.records] == [r.kind for r in document.records]
+    assert recovered_document.colors[recovered_document.records[-1].color] == (0, 0.5, 1, 1)
+
+
+def test_recover_without_a_checkpoint_replays_the_whole_journal(tmp_path):
+    layers, document = _session()
+    session = journal.Journal(str(tmp_path))
+    session.start(layers, document)
+    for record in _strokes(document, 3):
+        _draw(layers, document, record, session)
+    session.close(discard_session=False)
+    os.remove(os.path.join(str(tmp_path), journal.CHECKPOINT_NAME))
+    assert journal.has_session(str(tmp_path))
+
+    recovered, recovered_document, replayed = journal.recover(str(tmp_path))
+    assert replayed == 3 and (recovered.width, recovered.height) == (300, 200)
+    assert np.array_equal(recovered.active.raster.to_array(), layers.active.raster.to_array())
+
+
+def test_recover_stops_at_a_torn_entry(tmp_path):
+    layers, document = _session()
+    session = journal.Journal(str(tmp_path))
+    session.start(layers, document)
+    for record in _strokes(document, 3):
+        _draw(layers, document, record, session)
+    session.close(discard_session=False)
+    path = os.path.join(str(tmp_path), journal.JOURNAL_NAME)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 5)
+
+    _, recovered_document, replayed = journal.recover(str(tmp_path))
+    assert replayed == 2 and len(recovered_document.records) == 2
+
+
+def test_checkpoint_captures_changes_records_cannot(tmp_path):
+    layers, document = _session()
+    session = journal.Journal(str(tmp_path))
+    session.start(layers, document)
+    records = _strokes(document, 4)
+    for record in records[:3]:
+        _draw(layers, document, record, session)
+    # Undo the last stroke and add a layer, which only a checkpoint records
+    before = layers.active.raster.to_array()
+    _draw(layers, document, records[3], session)
+    layers.active.raster.write_region(0, 0, before)
+    document.remove(records[3])
+    layers.add_layer('Ink')
+    session.checkpoint(layers, document)
+    ink = _strokes(document, 2, seed=1)
+    for record in ink:
+        _draw(layers, document, record, session)
+    session.close(discard_session=False)
+    assert session.checkpoints == 2
+
+    recovered, recovered_document, replayed = journal.recover(str(tmp_path))
+    assert replayed == 2 and len(recovered_document.records) == 5
+    assert [layer.name for layer in recovered.layers] == ['Background', 'Ink']
+    for layer, original in zip(recovered.layers, layers.layers):
+        assert np.array_equal(layer.raster.to_array(), original.raster.to_array())
+
+
+def test_clean_close_discards_the_session(tmp_path):
+    layers, document = _session()
+    session = journal.Journal(str(tmp_path))
+    session.start(layers, document)
+    _draw(layers, document, _strokes(document, 1)[0], session)
+    session.close()
+    assert not journal.has_session(str(tmp_path))
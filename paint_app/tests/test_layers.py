@@ -0,0 +1,96 @@
+import numpy as np
+
+from document import Document, RecordKind
+from layers import LayerStack, unpremultiply
+
+
+def test_add_remove_and_move_layers():
+    stack = LayerStack(64, 32)
+    ink = stack.add_layer('Ink')
+    notes = stack.add_layer('Notes')
+    assert [layer.name for layer in stack.layers] == ['Background', 'Ink', 'Notes']
+    assert stack.active is notes
+
+    stack.move_layer(2, 0)
+    assert [layer.name for layer in stack.layers] == ['Notes', 'Background', 'Ink']
+    assert stack.active is notes
+
+    stack.remove_layer()
+    assert stack.active is stack.layers[0] and len(stack.layers) == 2
+    stack.remove_layer(1)
+    assert stack.remove_layer() is None  # The last layer stays
+    assert stack.layers[0].name == 'Background' and ink not in stack.layers
+
+
+def test_new_layers_are_transparent():
+    stack = LayerStack(64, 32)
+    stack.add_layer()
+    assert np.array_equal(stack.flatten(), stack.layers[0].raster.to_array())
+
+
+def test_flatten_applies_opacity_and_visibility():
+    stack = LayerStack(64, 32)
+    top = stack.add_layer()
+    top.raster.write_region(0, 0, np.array([[[0, 0, 0, 255]] * 4] * 4, dtype=np.uint8))
+    top.opacity = 0.5
+
+    pixels = stack.flatten()
+    assert tuple(pixels[0, 0]) == (128, 128, 128, 255)
+    assert tuple(pixels[10, 10]) == (255, 255, 255, 255)
+
+    top.visible = False
+    assert tuple(stack.flatten()[0, 0]) == (255, 255, 255, 255)
+
+
+def test_flatten_region_matches_flatten():
+    stack = LayerStack(300, 280)
+    top = stack.add_layer()
+    top.raster.write_region(250, 200, np.full((60, 40, 4), 90, dtype=np.uint8))
+    top.opacity = 0.7
+    assert np.array_equal(stack.flatten_region(240, 190, 50, 80), stack.flatten()[190:270, 240:290])
+
+
+def test_unpremultiply_leaves_opaque_and_clear_pixels():
+    pixels = np.array([[[64, 0, 0, 128], [10, 20, 30, 255], [0, 0, 0, 0]]], dtype=np.uint8)
+    unpremultiply(pixels)
+    assert tuple(pixels[0, 0]) == (128, 0, 0, 128)
+    assert tuple(pixels[0, 1]) == (10, 20, 30, 255)
+
+
+def test_document_renders_each_layer_separately():
+    stack = LayerStack(40, 40)
+    top = stack.add_layer()
+    document = Document(40, 40)
+    document.add(document.fill(5, 5, (1, 0, 0, 1)))
+    line = document.shape(RecordKind.LINE, (0, 20, 40, 20), (0, 0, 1, 1), 2)
+    line.layer = top.id
+    document.add(line)
+
+    pixels = document.render(layers=stack.composite_order())
+    assert tuple(pixels[5, 5]) == (255, 0, 0, 255)     # Fill saw only the background layer
+    assert tuple(pixels[19, 5]) == (0, 0, 255, 255)
+
+    top.visible = False
+    assert tuple(document.render(layers=stack.composite_order())[19, 5]) == (255, 0, 0, 255)
+
+
+def test_eraser_on_an_upper_layer_shows_the_layer_below():
+    stack = LayerStack(40, 40)
+    top = stack.add_layer()
+    document = Document(40, 40)
+    document.add(document.fill(5, 5, (1, 0, 0, 1)))
+    band = document.shape(RecordKind.RECTANGLE, (10, 10, 20, 20), (0, 0, 1, 1), 10)
+    band.layer = top.id
+    document.add(band)
+    eraser = document.stroke(RecordKind.ERASER, [(0, 10), (40, 10)], (1, 1, 1, 1), 3)
+    eraser.layer = top.id
+    document.add(eraser)
+
+    pixels = document.render(layers=stack.composite_order())
+    assert tuple(pixels[30, 20]) == (255, 0, 0, 255)   # Erased from the blue band, red below shows through
+    assert tuple(pixels[10, 20]) == (0, 0, 255, 255)   # The rest of the band is untouched
+
+    # On the background layer the eraser still paints white
+    eraser.layer = stack.layers[0].id
+    document.remove(band)
+    assert tuple(document.render(layers=stack.composite_order())[30, 20]) == (255, 255, 255, 255)
@@ -0,0 +1,52 @@
+import numpy as np
+
+from mipmap import MipPyramid, downsample
+from raster_store import TileStore
+
+
+def test_downsample_averages_opaque_pixels():
+    pixels = np.zeros((2, 2, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    pixels[0, 0, 0] = 255
+    pixels[1, 1, 0] = 255
+    assert tuple(downsample(pixels)[0, 0]) == (128, 0, 0, 255)
+
+
+def test_downsample_ignores_color_of_transparent_pixels():
+    pixels = np.zeros((2, 2, 4), dtype=np.uint8)
+    pixels[0, 0] = (255, 0, 0, 255)  # The rest is transparent black
+    assert tuple(downsample(pixels)[0, 0]) == (255, 0, 0, 64)
+
+
+def test_downsample_keeps_odd_edges():
+    assert downsample(np.zeros((5, 3, 4), dtype=np.uint8)).shape == (3, 2, 4)
+
+
+def test_levels_shrink_to_one_tile():
+    raster = TileStore(1000, 600, tile_size=64)
+    pyramid = MipPyramid(raster)
+    assert pyramid.max_level == 4
+    assert pyramid.grid(0) == (10, 16) and pyramid.grid(4) == (1, 1)
+    assert pyramid.tile(4, 0, 0).shape == (38, 63, 4)
+
+
+def test_top_level_matches_direct_downsample():
+    rng = np.random.default_rng(5)
+    pixels = rng.integers(0, 256, (256, 256, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    raster = TileStore(256, 256, tile_size=64)
+    raster.load_array(pixels)
+    expected = downsample(downsample(pixels))
+    assert np.array_equal(MipPyramid(raster).tile(2, 0, 0), expected)
+
+
+def test_invalidate_rebuilds_only_tiles_above_the_region():
+    raster = TileStore(256, 256, tile_size=64)
+    pyramid = MipPyramid(raster)
+    pyramid.build()
+    old = {key: tile for key, tile in pyramid._tiles.items()}
+    raster.write_region(10, 10, np.zeros((4, 4, 4), dtype=np.uint8))
+    affected = pyramid.invalidate(10, 10, 4, 4)
+    assert affected == [(1, 0, 0), (2, 0, 0)]
+    assert pyramid.tile(1, 1, 1) is old[(1, 1, 1)]
+    assert pyramid.tile(2, 0, 0)[2, 2, 3] < 255
@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+
+from document import Document, ImageRecord, RecordKind
+from layers import Layer, LayerStack
+from project_file import ProjectFile, ProjectFormatError
+from raster_store import TileStore
+
+
+def make_project(width=1024, height=768):
+    raster = TileStore(width, height)
+    rng = np.random.default_rng(3)
+    raster.load_array(rng.integers(0, 256, (height, width, 4), dtype=np.uint8))
+    document = Document(width, height)
+    document.add(document.stroke(RecordKind.PENCIL, [(1, 2), (30, 40), (50, 20)], (1, 0, 0, 1), 2))
+    document.add(document.stroke(RecordKind.BRUSH, [(5, 5), (9, 9)], (0, 0, 1, 0.5), 8, square=True))
+    document.add(document.shape(RecordKind.CIRCLE, (100, 100, 40), (0, 1, 0, 1), 3))
+    document.add(document.fill(10, 10, (0, 0, 0, 1), 4))
+    return LayerStack(width, height, [Layer(0, 'Background', raster)]), document
+
+
+def test_round_trip_restores_tiles_and_records(tmp_path):
+    layers, document = make_project()
+    raster = layers.active.raster
+    path = str(tmp_path / 'art.paintproj')
+    ProjectFile(path).save(layers, document)
+
+    _, loaded_layers, loaded_document = ProjectFile.open(path)
+    loaded = loaded_layers.active.raster
+    assert np.array_equal(loaded.to_array(), raster.to_array())
+    assert loaded_document.colors == document.colors
+    assert loaded_document.widths == document.widths
+    assert [r.kind for r in loaded_document.records] == [r.kind for r in document.records]
+    brush = loaded_document.records[1]
+    assert brush.square and np.array_equal(brush.points, document.records[1].points)
+    fill = loaded_document.records[3]
+    assert (fill.x, fill.y, fill.tolerance) == (10, 10, 4)
+
+
+def test_open_decodes_tiles_only_when_read(tmp_path):
+    layers, document = make_project()
+    raster = layers.active.raster
+    path = str(tmp_path / 'art.paintproj')
+    ProjectFile(path).save(layers, document)
+
+    _, loaded_layers, _ = ProjectFile.open(path)
+    loaded = loaded_layers.active.raster
+    assert loaded.mapped_tiles == 12
+    loaded.read_region(0, 0, 100, 100)
+    assert loaded.mapped_tiles == 11
+
+
+def test_save_rewrites_only_changed_chunks(tmp_path):
+    layers, document = make_project()
+    raster = layers.active.raster
+    path = str(tmp_path / 'art.paintproj')
+    project = ProjectFile(path)
+    first = project.save(layers, document)
+    assert first['written'] == 12 + 1
+
+    raster.write_region(300, 300, np.zeros((10, 10, 4), dtype=np.uint8))
+    second = project.save(layers, document)
+    assert second['written'] == 1 and second['reused'] == 12
+
+    _, loaded_layers, _ = ProjectFile.open(path)
+    loaded = loaded_layers.active.raster
+    assert np.array_equal(loaded.to_array(), raster.to_array())
+
+
+def test_incremental_save_after_open(tmp_path):
+    layers, document = make_project()
+    raster = layers.active.raster
+    path = str(tmp_path / 'art.paintproj')
+    ProjectFile(path).save(layers, document)
+
+    project, loaded_layers, loaded_document = ProjectFile.open(path)
+    loaded = loaded_layers.active.raster
+    loaded_document.add(loaded_document.shape(RecordKind.LINE, (0, 0, 10, 10), (0, 0, 0, 1), 2))
+    stats = project.save(loaded_layers, loaded_document)
+    assert stats['written'] == 1  # Only the record chunk
+    assert loaded.mapped_tiles == 12  # Unchanged tiles were never decoded
+
+    _, reloaded_layers, reloaded_document = ProjectFile.open(path)
+    reloaded = reloaded_layers.active.raster
+    assert len(reloaded_document.records) == 5
+    assert np.array_equal(reloaded.to_array(), raster.to_array())
+
+
+def test_image_records_are_saved_once_as_tile_references(tmp_path):
+    rng = np.random.default_rng(5)
+    pixels = rng.integers(0, 256, (300, 512, 4), dtype=np.uint8)
+    raster = TileStore(512, 300)
+    raster.load_array(pixels)
+    layers = LayerStack(512, 300, [Layer(0, 'Background', raster)])
+    document = Document(512, 300)
+    document.add(ImageRecord(pixels))
+    path = str(tmp_path / 'art.paintproj')
+    project = ProjectFile(path)
+    # 4 layer tiles, the 2 partial image tiles along the bottom (the full ones share the layer's), 1 record chunk
+    assert project.save(layers, document)['written'] == 4 + 2 + 1
+
+    raster.write_region(0, 0, np.zeros((10, 10, 4), dtype=np.uint8))
+    document.add(document.stroke(RecordKind.PENCIL, [(1, 2), (30, 40)], (1, 0, 0, 1), 2))
+    assert project.save(layers, document)['written'] == 1 + 1  # The changed tile and the record chunk
+
+    _, _, loaded_document = ProjectFile.open(path)
+    image = loaded_document.records[0]
+    assert np.array_equal(image.pixels, pixels)
+    assert image.digests == document.records[0].digests
+
+
+def test_layers_round_trip(tmp_path):
+    layers, document = make_project(300, 200)
+    top = layers.add_layer('Ink')
+    top.raster.write_region(10, 10, np.full((5, 5, 4), 200, dtype=np.uint8))
+    top.opacity = 0.5
+    layers.layers[0].visible = False
+    record = document.shape(RecordKind.LINE, (0, 0, 10, 10), (0, 0, 0, 1), 2)
+    record.layer = top.id
+    document.add(record)
+    path = str(tmp_path / 'art.paintproj')
+    ProjectFile(path).save(layers, document)
+
+    _, loaded, loaded_document = ProjectFile.open(path)
+    assert [layer.name for layer in loaded.layers] == ['Background', 'Ink']
+    assert loaded.active_index == 1 and loaded.active.opacity == 0.5
+    assert not loaded.layers[0].visible
+    assert np.array_equal(loaded.active.raster.to_array(), top.raster.to_array())
+    assert loaded_document.records[-1].layer == top.id
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'not.paintproj'
+    path.write_bytes(b'\x89PNG' + bytes(64))
+    with pytest.raises(ProjectFormatError):
+        ProjectFile.open(str(path))
+
+
+def test_meta_round_trips(tmp_path):
+    layers, document = make_project(64, 64)
+    path = str(tmp_path / 'art.paintproj')
+    project = ProjectFile(path)
+    project.meta = {'journal_seq': 42}
+    project.save(layers, document)
+    assert ProjectFile.open(path)[0].meta == {'journal_seq': 42}
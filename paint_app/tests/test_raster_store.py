@@ -0,0 +1,53 @@
+import numpy as np
+
+from raster_store import TileStore, RegionDelta
+
+
+def test_regions_span_tiles():
+    store = TileStore(300, 200, tile_size=64)
+    patch = np.arange(50 * 90 * 4, dtype=np.uint32).astype(np.uint8).reshape(50, 90, 4)
+    store.write_region(40, 30, patch)
+    assert np.array_equal(store.read_region(40, 30, 90, 50), patch)
+    full = store.to_array()
+    assert full.shape == (200, 300, 4)
+    assert (full[:30] == 255).all() and (full[80:] == 255).all()
+    assert len(store.tiles) == 6
+
+
+def test_resize_blanks_cropped_pixels():
+    store = TileStore(100, 100, tile_size=64)
+    store.write_region(0, 0, np.zeros((100, 100, 4), dtype=np.uint8))
+    store.resize(50, 50)
+    store.resize(100, 100)
+    full = store.to_array()
+    assert (full[:50, :50] == 0).all()
+    assert (full[50:] == 255).all() and (full[:, 50:] == 255).all()
+
+
+def test_region_delta_round_trip():
+    store = TileStore(64, 64)
+    old = store.read_region(10, 10, 20, 5)
+    new = np.zeros_like(old)
+    delta = RegionDelta((10, 10, 20, 5), old, new)
+
+    class Target:
+        def write_pixels(self, x, y, data):
+            store.write_region(x, y, data)
+
+    delta.apply(Target())
+    assert (store.read_region(10, 10, 20, 5) == 0).all()
+    delta.revert(Target())
+    assert (store.to_array() == 255).all()
+
+
+def test_load_store_takes_over_tiles():
+    source = TileStore(100, 70, tile_size=32)
+    source.write_region(10, 10, np.zeros((5, 5, 4), dtype=np.uint8))
+    store = TileStore(300, 200, tile_size=32)
+    store.write_region(0, 0, np.zeros((200, 300, 4), dtype=np.uint8))
+    revision = store.revision
+    store.load_store(source)
+    assert store.shape == (70, 100, 4)
+    assert np.array_equal(store.to_array(), source.to_array())
+    assert store.tile_keys() == source.tile_keys()
+    assert all(store.tile_revisions[key] > revision for key in store.tile_keys())
@@ -0,0 +1,52 @@
+import numpy as np
+
+import rasterizer
+
+
+def ink(pixels):
+    """Mask of pixels that are no longer white"""
+    return np.any(pixels[..., :3] < 255, axis=-1)
+
+
+def test_pencil_line_thickness_and_orientation():
+    pixels = rasterizer.new_canvas(100, 50)
+    # Horizontal stroke 10 px above the bottom edge, width 2 -> 4 px thick
+    rasterizer.draw_pencil(pixels, [20, 10, 80, 10], (0, 0, 0, 1), 2)
+    rows = np.flatnonzero(ink(pixels).any(axis=1))
+    assert rows.tolist() == [38, 39, 40, 41]
+    assert tuple(pixels[40, 50]) == (0, 0, 0, 255)
+
+
+def test_eraser_paints_white_over_strokes():
+    pixels = rasterizer.new_canvas(100, 50)
+    rasterizer.draw_pencil(pixels, [20, 25, 80, 25], (1, 0, 0, 1), 2)
+    rasterizer.draw_eraser(pixels, [0, 25, 100, 25], 2)
+    assert not ink(pixels).any()
+
+
+def test_rectangle_and_circle_outlines_leave_interior_untouched():
+    pixels = rasterizer.new_canvas(100, 100)
+    rasterizer.draw_rectangle(pixels, (10, 10, 80, 80), (0, 0, 1, 1), 2)
+    assert ink(pixels)[90, 50] and ink(pixels)[50, 10] and not ink(pixels)[50, 50]
+
+    pixels = rasterizer.new_canvas(100, 100)
+    rasterizer.draw_circle(pixels, (50, 50, 30), (0, 0, 1, 1), 2)
+    assert ink(pixels)[50, 20] and ink(pixels)[20, 50] and not ink(pixels)[50, 50]
+
+
+def test_translucent_brush_builds_up_where_dabs_overlap():
+    pixels = rasterizer.new_canvas(60, 30)
+    rasterizer.draw_brush(pixels, [(20, 15), (24, 15)], (0, 0, 0, 0.5), 6)
+    single, overlap = pixels[15, 14, 0], pixels[15, 22, 0]
+    assert overlap < single < 255
+
+
+def test_fill_matches_fill_tool_inside_rectangle():
+    pixels = rasterizer.new_canvas(100, 100)
+    rasterizer.draw_rectangle(pixels, (10, 10, 80, 80), (0, 0, 0, 1), 2)
+    spans = rasterizer.fill(pixels, 50, 50, (0, 1, 0, 1))
+    assert spans
+    assert tuple(pixels[50, 50]) == (0, 255, 0, 255)
+    assert tuple(pixels[2, 2]) == (255, 255, 255, 255)
+    # Filling again with the same color is a no-op
+    assert rasterizer.fill(pixels, 50, 50, (0, 1, 0, 1)) == []
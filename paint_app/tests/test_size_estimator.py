@@ -0,0 +1,85 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from size_estimator import SizeEstimator, sample_rows
+
+
+def _pixels(width, height):
+    rng = np.random.default_rng(0)
+    pixels = np.full((height, width, 4), 255, dtype=np.uint8)
+    pixels[..., 0] = np.linspace(0, 255, width, dtype=np.uint8)[None, :]
+    pixels[..., 1] = np.linspace(255, 0, height, dtype=np.uint8)[:, None]
+    # Blocks of noise over the gradient, as strokes would add
+    for _ in range(30):
+        x, y = rng.integers(0, width - 40), rng.integers(0, height - 40)
+        pixels[y:y + 40, x:x + 40, :3] = rng.integers(0, 256, (40, 40, 3), dtype=np.uint8)
+    return pixels
+
+
+class Reader:
+    """read_region over an array, counting the calls"""
+
+    def __init__(self, pixels):
+        self.pixels = pixels
+        self.calls = 0
+
+    def __call__(self, x, y, w, h):
+        self.calls += 1
+        return self.pixels[y:y + h, x:x + w].copy()
+
+
+def test_sample_rows_spread_over_the_canvas():
+    assert sample_rows(100, 100) == [0]
+    rows = sample_rows(4000, 3000)
+    assert len(rows) >= 4 and rows == sorted(rows)
+    assert rows[0] < 3000 / len(rows) and rows[-1] + 16 <= 3000
+
+
+def test_estimates_are_close_to_real_sizes():
+    pixels = _pixels(1600, 1200)
+    estimator = SizeEstimator()
+    reader = Reader(pixels)
+    for format, params in (('PNG', {}), ('JPEG', {'quality': 80})):
+        buffer = io.BytesIO()
+        image = Image.fromarray(pixels[..., :3] if format == 'JPEG' else pixels)
+        image.save(buffer, format, optimize=True, **params)
+        estimate = estimator.estimate(1, 1600, 1200, reader, format, quality=80)
+        assert abs(estimate - buffer.tell()) / buffer.tell() < 0.15, format
+    assert estimator.estimate(1, 1600, 1200, reader, 'BMP') == 54 + 1600 * 3 * 1200
+
+
+def test_estimates_are_cached_by_version():
+    reader = Reader(_pixels(1600, 1200))
+    estimator = SizeEstimator()
+    first = estimator.estimate(1, 1600, 1200, reader, 'JPEG', quality=50)
+    reads = reader.calls
+    assert estimator.estimate(1, 1600, 1200, reader, 'JPEG', quality=50) == first
+    assert estimator.estimate(1, 1600, 1200, reader, 'JPEG', quality=95) > first
+    assert reader.calls == reads  # A new quality re-encodes the samples it already has
+    assert estimator.stats()['hits'] == 1
+
+    estimator.estimate(2, 1600, 1200, reader, 'JPEG', quality=50)
+    assert reader.calls == reads * 2
+
+
+def test_estimate_later_encodes_on_a_worker_and_caches():
+    reader = Reader(_pixels(1600, 1200))
+    estimator = SizeEstimator()
+    done = threading.Event()
+    sizes = []
+
+    def ready(size):
+        sizes.append((threading.current_thread(), size))
+        done.set()
+
+    assert estimator.estimate_later(1, 1600, 1200, reader, ready, 'PNG') is None
+    assert done.wait(10)
+    worker, size = sizes[0]
+    assert worker is not threading.current_thread()
+    assert size == SizeEstimator().estimate(1, 1600, 1200, reader, 'PNG')
+    # Now cached, so answered straight away without the worker
+    assert estimator.estimate_later(1, 1600, 1200, reader, ready, 'PNG') == size
+    assert len(sizes) == 1
@@ -0,0 +1,45 @@
+import contextlib
+
+import numpy as np
+
+from modules.stroke_buffer import StrokeBuffer
+
+
+class RecordingLine:
+    """Stands in for kivy's Line, which needs a GL context to tessellate"""
+
+    def __init__(self, width):
+        self.width = width
+        self.points = []
+
+
+def draw_stroke(monkeypatch, raw, chunk_points):
+    monkeypatch.setattr('modules.stroke_buffer.Line', RecordingLine)
+    buffer = StrokeBuffer(contextlib.nullcontext(), 2, chunk_points=chunk_points)
+    for x, y in raw:
+        buffer.append(x, y)
+    return buffer
+
+
+def test_finished_chunks_hold_only_stored_points(monkeypatch):
+    t = np.linspace(0, 2 * np.pi, 3000)
+    raw = np.column_stack([400 + 200 * np.cos(t), 300 + 150 * np.sin(2 * t)])
+
+    buffer = draw_stroke(monkeypatch, raw, chunk_points=16)
+
+    assert len(buffer.lines) > 2
+    stored = {tuple(point) for point in buffer.points.tolist()}
+    for line in buffer.lines[:-1]:
+        assert all(point in stored for point in zip(line.points[::2], line.points[1::2]))
+
+
+def test_chunks_share_exactly_one_point(monkeypatch):
+    monkeypatch.setattr('modules.stroke_buffer.Line', RecordingLine)
+    buffer = StrokeBuffer(contextlib.nullcontext(), 2, chunk_points=16, smooth=False)
+    for i in range(100):
+        buffer.append(float(i), 0.0)
+
+    drawn = [line.points for line in buffer.lines]
+    assert sum(len(points) // 2 for points in drawn) == buffer.count + len(drawn) - 1
+    for before, after in zip(drawn, drawn[1:]):
+        assert before[-2:] == after[:2]
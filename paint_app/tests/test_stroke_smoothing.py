@@ -0,0 +1,44 @@
+import numpy as np
+
+from modules.stroke_smoothing import StrokeSmoother, rdp_mask
+
+
+def smooth_stroke(raw):
+    smoother = StrokeSmoother()
+    out = [smoother.add(x, y)[0] for x, y in raw]
+    out.append(smoother.finish())
+    return np.concatenate(out)
+
+
+def distance_to_polyline(point, polyline):
+    start, end = polyline[:-1], polyline[1:]
+    seg = end - start
+    length = np.maximum((seg ** 2).sum(axis=1), 1e-12)
+    t = np.clip(((point - start) * seg).sum(axis=1) / length, 0, 1)
+    nearest = start + t[:, None] * seg
+    return np.hypot(*(point - nearest).T).min()
+
+
+def test_rdp_drops_collinear_points():
+    points = np.column_stack([np.arange(10.0), np.zeros(10)])
+    assert rdp_mask(points, 0.5).nonzero()[0].tolist() == [0, 9]
+
+
+def test_noisy_stroke_is_decimated_and_stays_close():
+    rng = np.random.default_rng(0)
+    t = np.linspace(0, 2 * np.pi, 2000)
+    raw = np.column_stack([400 + 200 * np.cos(t), 300 + 150 * np.sin(2 * t)])
+    raw += rng.normal(0, 0.3, raw.shape)
+
+    points = smooth_stroke(raw)
+
+    assert len(points) * 3 < len(raw)
+    np.testing.assert_allclose(points[0], raw[0], atol=1e-3)
+    assert max(distance_to_polyline(p, points) for p in raw) < 2.0
+
+
+def test_tail_reaches_latest_sample():
+    smoother = StrokeSmoother()
+    for x in range(0, 50, 5):
+        final, tail = smoother.add(float(x), 10.0)
+    np.testing.assert_allclose(tail[-1], (45.0, 10.0))
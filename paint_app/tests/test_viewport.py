@@ -0,0 +1,52 @@
+import pytest
+
+from viewport import Viewport
+
+
+def test_mapping_round_trips():
+    view = Viewport(scale=0.5, offset=(30, 20))
+    assert view.to_image(30, 20) == (0, 0)
+    assert view.to_image(80, 70) == (100, 100)
+    assert view.to_widget(*view.to_image(123, 45)) == pytest.approx((123, 45))
+
+
+def test_zoom_keeps_point_under_cursor():
+    view = Viewport()
+    before = view.to_image(200, 150)
+    view.zoom_about(2, 200, 150)
+    assert view.scale == 2
+    assert view.to_image(200, 150) == pytest.approx(before)
+
+
+def test_fit_centres_and_never_enlarges():
+    view = Viewport()
+    view.fit(16384, 16384, 1200, 800)
+    assert view.scale == pytest.approx(800 / 16384)
+    assert view.to_widget(8192, 8192) == pytest.approx((600, 400))
+    view.fit(100, 50, 1200, 800)
+    assert view.scale == 1
+
+
+@pytest.mark.parametrize('scale, level', [(2, 0), (1, 0), (0.75, 0), (0.5, 1), (0.3, 1), (0.25, 2), (1 / 64, 5)])
+def test_level_matches_scale(scale, level):
+    assert Viewport(scale=scale).level(max_level=5) == level
+
+
+def test_visible_tiles_cover_only_the_view():
+    view = Viewport()
+    # 1000x800 image, 300x200 view at the bottom-left corner: image rows 600-800
+    assert view.visible_tiles(1000, 800, 300, 200, 256) == [(2, 0), (2, 1), (3, 0), (3, 1)]
+    assert view.visible_region(1000, 800, 300, 200) == (0, 600, 300, 800)
+    view.pan(-600, 0)  # Now image columns 600-900
+    assert view.visible_tiles(1000, 800, 300, 200, 256) == [(2, 2), (2, 3), (3, 2), (3, 3)]
+    view.pan(-2000, 0)
+    assert view.visible_tiles(1000, 800, 300, 200, 256) == []
+    assert view.visible_region(1000, 800, 300, 200) is None
+
+
+def test_zoomed_out_view_uses_few_large_tiles():
+    view = Viewport()
+    view.fit(16384, 16384, 1200, 800)
+    level = view.level(max_level=6)
+    tiles = view.visible_tiles(16384, 16384, 1200, 800, 256, level)
+    assert level == 4 and len(tiles) == 16